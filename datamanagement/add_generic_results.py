@@ -6,6 +6,7 @@ from __future__ import print_function
 import logging
 import os
 import sys
+import time
 import click
 import json
 import ast
@@ -20,6 +21,100 @@ import datamanagement.transfer_files as transfer_files
 
 logging.basicConfig(format=LOGGING_FORMAT, stream=sys.stderr, level=logging.INFO)
 
+# Number of files registered per add_files call when recursing a directory
+RECURSIVE_BATCH_SIZE = 1000
+
+
+def _iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_checkpoint(checkpoint_filename):
+    """ Read filenames and file resource ids registered in a previous run.
+    """
+    registered = {}
+
+    if checkpoint_filename is None or not os.path.exists(checkpoint_filename):
+        return registered
+
+    with open(checkpoint_filename) as f:
+        for line in f:
+            filename, file_resource_id = line.rstrip('\n').split('\t')
+            registered[filename] = int(file_resource_id)
+
+    logging.info("Resuming from checkpoint {} with {} registered files".format(
+        checkpoint_filename, len(registered)))
+
+    return registered
+
+
+def add_directory_files(
+        tantalus_api, storage_name, filepath, update=False,
+        registered=(), checkpoint_filename=None, batch_size=RECURSIVE_BATCH_SIZE):
+    """ Stream the files in a directory into tantalus in concurrent batches.
+
+    Args:
+        tantalus_api (TantalusApi): tantalus api client
+        storage_name (str): storage containing the directory
+        filepath (str): full path of the directory
+
+    KwArgs:
+        update (bool): update files that exist with different size
+        registered (collection): listed names already registered, to be skipped
+        checkpoint_filename (str): file to which registered files are appended
+        batch_size (int): number of files registered per batch
+
+    Yields:
+        file resource ids of newly registered files
+
+    Only a single batch of filenames is held in memory.
+    """
+    storage_client = tantalus_api.get_storage_client(storage_name)
+    storage_prefix = tantalus_api.get_storage(storage_name)['prefix']
+
+    filename_prefix = tantalus_api.get_file_resource_filename(storage_name, filepath)
+
+    checkpoint = None
+    if checkpoint_filename is not None:
+        checkpoint = open(checkpoint_filename, 'a')
+
+    num_added = 0
+    start_time = time.time()
+
+    try:
+        listing = (a for a in storage_client.list(filename_prefix) if a not in registered)
+
+        for batch in _iter_batches(listing, batch_size):
+            # Server storages list absolute paths, blob storages list blob names
+            add_filepaths = [a if os.path.isabs(a) else os.path.join(storage_prefix, a) for a in batch]
+
+            added_files = tantalus_api.add_files(storage_name, add_filepaths, update=update)
+
+            for name, add_filepath in zip(batch, add_filepaths):
+                file_resource_id = added_files[add_filepath][0]['id']
+                if checkpoint is not None:
+                    checkpoint.write('{}\t{}\n'.format(name, file_resource_id))
+                yield file_resource_id
+
+            if checkpoint is not None:
+                checkpoint.flush()
+
+            num_added += len(batch)
+            elapsed = time.time() - start_time
+            logging.info("Added {} files from {} in {:.0f}s ({:.1f} files/s)".format(
+                num_added, filepath, elapsed, num_added / max(elapsed, 1e-6)))
+
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
 
 @click.command()
 @click.argument('filepaths', nargs=-1)
@@ -34,26 +129,29 @@ logging.basicConfig(format=LOGGING_FORMAT, stream=sys.stderr, level=logging.INFO
 @click.option('--recursive', is_flag=True)
 @click.option('--update', is_flag=True)
 @click.option('--remote_storage_name')
+@click.option('--checkpoint_filename', help='file recording registered files, for resuming a recursive add')
 def add_generic_results_cmd(
         filepaths, storage_name, results_name, results_type, results_version,
         sample_ids=(), library_ids=(), analysis_pk=None, recursive=False,
-        tag_name=None, update=False, remote_storage_name=None):
+        tag_name=None, update=False, remote_storage_name=None,
+        checkpoint_filename=None):
 
     return add_generic_results(
         filepaths, storage_name, results_name, results_type, results_version,
         sample_ids=sample_ids, library_ids=library_ids, analysis_pk=analysis_pk,
         recursive=recursive, tag_name=tag_name, update=update,
         remote_storage_name=remote_storage_name,
+        checkpoint_filename=checkpoint_filename,
     )
 
 
 def add_generic_results(
         filepaths, storage_name, results_name, results_type, results_version,
         sample_ids=(), library_ids=(), analysis_pk=None, recursive=False,
-        tag_name=None, update=False, remote_storage_name=None):
+        tag_name=None, update=False, remote_storage_name=None,
+        checkpoint_filename=None):
 
     tantalus_api = TantalusApi()
-    storage_client = tantalus_api.get_storage_client(storage_name)
 
     sample_pks = []
     for sample_id in sample_ids:
@@ -73,24 +171,25 @@ def add_generic_results(
 
     #Add the file resource to tantalus
     file_resource_pks = []
-    for filepath in filepaths:
-        if recursive:
+    if recursive:
+        registered = read_checkpoint(checkpoint_filename)
+        file_resource_pks.extend(registered.values())
+
+        for filepath in filepaths:
             logging.info("Recursing directory {}".format(filepath))
-            filename_prefix = tantalus_api.get_file_resource_filename(storage_name, filepath)
-            add_filepaths = []
-            for filename in storage_client.list(filename_prefix):
-                add_filepaths.append(tantalus_api.get_filepath(storage_name, filename))
-
-        else:
-            add_filepaths = [filepath]
-
-        for add_filepath in add_filepaths:
-            logging.info("Adding file resource for {} to Tantalus".format(add_filepath))
-            resource, instance = tantalus_api.add_file(
-                storage_name=storage_name,
-                filepath=add_filepath,
-                update=update,
-            )
+            file_resource_pks.extend(add_directory_files(
+                tantalus_api, storage_name, filepath, update=update,
+                registered=registered, checkpoint_filename=checkpoint_filename,
+            ))
+
+    else:
+        logging.info("Adding {} file resources to Tantalus".format(len(filepaths)))
+        added_files = tantalus_api.add_files(
+            storage_name,
+            filepaths,
+            update=update,
+        )
+        for resource, instance in added_files.values():
             file_resource_pks.append(resource["id"])
 
     results_dataset_fields = dict(
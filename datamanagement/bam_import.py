@@ -3,13 +3,13 @@ import os
 import time
 import azure.storage.blob
 import pandas as pd
-import pysam
 import re
 import logging
 import sys
 
 from datamanagement.utils.constants import REF_GENOME_REGEX_MAP, SEQUENCING_CENTRE_MAP
 from datamanagement.utils.utils import get_lanes_hash, get_lane_str
+from datamanagement.utils.bam_header import inspect_bams
 import datamanagement.templates as templates
 from dbclients.tantalus import TantalusApi
 import click
@@ -310,7 +310,8 @@ def import_bam(
     read_type=None,
     ref_genome=None,
     tag_name=None,
-    update=False):
+    update=False,
+    bam_info=None):
     """
     Imports bam into tantalus
 
@@ -325,18 +326,22 @@ def import_bam(
         read_type:      (string) read type for the run
         tag_name:       (string)
         update:         (boolean)
+        bam_info:       (dict) header and index info from inspect_bams,
+                        read from the bam if not given
     Returns:
         sequence_dataset:   (dict) sequence dataset created on tantalus
     """ 
     tantalus_api = TantalusApi()
 
-    # Get a url allowing access regardless of whether the file
-    # is in cloud or local storage
+    # Read the header and check for an index regardless of whether
+    # the file is in cloud or local storage
     storage_client = tantalus_api.get_storage_client(storage_name)
     bam_filename = tantalus_api.get_file_resource_filename(storage_name, bam_file_path)
-    bam_url = storage_client.get_url(bam_filename)
 
-    bam_header = pysam.AlignmentFile(bam_url).header
+    if bam_info is None:
+        bam_info = inspect_bams(storage_client, [bam_filename])[bam_filename]
+
+    bam_header = bam_info["header"]
     bam_header_info = get_bam_header_info(bam_header)
 
     if ref_genome is None:
@@ -347,7 +352,7 @@ def import_bam(
     logging.info(f"bam header shows reference genome {ref_genome} and aligner {aligner_name}")
 
     bai_file_path = None
-    if storage_client.exists(bam_filename + ".bai"):
+    if bam_info["has_index"]:
         bai_file_path = bam_file_path + ".bai"
     else:
         logging.info(f"no bam index found at {bam_filename + '.bai'}")
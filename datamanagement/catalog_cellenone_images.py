@@ -10,7 +10,9 @@ import yaml
 import pandas as pd
 import PIL.Image
 import tempfile
-import codecs
+import fnmatch
+import functools
+import concurrent.futures
 
 from dbclients.basicclient import NotFoundError
 from dbclients.tantalus import TantalusApi
@@ -19,112 +21,131 @@ from datamanagement.add_generic_results import add_generic_results
 from utils.constants import LOGGING_FORMAT
 
 
-def clean_filename(filename):
+def clean_filenames(filenames):
+    """ Clean the hyperlink tag from a series of filenames.
+    """
     prefix = '=HYPERLINK("'
     suffix = '")'
 
-    if not filename.startswith(prefix) or not filename.endswith(suffix):
-        raise ValueError(f'unknown format for filename {filename}')
-
-    filename = filename[len(prefix):-len(suffix)]
+    malformed = ~(filenames.str.startswith(prefix) & filenames.str.endswith(suffix))
+    if malformed.any():
+        raise ValueError(f'unknown format for filename {filenames[malformed].iloc[0]}')
 
-    return filename
+    return filenames.str[len(prefix):-len(suffix)]
 
 
 cell_filename_template = '{library_id}_R{row:02d}_C{column:02d}.png'
 background_filename_template = 'background_{idx}{extension}'
 
-def generate_new_filename(row):
-    library_id = row['library_id']
-    chip_row = row['chip_row']
-    chip_column = row['chip_column']
-
-    new_filename = cell_filename_template.format(
-        library_id=library_id, row=chip_row, column=chip_column)
-
-    return new_filename
+def generate_new_filenames(catalog):
+    """ Generate cell image filenames for a catalog.
+    """
+    return pd.Series([
+        cell_filename_template.format(library_id=library_id, row=int(chip_row), column=int(chip_column))
+        for library_id, chip_row, chip_column in zip(
+            catalog['library_id'], catalog['chip_row'], catalog['chip_column'])
+    ], index=catalog.index, dtype=object)
 
 
 def read_log_filename(log_filename):
-    for line in codecs.open(log_filename, 'r', encoding='utf-8', errors='ignore'):
-        pattern = 'Ejection zone bondary:\s+(\d+)\s+Sedimentation zone bondary:\s+(\d+)'
-        result = re.match(pattern, str(line))
-        if not result:
-            continue
-        ejection = int(result.group(1))
-        sedimention = int(result.group(2))
-        return {'ejection_zone_boundary': ejection, 'sedimentation_zone_boundary': sedimention}
+    pattern = re.compile(r'Ejection zone bondary:\s+(\d+)\s+Sedimentation zone bondary:\s+(\d+)')
+    with open(log_filename, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            result = pattern.match(line)
+            if not result:
+                continue
+            ejection = int(result.group(1))
+            sedimention = int(result.group(2))
+            return {'ejection_zone_boundary': ejection, 'sedimentation_zone_boundary': sedimention}
     raise ValueError(f'unable to parse log {log_filename}')
 
 
-def read_cellenone_isolated_files(source_dir):
-    """Read the isolated.xls files in a cellenone directory.
-    
-    Args:
-        source_dir (str): Path to the cellenone output
+def _list_run_directory(run_directory, run_listings):
+    if run_directory not in run_listings:
+        # Hidden files are excluded to match glob
+        run_listings[run_directory] = tuple(sorted(a for a in os.listdir(run_directory) if not a.startswith('.')))
+    return run_listings[run_directory]
+
+
+def _read_isolated_file(isolated_filename, run_listings, run_parameters):
+    """Read a single isolated.xls file and the files of its run.
+
+    Run directory listings and log parameters are shared through the
+    run_listings and run_parameters dicts by isolated files of the same run.
     """
-    logging.info(f'processing directory {source_dir}')
+    logging.info(f'processing {isolated_filename}')
 
-    isolated_filenames = glob.glob(os.path.join(source_dir, '*', '*__isolated.xls'))
+    data = pd.read_csv(isolated_filename, sep='\t')
 
-    catalog = []
+    data = data.dropna(subset=['XPos', 'YPos', 'X', 'Y', 'ImageFile'])
 
-    for isolated_filename in isolated_filenames:
-        logging.info(f'processing {isolated_filename}')
+    if data.empty:
+        logging.info(f'no useful data in {isolated_filename}')
+        return None
 
-        data = pd.read_csv(isolated_filename, sep='\t')
+    # Clean spaces from column names
+    data.columns = [a.strip() for a in data.columns]
 
-        data = data.dropna(subset=['XPos', 'YPos', 'X', 'Y', 'ImageFile'])
+    run_directory = os.path.dirname(isolated_filename)
+    run_filenames = _list_run_directory(run_directory, run_listings)
 
-        if data.empty:
-            logging.info(f'no useful data in {isolated_filename}')
-            continue
+    # Images subdirectory for the run given by this isolated.xls
+    images_dir = os.path.basename(run_directory)
 
-        # Clean spaces from column names
-        data.columns = [a.strip() for a in data.columns]
+    # Clean hyperlink tag from original filename, relative to root cellenone directory
+    data['original_filename'] = images_dir + '/' + clean_filenames(data['ImageFile'])
 
-        # Images subdirectory for the run given by this isolated.xls
-        images_dir = os.path.basename(os.path.dirname(isolated_filename))
+    # Chip row and column as YPos and XPos
+    data['chip_row'] = data['YPos']
+    data['chip_column'] = data['XPos']
 
-        # Clean hyperlink tag from original filename
-        data['original_filename'] = data['ImageFile'].apply(clean_filename)
+    # Assume a single _Background.(tiff|png) exists along side __isolated.xls
+    background_filename_prefix = os.path.basename(isolated_filename).split('.')[0]
+    background_filename_glob = background_filename_prefix + '*Background*'
+    background_filenames = fnmatch.filter(run_filenames, background_filename_glob)
+    if len(background_filenames) != 1:
+        raise ValueError(f'found background files {background_filenames} along side {isolated_filename}, matching {background_filename_glob}')
+    background_filename = background_filenames[0]
+    background_extension = '.' + background_filename.split('.')[-1]
+    if background_extension not in ('.tiff', '.png'):
+        raise ValueError(f'found background file with unexpected extension {background_extension}')
 
-        # Original filename relative to root cellenone directory
-        data['original_filename'] = [os.path.join(images_dir, a) for a in data['original_filename']]
+    # Original background filename relative to root cellenone directory
+    data['original_background_filename'] = os.path.join(images_dir, background_filename)
+    data['original_background_extension'] = background_extension
 
-        # Chip row and column as YPos and XPos
-        data['chip_row'] = data['YPos']
-        data['chip_column'] = data['XPos']
+    # Read additional run parameters out of the log file
+    log_filenames = fnmatch.filter(run_filenames, '*_Logfile.log')
+    if len(log_filenames) != 1:
+        raise ValueError(f'found {len(log_filenames)} log files')
+    log_filename = os.path.join(run_directory, log_filenames[0])
 
-        # Assume a single _Background.(tiff|png) exists along side __isolated.xls
-        background_filename_prefix = os.path.basename(isolated_filename).split('.')[0]
-        background_filename_dirname = os.path.dirname(isolated_filename)
-        background_filename_glob = os.path.join(background_filename_dirname, background_filename_prefix + '*Background*')
-        background_filenames = glob.glob(background_filename_glob)
-        if len(background_filenames) != 1:
-            raise ValueError(f'found background files {background_filenames} along side {isolated_filename}, matching {background_filename_glob}')
-        background_filename = background_filenames[0]
-        background_extension = '.' + background_filename.split('.')[-1]
-        if background_extension not in ('.tiff', '.png'):
-            raise ValueError(f'found background file with unexpected extension {background_extension}')
+    if log_filename not in run_parameters:
+        run_parameters[log_filename] = read_log_filename(log_filename)
 
-        # Original background filename relative to root cellenone directory
-        data['original_background_filename'] = os.path.join(images_dir, os.path.basename(background_filename))
-        data['original_background_extension'] = background_extension
+    data = data.assign(**run_parameters[log_filename])
 
-        # Read additional run parameters out of the log file
-        run_directory = os.path.dirname(isolated_filename)
-        log_filenames = glob.glob(os.path.join(run_directory, '*_Logfile.log'))
-        if len(log_filenames) != 1:
-            raise ValueError(f'found {len(log_filenames)} log files')
-        log_filename = log_filenames[0]
+    return data
 
-        log_info = read_log_filename(log_filename)
 
-        for name, value in log_info.items():
-            data[name] = value
+def read_cellenone_isolated_files(source_dir, num_workers=8):
+    """Read the isolated.xls files in a cellenone directory.
+    
+    Args:
+        source_dir (str): Path to the cellenone output
 
-        catalog.append(data)
+    KwArgs:
+        num_workers (int): number of isolated.xls files read concurrently
+    """
+    logging.info(f'processing directory {source_dir}')
+
+    isolated_filenames = sorted(glob.glob(os.path.join(source_dir, '*', '*__isolated.xls')))
+
+    # Listings and log parameters of run directories, cached for this call only
+    read_isolated_file = functools.partial(_read_isolated_file, run_listings={}, run_parameters={})
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        catalog = [a for a in executor.map(read_isolated_file, isolated_filenames) if a is not None]
 
     if len(catalog) == 0:
         return pd.DataFrame()
@@ -186,7 +207,58 @@ def _copy_if_different(source_filepath, destination_filepath):
         logging.info(f'skipping copy of {source_filepath} to {destination_filepath} with same size')
 
 
-def catalog_images(library_id, source_dir, destination_dir, temp_dir):
+def _scan_file_sizes(directories):
+    """ Get sizes of all files in a set of directories with one scan per directory.
+
+    Returns:
+        dict of filepath to size
+    """
+    sizes = {}
+    for directory in set(directories):
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        sizes[os.path.join(directory, entry.name)] = entry.stat().st_size
+        except FileNotFoundError:
+            pass
+    return sizes
+
+
+def _convert_and_copy(original_filepath, copy_from_filepath, new_filepath):
+    PIL.Image.open(original_filepath).save(copy_from_filepath)
+    _copy_if_different(copy_from_filepath, new_filepath)
+
+
+def _copy_files(copies, num_workers=8):
+    """ Copy files that are missing or differ in size from a pool of workers.
+
+    Args:
+        copies (list of tuple): source and destination filepaths
+
+    KwArgs:
+        num_workers (int): number of concurrent copies
+    """
+    sizes = _scan_file_sizes(
+        [os.path.dirname(a) for a, _ in copies] +
+        [os.path.dirname(b) for _, b in copies])
+
+    required = []
+    for source_filepath, destination_filepath in copies:
+        if source_filepath not in sizes:
+            raise FileNotFoundError(f'missing source file {source_filepath}')
+        if sizes.get(destination_filepath) == sizes[source_filepath]:
+            continue
+        required.append((source_filepath, destination_filepath))
+
+    logging.info(f'copying {len(required)} files, skipping {len(copies) - len(required)} with same size')
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for _ in executor.map(lambda a: shutil.copyfile(*a), required):
+            pass
+
+
+def catalog_images(library_id, source_dir, destination_dir, temp_dir, num_workers=8):
     """ Catalog cellenone images and organize into a new directory
     
     Args:
@@ -194,9 +266,12 @@ def catalog_images(library_id, source_dir, destination_dir, temp_dir):
         source_dir (str): Source Cellenone directory
         destination_dir (str): Destination catalogued images directory
         temp_dir (str): Temporary directory
+
+    KwArgs:
+        num_workers (int): number of concurrent copies and conversions
     """
 
-    catalog = read_cellenone_isolated_files(source_dir)
+    catalog = read_cellenone_isolated_files(source_dir, num_workers=num_workers)
 
     if catalog.empty:
         raise ValueError(f'empty catalog, cellenone data incompatible')
@@ -205,7 +280,7 @@ def catalog_images(library_id, source_dir, destination_dir, temp_dir):
     catalog['library_id'] = library_id
 
     # Generate a pretty filename
-    catalog['filename'] = catalog.apply(generate_new_filename, axis=1)
+    catalog['filename'] = generate_new_filenames(catalog)
 
     # Report duplicate chip wells
     cols = ['chip_row', 'chip_column']
@@ -222,24 +297,19 @@ def catalog_images(library_id, source_dir, destination_dir, temp_dir):
     assert not catalog[['original_filename']].duplicated().any()
     assert not catalog[['filename']].duplicated().any()
 
-    # List of filepaths of newly created files
-    filepaths = []
+    # Copy the image files into the destination directory
+    new_filepaths = [os.path.join(destination_dir, a) for a in catalog['filename']]
+    original_filepaths = [os.path.join(source_dir, a) for a in catalog['original_filename']]
 
-    # Move the image files into the source directory
-    for idx in catalog.index:
-        new_filename = catalog.loc[idx, 'filename']
-        new_filepath = os.path.join(destination_dir, new_filename)
-
-        original_filename = catalog.loc[idx, 'original_filename']
-        original_filepath = os.path.join(source_dir, original_filename)
-
-        _copy_if_different(original_filepath, new_filepath)
+    # List of filepaths of newly created files
+    filepaths = list(new_filepaths)
 
-        filepaths.append(new_filepath)
+    copies = list(zip(original_filepaths, new_filepaths))
 
-    # Move the background images into the source directory
-    catalog['background_filename'] = None
-    catalog['background_idx'] = None
+    # Copy the background images into the destination directory, converting
+    # to png where necessary
+    conversions = []
+    background_idxs = {}
     orig_bg_filenames = catalog[['original_background_filename', 'original_background_extension']].drop_duplicates()
     for idx, (original_filename, original_extension) in enumerate(orig_bg_filenames.values):
         if original_filename is None:
@@ -252,18 +322,25 @@ def catalog_images(library_id, source_dir, destination_dir, temp_dir):
 
         if original_extension != '.png':
             copy_from_filepath = os.path.join(temp_dir, new_filename)
-            PIL.Image.open(original_filepath).save(copy_from_filepath)
+            conversions.append((original_filepath, copy_from_filepath, new_filepath))
 
         else:
-            copy_from_filepath = original_filepath
+            copies.append((original_filepath, new_filepath))
 
-        catalog.loc[catalog['original_background_filename'] == original_filename, 'background_idx'] = idx
-        catalog.loc[catalog['original_background_filename'] == original_filename, 'background_filename'] = new_filename
-
-        _copy_if_different(copy_from_filepath, new_filepath)
+        background_idxs[original_filename] = idx
 
         filepaths.append(new_filepath)
 
+    catalog['background_idx'] = catalog['original_background_filename'].map(background_idxs)
+    catalog['background_filename'] = catalog['background_idx'].map(
+        lambda idx: background_filename_template.format(idx=int(idx), extension='.png'), na_action='ignore')
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        conversion_futures = [executor.submit(_convert_and_copy, *a) for a in conversions]
+        _copy_files(copies, num_workers=num_workers)
+        for future in conversion_futures:
+            future.result()
+
     # Save the catalog
     catalog_filepath = os.path.join(destination_dir, 'catalog.csv')
     catalog.to_csv(catalog_filepath, index=False)
@@ -283,22 +360,18 @@ def catalog_images(library_id, source_dir, destination_dir, temp_dir):
 
     metadata['meta']['cell_images'] = {}
     metadata['meta']['cell_images']['template'] = cell_filename_template
-    metadata['meta']['cell_images']['instances'] = []
-    for idx, row in catalog.iterrows():
-        metadata['meta']['cell_images']['instances'].append({
-            'row': row['chip_row'],
-            'column': row['chip_column'],
-            'library_id': row['library_id'],
-        })
+    metadata['meta']['cell_images']['instances'] = [
+        {'row': chip_row, 'column': chip_column, 'library_id': row_library_id}
+        for chip_row, chip_column, row_library_id in zip(
+            catalog['chip_row'].tolist(),
+            catalog['chip_column'].tolist(),
+            catalog['library_id'].tolist())]
 
     metadata['meta']['background'] = {}
     metadata['meta']['background']['template'] = background_filename_template
-    metadata['meta']['background']['instances'] = []
-    for idx, row in catalog[['background_idx']].dropna().drop_duplicates().iterrows():
-        background_idx = int(row['background_idx'])
-        metadata['meta']['background']['instances'].append({
-            'idx': background_idx,
-        })
+    metadata['meta']['background']['instances'] = [
+        {'idx': int(background_idx)}
+        for background_idx in catalog['background_idx'].dropna().drop_duplicates().tolist()]
 
     metadata_filepath = os.path.join(destination_dir, 'metadata.yaml')
     with open(metadata_filepath, 'w') as meta_yaml:
@@ -67,6 +67,9 @@ def main(
 
     tantalus_api = TantalusApi()
 
+    # Dataset file instances are resolved repeatedly while checking datasets
+    tantalus_api.enable_dataset_cache()
+
     filters = None
     if filename_prefix is not None:
         filters = {'filename__startswith': filename_prefix}
@@ -6,15 +6,17 @@ import logging
 import os
 import re
 import socket
-import subprocess
 import sys
 import click
 import paramiko
+import pandas as pd
 import pwd
 
 from utils.qsub_job_submission import submit_qsub_job
 from utils.qsub_jobs import CramToBamJob
 from datamanagement.utils.utils import parse_ref_genome, connect_to_client
+from datamanagement.utils import bam_conversion
+from datamanagement.utils.bam_conversion import fetch_input, index_bam
 from dbclients.tantalus import TantalusApi
 from dbclients import basicclient
 
@@ -47,6 +49,13 @@ def get_uncompressed_bam_path(cram_path):
     return cram_path[:-5]
 
 
+def bam_exists(output_bam_path, to_storage):
+    """
+    Checks if the bam exists on the to_storage and in Tantalus with the same size
+    """
+    return bam_conversion.bam_exists(tantalus_api, output_bam_path, to_storage)
+
+
 def cram_to_bam(cram_path,
                 reference_genome,
                 output_bam_path,
@@ -72,26 +81,8 @@ def cram_to_bam(cram_path,
     # Convert the CRAM to a BAM
     logging.info("Converting {} to {}".format(cram_path, output_bam_path))
 
-    # If an sftp client was passed in 
-    if sftp_client:
-        # Connect to thost via SSH client
-        local_cram_path = output_bam_path + ".cram"
-        cmd = [
-            "rsync",
-            "-avPL",
-            "thost:" + cram_path,
-            local_cram_path
-        ]
-        remote_file = sftp_client.stat(cram_path)
-        
-        # Check if the file has been successfully transferred before
-        if not os.path.isfile(local_cram_path):
-            logging.info("Copying cram to {}".format(local_cram_path))
-            subprocess.check_call(cmd)
-        elif os.path.getsize(local_cram_path) != remote_file.st_size:
-            logging.info("Copying cram to {}".format(local_cram_file))
-            subprocess.check_call(cmd)
-        cram_path = local_cram_path
+    # Copy the cram locally if an sftp client was passed in
+    cram_path = fetch_input(cram_path, output_bam_path + ".cram", sftp_client)
         
     # Create the job to perform the cram decompression
     job = CramToBamJob('10', cram_path, HUMAN_REFERENCE_GENOMES_MAP[reference_genome], output_bam_path)
@@ -121,24 +112,9 @@ def create_bam(
         library:                (string) internal library ID the bam is associated with 
         sftp_client:            (sftp object) the sftp client connected to the remote host
     """ 
-    output_bam_filename = output_bam_path[len(to_storage["prefix"]) + 1:] 
-    
-    # Check if a decompressed bam already exists in Tantalus 
-    # and get its file size
-    try:
-        file_resource = tantalus_api.get(
-                "file_resource",
-                filename=output_bam_filename
-        )
-        file_size = file_resource["size"]
-    except basicclient.NotFoundError as e:
-        file_size = None
-
-    #Check if the file exists on the to_storage, and if it exists in Tantalus with the same size
-    if os.path.isfile(output_bam_path):
-        if os.path.getsize(output_bam_path) == file_size:
-            logging.warning("An uncompressed BAM file already exists at {} Skipping decompression of cram file".format(output_bam_path))
-            return False
+    if bam_exists(output_bam_path, to_storage):
+        logging.warning("An uncompressed BAM file already exists at {} Skipping decompression of cram file".format(output_bam_path))
+        return False
 
     # Find out what reference genome to use. Currently there are no
     # standardized strings that we can expect, and for reference genomes
@@ -162,14 +138,61 @@ def create_bam(
     )
 
     # Create the bam index
-    logging.info("Creating bam index at {}".format(output_bam_path + '.bai'))
-    cmd = [ 'samtools',
-            'index',
-            output_bam_path,
-    ]
-    subprocess.check_call(cmd)
+    index_bam(output_bam_path)
+
 
-    logging.info("Successfully created bam index at {}".format(output_bam_path + ".bai"))
+def create_bams(conversions, to_storage, sftp_client=None, on_complete=None, title="cram_to_bam"):
+    """
+    Creates decompressed bams and bam indices from many cram files as a single
+    batch of cluster jobs
+
+    Args:
+        conversions:    (list) dicts with cram_path, output_bam_path and
+                        raw_reference_genome
+        to_storage:     (dict) the destination storage for the bams
+        sftp_client:    (sftp object) the sftp client connected to the remote host
+        on_complete:    (callable) called with each bam in place of adding
+                        it to Tantalus
+        title:          (string) title of the batch used for job logs
+
+    Returns:
+        failed:     (list) conversions that failed
+    """
+    def _create_job(local_path, reference_genome, output_bam_path):
+        return CramToBamJob(
+            '10', local_path, HUMAN_REFERENCE_GENOMES_MAP[reference_genome], output_bam_path)
+
+    return bam_conversion.create_bams(
+        tantalus_api,
+        conversions,
+        to_storage,
+        "cram_path",
+        _create_job,
+        DEFAULT_NATIVECRAM,
+        title,
+        sftp_client=sftp_client,
+        on_complete=on_complete,
+    )
+
+
+@click.command()
+@click.argument("conversions_csv")
+@click.argument("to_storage_name")
+@click.option("--from_gsc", is_flag=True)
+def batch(conversions_csv, to_storage_name, from_gsc=False):
+    """
+    Decompresses many cram files to bams using the cluster in parallel. Creates
+    a new bam index for each bam, and adds the files to Tantalus as each
+    decompression finishes
+
+    Args:
+        conversions_csv:    (string) csv with cram_path, output_bam_path
+                            and reference_genome columns
+        to_storage_name:    (string) name of the destination storage for the bams 
+        from_gsc:           (flag) a flag to specify whether the cram files are from the GSC
+    """
+    bam_conversion.batch_main(
+        tantalus_api, conversions_csv, to_storage_name, "cram_path", create_bams, from_gsc=from_gsc)
 
 
 @click.command()
@@ -193,18 +216,15 @@ def main(**kwargs):
         from_gsc:           (flag) a flag to specify whether the cram is from the GSC
     """
     # If the cram file is from the GSC, check if the script is being run on thost
-    hostname = socket.gethostname()
-    if kwargs["from_gsc"] and hostname != "txshah":
-        ssh_client = connect_to_client("10.9.208.161")       
-        sftp_client = ssh_client.open_sftp()
+    sftp_client = bam_conversion.connect_sftp(kwargs["from_gsc"])
 
+    if sftp_client:
         try:
             sftp_client.stat(kwargs["cram_path"])
         except IOError:
             raise Exception("The cram does not exist at {} -- skipping decompression".format(kwargs["cram_path"]))
 
     else:
-        sftp_client = None
         if not os.path.exists(kwargs["cram_path"]):
             raise Exception("The cram does not exist at {} -- skipping decompression".format(kwargs["cram_path"]))
 
@@ -232,4 +252,8 @@ def main(**kwargs):
 
 
 if __name__=='__main__':
-    main()
\ No newline at end of file
+    # Batches are run with the batch command, otherwise a single file is converted
+    if sys.argv[1:2] == ["batch"]:
+        batch(sys.argv[2:])
+    else:
+        main()
@@ -2,12 +2,14 @@ import os
 import re
 import click
 import logging
+import concurrent.futures
 from tabulate import tabulate
 from distutils.version import StrictVersion
 
 from dbclients.tantalus import TantalusApi
 from dbclients.colossus import ColossusApi
 from dbclients.basicclient import NotFoundError
+from datamanagement.utils.transfer_budget import TransferBudget
 
 tantalus_api = TantalusApi()
 colossus_api = ColossusApi()
@@ -106,7 +108,6 @@ def check_user_file_input(user_input):
 
 def get_reads(jira_ticket, version, library_id):
 
-	filenames = []
 	if StrictVersion(version.strip('v')) < StrictVersion('0.2.23'):
 		file_resources = list(tantalus_api.list(
 			"file_resource",
@@ -120,14 +121,11 @@ def get_reads(jira_ticket, version, library_id):
 			filename__endswith="{}_reads.csv.gz".format(library_id)
 		))
 
-	filenames += [f["filename"] for f in file_resources]
-
-	return filenames
+	return file_resources
 
 
 def get_metrics(jira_ticket, version, library_id):
 
-	filenames = []
 	if StrictVersion(version.strip('v')) < StrictVersion('0.2.23'):
 
 		file_resources = list(tantalus_api.list(
@@ -162,13 +160,10 @@ def get_metrics(jira_ticket, version, library_id):
 			filename__endswith="{}_metrics.csv.gz".format(library_id)
 		))
 
-	filenames += [f["filename"] for f in file_resources]
-
-	return filenames
+	return file_resources
 
 
 def get_segments(jira_ticket, version, library_id):
-	filenames = []
 	if StrictVersion(version.strip('v')) < StrictVersion('0.2.23'):
 		file_resources = list(tantalus_api.list(
 			"file_resource",
@@ -182,13 +177,10 @@ def get_segments(jira_ticket, version, library_id):
 			filename__endswith="{}_segments.csv.gz".format(library_id)
 		))
 
-	filenames += [f["filename"] for f in file_resources]
-	return filenames
+	return file_resources
 
 def get_plots(jira_ticket, version, library_id):
 
-	filenames = []
-
 	file_resources = list(tantalus_api.list(
 		"file_resource",
 		filename__startswith=jira_ticket,
@@ -206,25 +198,25 @@ def get_plots(jira_ticket, version, library_id):
 		filename__startswith=jira_ticket,
 		filename__endswith="{}_heatmap_by_ec.pdf".format(library_id)
 	))
-	filenames += [f["filename"] for f in file_resources]
-
-	return filenames
+	return file_resources
 
 
 def get_all_files(jira_ticket, version, library_id):
-	filenames = []
+	file_resources = []
 
-	filenames += get_reads(jira_ticket, version, library_id)
-	filenames += get_metrics(jira_ticket, version, library_id)
-	filenames += get_segments(jira_ticket, version, library_id)
-	filenames += get_plots(jira_ticket, version, library_id)
+	file_resources += get_reads(jira_ticket, version, library_id)
+	file_resources += get_metrics(jira_ticket, version, library_id)
+	file_resources += get_segments(jira_ticket, version, library_id)
+	file_resources += get_plots(jira_ticket, version, library_id)
 
-	return filenames
+	return file_resources
 
 @click.command()
 @click.argument('ticket_or_library', nargs=1)
 @click.option('--file',  type=click.Choice(['metrics', 'reads', 'plots', 'segments', 'all']))
-def main(ticket_or_library, file=None):
+@click.option('--max_workers', type=int, default=4)
+@click.option('--max_mbps', type=float, help='bandwidth budget in megabytes per second')
+def main(ticket_or_library, file=None, max_workers=4, max_mbps=None):
 	# Define source and destination storage clients
 	from_storage_name = "singlecellresults"
 	to_storage_name = "downloads"
@@ -279,22 +271,25 @@ def main(ticket_or_library, file=None):
 
 	version = analysis_object["version"]
 	if files_to_download == "reads":
-		filenames = get_reads(analysis_ticket, version, library_id)
+		file_resources = get_reads(analysis_ticket, version, library_id)
 
 	elif files_to_download == "metrics":
-		filenames = get_metrics(analysis_ticket, version, library_id)
+		file_resources = get_metrics(analysis_ticket, version, library_id)
 
 	elif files_to_download == "segments":
-		filenames = get_segments(analysis_ticket, version, library_id)
+		file_resources = get_segments(analysis_ticket, version, library_id)
 
 	elif files_to_download == "plots":
-		filenames = get_plots(analysis_ticket, version, library_id)
+		file_resources = get_plots(analysis_ticket, version, library_id)
 
 	elif files_to_download == "all":
-		filenames = get_all_files(analysis_ticket, version, library_id)
+		file_resources = get_all_files(analysis_ticket, version, library_id)
+
+	budget = TransferBudget(max_bytes_per_second=max_mbps * 1024 * 1024 if max_mbps else None)
 
-	downloaded_files = []
-	for filename in filenames:
+	downloads = []
+	for file_resource in file_resources:
+		filename = file_resource["filename"]
 		filepath_parsed = filename.split("/")
 		analysis_type = filepath_parsed[-2]
 		file = filepath_parsed[-1]
@@ -313,13 +308,22 @@ def main(ticket_or_library, file=None):
 		if not os.path.exists(subdir):
 			os.makedirs(subdir)
 
-		print("Downloading {} to {}".format(file, subdir))
-		blob = from_storage_client.blob_service.get_blob_to_path(
-			container_name="results",
-			blob_name=filename,
-			file_path=filepath
-		)
-		downloaded_files.append(filepath)
+		downloads.append((filename, filepath))
+
+	budget.add_planned(len(downloads), sum(a["size"] for a in file_resources))
+
+	def _download(filename_filepath):
+		filename, filepath = filename_filepath
+		print("Downloading {} to {}".format(filename, os.path.dirname(filepath)))
+		progress = budget.file_progress()
+		from_storage_client.download(filename, filepath, progress_callback=progress)
+		budget.complete_file(progress.transferred, progress)
+		return filepath
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+		downloaded_files = list(executor.map(_download, downloads))
+
+	budget.report(force=True)
 
 	print("\n********** Download complete **********\n\n")
 	for file in downloaded_files:
@@ -20,6 +20,7 @@ import pandas as pd
 
 import datamanagement.transfer_files
 from datamanagement.utils.constants import LOGGING_FORMAT
+from datamanagement.utils.file_cache import FileCache
 from dbclients.tantalus import TantalusApi
 from datamanagement.miscellaneous.hdf5helper import get_python2_hdf5_keys
 from datamanagement.miscellaneous.hdf5helper import convert_python2_hdf5_to_csv
@@ -31,6 +32,10 @@ logging.basicConfig(format=LOGGING_FORMAT, level=logging.INFO)
 
 remote_storage_name = "singlecellresults"
 
+# Byte budget of cached h5 files if neither --max_cache_bytes nor
+# SISYPHUS_CACHE_MAX_BYTES is set
+DEFAULT_MAX_CACHE_BYTES = 100 * 1024 * 1024 * 1024
+
 
 h5_key_name_map = {
     '_destruct.h5': {
@@ -126,10 +131,15 @@ def convert_h5(h5_filepath, key, csv_filepath):
 @click.option('--redo', is_flag=True)
 @click.option('--dry_run', is_flag=True)
 @click.option('--check_done', is_flag=True)
-def run_h5_convert(cache_dir, dataset_id=None, results_type=None, redo=False, dry_run=False, check_done=False):
+@click.option('--max_cache_bytes', type=int, help='byte budget of cached h5 files')
+def run_h5_convert(cache_dir, dataset_id=None, results_type=None, redo=False, dry_run=False, check_done=False, max_cache_bytes=None):
     tantalus_api = TantalusApi()
 
+    if max_cache_bytes is None and not os.environ.get('SISYPHUS_CACHE_MAX_BYTES'):
+        max_cache_bytes = DEFAULT_MAX_CACHE_BYTES
+
     local_cache_client = tantalus_api.get_cache_client(cache_dir)
+    local_cache = FileCache(cache_dir, max_bytes=max_cache_bytes)
     remote_storage_client = tantalus_api.get_storage_client(remote_storage_name)
 
     if dataset_id is not None:
@@ -147,6 +157,8 @@ def run_h5_convert(cache_dir, dataset_id=None, results_type=None, redo=False, dr
     for result in results_list:
         logging.info('processing results dataset {}'.format(result['id']))
 
+        cached_filenames = []
+
         try:
             file_instances = tantalus_api.get_dataset_file_instances(
                 result["id"],
@@ -177,11 +189,12 @@ def run_h5_convert(cache_dir, dataset_id=None, results_type=None, redo=False, dr
                 if not file_instance['file_resource']['filename'].endswith('.h5'):
                     continue
 
-                datamanagement.transfer_files.cache_file(tantalus_api, file_instance, cache_dir)
+                datamanagement.transfer_files.cache_file(
+                    tantalus_api, file_instance, cache_dir, max_cache_bytes=max_cache_bytes)
 
                 h5_filepath = local_cache_client.get_url(file_instance['file_resource']['filename'])
 
-                filepaths_to_clean.append(h5_filepath)
+                cached_filenames.append(file_instance['file_resource']['filename'])
 
                 logging.info('converting {}'.format(h5_filepath))
 
@@ -213,11 +226,14 @@ def run_h5_convert(cache_dir, dataset_id=None, results_type=None, redo=False, dr
                         (yaml_filename, yaml_filepath),                        
                     ]
 
-                    for filename, filepath in fileinfo_to_add:
-                        logging.info('creating file {} from path {}'.format(
-                            filename, filepath))
+                    logging.info('creating files {}'.format(
+                        ', '.join(filename for filename, _ in fileinfo_to_add)))
 
-                        remote_storage_client.create(filename, filepath, update=redo)
+                    failed = remote_storage_client.create_many(fileinfo_to_add, update=redo)
+                    if failed:
+                        raise Exception('failed to create files {}'.format(', '.join(failed)))
+
+                    for filename, filepath in fileinfo_to_add:
                         remote_filepath = os.path.join(remote_storage_client.prefix, filename)
 
                         logging.info('adding file {} from path {}'.format(
@@ -255,6 +271,10 @@ def run_h5_convert(cache_dir, dataset_id=None, results_type=None, redo=False, dr
         except Exception:
             logging.exception('conversion failed')
 
+        finally:
+            # Cached h5 files are kept for later runs, evicted as the cache fills
+            local_cache.release(cached_filenames)
+
 
 if __name__ == "__main__":
     run_h5_convert()
@@ -3,7 +3,7 @@ import logging
 import click
 from dbclients.tantalus import TantalusApi
 from datamanagement.utils.constants import LOGGING_FORMAT
-from datamanagement.transfer_files import transfer_dataset
+from datamanagement.transfer_files import transfer_datasets, parse_storage_limits, DEFAULT_MAX_TRANSFERS
 
 
 @click.command()
@@ -11,7 +11,12 @@ from datamanagement.transfer_files import transfer_dataset
 @click.argument('from_storage_name')
 @click.argument('to_storage_name')
 @click.option('--dataset_id', type=int)
-def download_datasets(results_type, from_storage_name, to_storage_name, dataset_id=None, jira_ticket=None):
+@click.option('--max_workers', type=int, default=DEFAULT_MAX_TRANSFERS)
+@click.option('--max_mbps', type=float, help='bandwidth budget in megabytes per second')
+@click.option('--storage_limit', multiple=True, help='maximum concurrent transfers of a storage as name=limit')
+def download_datasets(
+        results_type, from_storage_name, to_storage_name, dataset_id=None, jira_ticket=None,
+        max_workers=DEFAULT_MAX_TRANSFERS, max_mbps=None, storage_limit=()):
     ''' Download a set of datasets by type.
     '''
 
@@ -31,13 +36,18 @@ def download_datasets(results_type, from_storage_name, to_storage_name, dataset_
     # Download most recent first
     dataset_ids = reversed(sorted(dataset_ids))
 
-    failed = False
-    for dataset_id in dataset_ids:
-        try:
-            transfer_dataset(tantalus_api, dataset_id, 'resultsdataset', from_storage_name, to_storage_name)
-        except:
-            logging.exception(f'failed to download {dataset_id}')
-            failed = True
+    failed = transfer_datasets(
+        tantalus_api,
+        [(a, 'resultsdataset') for a in dataset_ids],
+        from_storage_name,
+        to_storage_name,
+        max_workers=max_workers,
+        max_bytes_per_second=max_mbps * 1024 * 1024 if max_mbps else None,
+        storage_limits=parse_storage_limits(storage_limit),
+    )
+
+    for dataset_id, _ in failed:
+        logging.error(f'failed to download {dataset_id}')
 
     if failed:
         raise Exception('one or more downloads failed')
@@ -20,9 +20,10 @@ from datamanagement.utils.utils import (
         add_compression_suffix,
         connect_to_client
     )
-from datamanagement.spec_to_bam import create_bam
-from datamanagement.cram_to_bam import create_bam as HelperCram
+from datamanagement.spec_to_bam import create_bam, create_bams as create_spec_bams
+from datamanagement.cram_to_bam import create_bam as HelperCram, create_bams as create_cram_bams
 from datamanagement.bam_import import import_bam
+from datamanagement.utils.bam_header import inspect_bams
 
 from datamanagement.templates import (
         WGS_BAM_PATH_TEMPLATE,
@@ -705,6 +706,47 @@ def main(**kwargs):
     if not kwargs["id_type"]:
         raise Exception("Please specify an ID type (sample or library")
 
+    def _import_gsc_bams(bams):
+        """ Import bams to Tantalus, reading all their headers concurrently
+
+        Returns:
+            failed:     (list) paths of bams that could not be imported
+        """
+        storage_client = tantalus_api.get_storage_client(storage["name"])
+        filenames = [tantalus_api.get_file_resource_filename(storage["name"], bam_path) for _, bam_path in bams]
+        bam_infos = inspect_bams(storage_client, filenames)
+
+        failed = []
+        for (detail, bam_path), filename in zip(bams, filenames):
+            logging.info("Importing {} to Tantalus".format(bam_path))
+
+            try:
+                dataset = import_bam(
+                    storage_name=storage["name"],
+                    bam_file_path=bam_path,
+                    sample=detail["sample"],
+                    library=detail["library"],
+                    lane_infos=detail["lane_info"],
+                    read_type=detail["read_type"],
+                    tag_name=kwargs["tag_name"],
+                    update=kwargs["update"],
+                    bam_info=bam_infos[filename],
+                )
+            except Exception:
+                logging.exception("failed to import {}".format(bam_path))
+                failed.append(bam_path)
+                continue
+
+            logging.info("Successfully added sequence dataset with ID {}".format(dataset["id"]))
+
+        return failed
+
+    # Specs and crams to decompress in parallel on the cluster
+    compressed_bams = {".spec": [], ".cram": []}
+
+    # Bams to import once all are on the storage
+    bams_to_import = []
+
     details = []
     for identifier in kwargs["ids"]:
         # Query the GSC to see if the ID exists
@@ -736,24 +778,21 @@ def main(**kwargs):
                 continue
 
             if not kwargs["skip_file_import"]:
+                # Defer decompression of specs and crams to a batch of cluster jobs
+                compression = os.path.splitext(bam_paths["source_bam_path"])[1]
+                if compression in compressed_bams:
+                    compressed_bams[compression].append({
+                        compression[1:] + "_path": bam_paths["source_bam_path"],
+                        "output_bam_path": bam_paths["tantalus_bam_path"],
+                        "raw_reference_genome": detail["reference_genome"],
+                        "detail": detail,
+                    })
+                    continue
+
                 # Transfer the bam to the specified storage
                 transfer_gsc_bams(detail, bam_paths, storage, sftp)
 
-                # Add the files to Tantalus
-                logging.info("Importing {} to Tantalus".format(bam_paths["tantalus_bam_path"]))
-
-                dataset = import_bam(
-                    storage_name=storage["name"],
-                    bam_file_path=bam_paths["tantalus_bam_path"],
-                    sample=detail["sample"],
-                    library=detail["library"],
-                    lane_infos=detail["lane_info"],
-                    read_type=detail["read_type"],
-                    tag_name=kwargs["tag_name"],
-                    update=kwargs["update"]
-                )
-
-                logging.info("Successfully added sequence dataset with ID {}".format(dataset["id"]))
+                bams_to_import.append((detail, bam_paths["tantalus_bam_path"]))
             else:
                 logging.info("Importing library {} to tantalus".format(detail["library"]["library_id"]))
                 library_pk = tantalus_api.get_or_create(
@@ -777,6 +816,28 @@ def main(**kwargs):
                     )
                     logging.info("Successfully created lane {} in tantalus".format(lane["id"]))
 
+    failed = []
+    for compression, create_bams in ((".spec", create_spec_bams), (".cram", create_cram_bams)):
+        if not compressed_bams[compression]:
+            continue
+
+        failed += create_bams(
+            compressed_bams[compression],
+            storage,
+            sftp_client=sftp,
+            on_complete=lambda conversion: bams_to_import.append((conversion["detail"], conversion["output_bam_path"])),
+        )
+
+    failed_imports = []
+    if bams_to_import:
+        failed_imports = _import_gsc_bams(bams_to_import)
+
+    if failed:
+        raise Exception("failed to decompress {}".format(", ".join(a["input_path"] for a in failed)))
+
+    if failed_imports:
+        raise Exception("failed to import {}".format(", ".join(failed_imports)))
+
 
 
 if __name__=='__main__':
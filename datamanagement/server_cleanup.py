@@ -3,9 +3,10 @@ import os
 import logging
 import json
 import click
-from dbclients.tantalus import TantalusApi, DataError
-from dbclients.basicclient import NotFoundError
+from dbclients.tantalus import TantalusApi, DataNotOnStorageError
+from dbclients.basicclient import BulkError, NotFoundError
 from utils.constants import LOGGING_FORMAT
+from utils.cleanup import check_file_instances, write_manifest, MANIFEST_COLUMNS
 import pandas as pd
 
 
@@ -20,6 +21,8 @@ logging.getLogger('azure.storage').setLevel(logging.ERROR)
 @click.option('--tag_name')
 @click.option('--check_remote')
 @click.option('--dry_run', is_flag=True)
+@click.option('--manifest', help='csv file to which the deletion manifest is written')
+@click.option('--jobs', type=int, default=16, help='maximum number of concurrent requests')
 def main(
     storage_name,
     dataset_type,
@@ -27,6 +30,8 @@ def main(
     tag_name=None,
     check_remote=None,
     dry_run=False,
+    manifest=None,
+    jobs=16,
 ):
     logging.info('cleanup up storage {}'.format(storage_name))
 
@@ -37,6 +42,9 @@ def main(
 
     tantalus_api = TantalusApi()
 
+    # Dataset file instances are resolved repeatedly while planning deletions
+    tantalus_api.enable_dataset_cache()
+
     storage_client = tantalus_api.get_storage_client(storage_name)
 
     remote_client = None
@@ -59,64 +67,95 @@ def main(
 
     total_data_size = 0
     file_num_count = 0
+    plans = []
 
-    for dataset in datasets:
-        logging.info('checking dataset with id {}, name {}'.format(
-            dataset['id'], dataset['name']))
-
-        # Optionally skip datasets not present and intact on the remote storage
-        if check_remote is not None:
-            if not tantalus_api.is_dataset_on_storage(dataset['id'], 'sequencedataset', check_remote):
-                logging.warning('not deleting dataset with id {}, not on remote storage '.format(
-                    dataset['id'], check_remote))
-                continue
+    # Record the outcome for every dataset processed, even on failure
+    try:
+        for dataset in datasets:
+            logging.info('checking dataset with id {}, name {}'.format(
+                dataset['id'], dataset['name']))
 
-            # For each file instance on the remote, check if it exists and has the correct size in tantalus
-            remote_file_size_check = True
-            for file_instance in tantalus_api.get_dataset_file_instances(dataset['id'], dataset_type, check_remote):
+            # Optionally skip datasets not present and intact on the remote storage
+            if check_remote is not None:
                 try:
-                    tantalus_api.check_file(file_instance)
-                except DataError:
-                    logging.exception('check file failed')
-                    remote_file_size_check = False
-
-            # Skip this dataset if any files failed
-            if not remote_file_size_check:
+                    remote_file_instances = tantalus_api.get_dataset_file_instances(
+                        dataset['id'], dataset_type, check_remote)
+                except DataNotOnStorageError:
+                    logging.warning('not deleting dataset with id {}, not on remote storage {}'.format(
+                        dataset['id'], check_remote))
+                    continue
+
+                # For each file instance on the remote, check if it exists and has the correct size in tantalus
+                if check_file_instances(tantalus_api, remote_file_instances, max_workers=jobs):
+                    logging.warning("skipping dataset {} that failed check on {}".format(
+                        dataset['id'], check_remote))
+                    continue
+
+            # Check consistency with the removal storage
+            file_instances = tantalus_api.get_dataset_file_instances(dataset['id'], dataset_type, storage_name)
+            if check_file_instances(tantalus_api, file_instances, max_workers=jobs):
                 logging.warning("skipping dataset {} that failed check on {}".format(
-                    dataset['id'], check_remote))
+                    dataset['id'], storage_name))
                 continue
 
-        # Check consistency with the removal storage
-        file_size_check = True
-        for file_instance in tantalus_api.get_dataset_file_instances(dataset['id'], dataset_type, storage_name):
-            try:
-                tantalus_api.check_file(file_instance)
-            except DataError:
-                logging.exception('check file failed')
-                file_size_check = False
-
-        # Skip this dataset if any files failed
-        if not file_size_check:
-            logging.warning("skipping dataset {} that failed check on {}".format(
-                dataset['id'], storage_name))
-            continue
-
-        # Delete all files for this dataset
-        for file_instance in tantalus_api.get_dataset_file_instances(dataset['id'], dataset_type, storage_name):
-            if dry_run:
-                logging.info("would delete file instance with id {}, filepath {}".format(
-                    file_instance['id'], file_instance['filepath']))
-            else:
-                logging.info("deleting file instance with id {}, filepath {}".format(
-                    file_instance['id'], file_instance['filepath']))
-                tantalus_api.update("file_instance", id=file_instance['id'], is_deleted=True)
-            total_data_size += file_instance['file_resource']['size']
-            file_num_count += 1
+            # Delete all files for this dataset
+            action = 'would delete'
+            reason = 'dataset {}'.format(dataset['id'])
+            failed_ids = set()
+
+            for file_instance in file_instances:
+                if dry_run:
+                    logging.info("would delete file instance with id {}, filepath {}".format(
+                        file_instance['id'], file_instance['filepath']))
+                else:
+                    logging.info("deleting file instance with id {}, filepath {}".format(
+                        file_instance['id'], file_instance['filepath']))
+
+            if not dry_run:
+                action = 'deleted'
+
+                try:
+                    tantalus_api.bulk_patch(
+                        "file_instance",
+                        [dict(id=f['id'], is_deleted=True) for f in file_instances],
+                        max_workers=jobs,
+                    )
+
+                except BulkError as e:
+                    logging.error('failed to mark {} file instances of dataset {} as deleted'.format(
+                        len(e.failed), dataset['id']))
+                    failed_ids = set(a['id'] for a in e.failed)
+
+            for file_instance in file_instances:
+                if file_instance['id'] in failed_ids:
+                    instance_action = 'failed'
+                    instance_reason = 'dataset {}, marking as deleted failed'.format(dataset['id'])
+                else:
+                    instance_action = action
+                    instance_reason = reason
+
+                plans.append({
+                    'file_instance_id': file_instance['id'],
+                    'file_resource_id': file_instance['file_resource']['id'],
+                    'filename': file_instance['file_resource']['filename'],
+                    'filepath': file_instance['filepath'],
+                    'size': file_instance['file_resource']['size'],
+                    'delete_file_resource': False,
+                    'action': instance_action,
+                    'reason': instance_reason,
+                })
+
+                if instance_action != 'failed':
+                    total_data_size += file_instance['file_resource']['size']
+                    file_num_count += 1
+
+    finally:
+        if manifest is not None:
+            write_manifest(pd.DataFrame(plans, columns=MANIFEST_COLUMNS), manifest)
 
     logging.info("deleted a total of {} files with size {} bytes".format(
         file_num_count, total_data_size))
 
-
 if __name__ == "__main__":
     main()
 
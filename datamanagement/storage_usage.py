@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+""" Storage usage accounting index.
+
+Builds a local HDF5 index of the bytes used by each dataset on each
+storage from bulk tantalus listings, and answers usage queries from the
+index without contacting tantalus.  The file instances of each storage
+are kept in the index, so that a refresh only lists instances created
+since the previous refresh, and the deleted instances, to remove
+instances deleted and restore instances undeleted since then.
+
+The index is written with pandas.HDFStore, which requires PyTables.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import logging
+import os
+import sys
+import click
+import pandas as pd
+
+from datamanagement.utils.constants import LOGGING_FORMAT
+from dbclients.tantalus import TantalusApi
+
+log = logging.getLogger('sisyphus')
+
+USAGE_COLUMNS = [
+    'storage',
+    'dataset_type',
+    'dataset_id',
+    'dataset_name',
+    'library',
+    'sample',
+    'analysis',
+    'num_files',
+    'bytes',
+    'last_updated',
+]
+
+FILE_COLUMNS = [
+    'storage',
+    'file_instance_id',
+    'file_resource_id',
+    'size',
+    'created',
+]
+
+# Placeholder datasets for files that belong to no dataset, and files
+# shared by several datasets
+UNASSIGNED_DATASET_ID = -1
+SHARED_DATASET_ID = -2
+
+
+def _join_ids(values, key):
+    return ','.join(sorted(set(str(a[key]) for a in values if a)))
+
+
+def list_dataset_files(tantalus_api):
+    """ List datasets and their file resources.
+
+    Returns:
+        datasets (pandas.DataFrame), dataset_files (pandas.DataFrame)
+    """
+    datasets = []
+    dataset_files = []
+
+    for dataset in tantalus_api.list('sequencedataset'):
+        datasets.append({
+            'dataset_type': 'sequencedataset',
+            'dataset_id': dataset['id'],
+            'dataset_name': dataset['name'],
+            'library': dataset['library']['library_id'],
+            'sample': dataset['sample']['sample_id'],
+            'analysis': dataset.get('analysis') or 0,
+        })
+        for file_resource_id in set(dataset['file_resources']):
+            dataset_files.append(('sequencedataset', dataset['id'], file_resource_id))
+
+    for dataset in tantalus_api.list('resultsdataset'):
+        datasets.append({
+            'dataset_type': 'resultsdataset',
+            'dataset_id': dataset['id'],
+            'dataset_name': dataset['name'],
+            'library': _join_ids(dataset['libraries'], 'library_id'),
+            'sample': _join_ids(dataset['samples'], 'sample_id'),
+            'analysis': dataset.get('analysis') or 0,
+        })
+        for file_resource_id in set(dataset['file_resources']):
+            dataset_files.append(('resultsdataset', dataset['id'], file_resource_id))
+
+    datasets = pd.DataFrame(datasets, columns=[
+        'dataset_type', 'dataset_id', 'dataset_name', 'library', 'sample', 'analysis'])
+    dataset_files = pd.DataFrame(dataset_files, columns=[
+        'dataset_type', 'dataset_id', 'file_resource_id'])
+
+    log.info('listed {} datasets with {} files'.format(len(datasets.index), len(dataset_files.index)))
+
+    return datasets, dataset_files
+
+
+def _get_file_rows(storage_name, file_instances):
+    files = []
+    for file_instance in file_instances:
+        file_resource = file_instance['file_resource']
+        files.append((storage_name, file_instance['id'], file_resource['id'], file_resource['size'], file_resource['created']))
+
+    files = pd.DataFrame(files, columns=FILE_COLUMNS)
+    files = files.astype({'file_instance_id': int, 'file_resource_id': int, 'size': int})
+    files['created'] = pd.to_datetime(files['created'], utc=True)
+
+    return files
+
+
+def list_storage_files(tantalus_api, storage_name, after_id=None, is_deleted=False):
+    """ List the file instances on a storage.
+
+    KwArgs:
+        after_id (int): only list instances with a greater id
+        is_deleted (bool): list deleted rather than existing instances
+
+    Returns:
+        pandas.DataFrame with FILE_COLUMNS
+    """
+    filters = {'storage__name': storage_name, 'is_deleted': is_deleted}
+
+    files = _get_file_rows(storage_name, tantalus_api.filter('file_instance', filters, cursor=after_id))
+
+    log.info('listed {} {}files on storage {}'.format(len(files.index), 'deleted ' if is_deleted else '', storage_name))
+
+    return files
+
+
+def get_storage_files(tantalus_api, storage_name, file_instance_ids):
+    """ Get file instances on a storage by id.
+
+    Returns:
+        pandas.DataFrame with FILE_COLUMNS
+    """
+    return _get_file_rows(storage_name, (tantalus_api.get('file_instance', id=a) for a in file_instance_ids))
+
+
+def compute_storage_usage(storage_name, files, datasets, dataset_files):
+    """ Compute per dataset usage of a storage.
+
+    Each file is counted once, files in multiple datasets are counted
+    towards a shared placeholder and files in no dataset towards an
+    unassigned placeholder, so that usage sums to the storage total.
+
+    Returns:
+        pandas.DataFrame with USAGE_COLUMNS
+    """
+    files = files.drop_duplicates('file_resource_id')
+
+    dataset_files = dataset_files.drop_duplicates()
+    num_datasets = dataset_files.groupby('file_resource_id').size()
+    shared = dataset_files['file_resource_id'].map(num_datasets) > 1
+
+    shared_files = dataset_files.loc[shared, ['file_resource_id']].drop_duplicates()
+    shared_files['dataset_type'] = 'shared'
+    shared_files['dataset_id'] = SHARED_DATASET_ID
+    dataset_files = pd.concat([dataset_files[~shared], shared_files], ignore_index=True)
+
+    usage = files.merge(dataset_files, on='file_resource_id', how='left')
+    usage['dataset_type'] = usage['dataset_type'].fillna('none')
+    usage['dataset_id'] = usage['dataset_id'].fillna(UNASSIGNED_DATASET_ID).astype(int)
+
+    usage = usage.groupby(['dataset_type', 'dataset_id']).agg(
+        num_files=('size', 'size'),
+        bytes=('size', 'sum'),
+        last_updated=('created', 'max'),
+    ).reset_index()
+
+    usage = usage.merge(datasets, on=['dataset_type', 'dataset_id'], how='left')
+    usage['dataset_name'] = usage['dataset_name'].fillna('')
+    usage['library'] = usage['library'].fillna('')
+    usage['sample'] = usage['sample'].fillna('')
+    usage['analysis'] = usage['analysis'].fillna(0).astype(int)
+    usage['storage'] = storage_name
+
+    return usage[USAGE_COLUMNS]
+
+
+class StorageUsageIndex(object):
+    """ HDF5 backed index of storage usage. """
+
+    def __init__(self, index_filename):
+        self.index_filename = index_filename
+
+    def _read(self, key):
+        if not os.path.exists(self.index_filename):
+            return None
+
+        with pd.HDFStore(self.index_filename, 'r') as store:
+            if '/' + key not in store.keys():
+                return None
+            return store[key]
+
+    def _write(self, key, data):
+        with pd.HDFStore(self.index_filename, 'a', complevel=9, complib='blosc') as store:
+            store.put(key, data, format='table', data_columns=True)
+
+    def refresh_datasets(self, tantalus_api):
+        """ Refresh the cached dataset listings.
+        """
+        datasets, dataset_files = list_dataset_files(tantalus_api)
+        self._write('datasets', datasets)
+        self._write('dataset_files', dataset_files)
+
+    def refresh_storage(self, tantalus_api, storage_name, full=False):
+        """ Refresh the usage of a single storage, keeping other storages.
+
+        Only file instances created since the previous refresh are listed,
+        together with the deleted instances of the storage.  Indexed
+        instances now deleted are removed, and instances deleted at the
+        previous refresh and no longer deleted are fetched and restored.
+
+        KwArgs:
+            full (bool): list all file instances of the storage
+        """
+        datasets = self._read('datasets')
+        dataset_files = self._read('dataset_files')
+
+        if datasets is None or dataset_files is None:
+            raise ValueError('no datasets in index {}, refresh datasets first'.format(self.index_filename))
+
+        files = self._read('files')
+        deleted_files = self._read('deleted_files')
+
+        storage_files = None
+        if files is not None:
+            storage_files = files[files['storage'] == storage_name]
+            files = files[files['storage'] != storage_name]
+
+        previous_deleted_ids = set()
+        if deleted_files is not None:
+            previous_deleted_ids = set(deleted_files.loc[deleted_files['storage'] == storage_name, 'file_instance_id'])
+            deleted_files = deleted_files[deleted_files['storage'] != storage_name]
+
+        # Instance ids increase with creation, the largest indexed id is the high water mark
+        after_id = None
+        if not full and storage_files is not None and not storage_files.empty:
+            after_id = int(storage_files['file_instance_id'].max())
+
+        new_files = list_storage_files(tantalus_api, storage_name, after_id=after_id)
+        storage_deleted_files = list_storage_files(tantalus_api, storage_name, is_deleted=True)
+
+        if after_id is None:
+            storage_files = new_files
+
+        else:
+            deleted_ids = set(storage_deleted_files['file_instance_id'])
+
+            # Instances undeleted since the previous refresh, later instances are in the new files
+            undeleted_ids = sorted(a for a in previous_deleted_ids - deleted_ids if a <= after_id)
+            undeleted_files = get_storage_files(tantalus_api, storage_name, undeleted_ids)
+
+            is_deleted = storage_files['file_instance_id'].isin(deleted_ids)
+            storage_files = storage_files[~is_deleted]
+
+            log.info('removed {} deleted and restored {} undeleted files on storage {}'.format(
+                is_deleted.sum(), len(undeleted_files.index), storage_name))
+
+            for added_files in (new_files, undeleted_files):
+                if not added_files.empty:
+                    storage_files = pd.concat([storage_files, added_files], ignore_index=True)
+
+        storage_deleted_files = storage_deleted_files[['storage', 'file_instance_id']]
+        if deleted_files is not None and not deleted_files.empty:
+            storage_deleted_files = pd.concat([deleted_files, storage_deleted_files], ignore_index=True)
+
+        self._write('deleted_files', storage_deleted_files)
+
+        if files is not None and not files.empty:
+            files = pd.concat([files, storage_files], ignore_index=True)
+        else:
+            files = storage_files
+
+        self._write('files', files)
+
+        storage_usage = compute_storage_usage(storage_name, storage_files, datasets, dataset_files)
+
+        usage = self._read('usage')
+        if usage is not None:
+            usage = usage[usage['storage'] != storage_name]
+            storage_usage = pd.concat([usage, storage_usage], ignore_index=True)
+
+        self._write('usage', storage_usage)
+
+    def get_usage(self, storage_name=None):
+        """ Get the indexed usage, optionally for a single storage.
+        """
+        usage = self._read('usage')
+
+        if usage is None:
+            raise ValueError('no usage in index {}'.format(self.index_filename))
+
+        if storage_name is not None:
+            usage = usage[usage['storage'] == storage_name]
+
+        return usage
+
+    def top_datasets(self, storage_name, n=20):
+        """ Get the n largest datasets on a storage.
+        """
+        return self.get_usage(storage_name).nlargest(n, 'bytes')
+
+    def summarize(self, by, storage_name=None):
+        """ Get total bytes and files grouped by one or more usage columns.
+        """
+        return self.get_usage(storage_name).groupby(by).agg(
+            num_files=('num_files', 'sum'),
+            bytes=('bytes', 'sum'),
+            last_updated=('last_updated', 'max'),
+        ).sort_values('bytes', ascending=False)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command('refresh')
+@click.argument('index_filename')
+@click.argument('storage_name', nargs=-1)
+@click.option('--datasets', is_flag=True, help='refresh dataset listings before storages')
+@click.option('--full', is_flag=True, help='list all files of each storage rather than new files only')
+def refresh_cmd(index_filename, storage_name, datasets=False, full=False):
+    tantalus_api = TantalusApi()
+
+    index = StorageUsageIndex(index_filename)
+
+    if datasets:
+        index.refresh_datasets(tantalus_api)
+
+    for name in storage_name:
+        index.refresh_storage(tantalus_api, name, full=full)
+
+
+@cli.command('top')
+@click.argument('index_filename')
+@click.argument('storage_name')
+@click.option('-n', '--num_datasets', type=int, default=20)
+def top_cmd(index_filename, storage_name, num_datasets=20):
+    index = StorageUsageIndex(index_filename)
+    print(index.top_datasets(storage_name, n=num_datasets).to_string(index=False))
+
+
+@cli.command('summary')
+@click.argument('index_filename')
+@click.option('--by', multiple=True, default=['storage'],
+              type=click.Choice(['storage', 'dataset_type', 'library', 'sample', 'analysis']))
+@click.option('--storage_name')
+def summary_cmd(index_filename, by, storage_name=None):
+    index = StorageUsageIndex(index_filename)
+    print(index.summarize(list(by), storage_name=storage_name).to_string())
+
+
+if __name__ == "__main__":
+    # Set up the root logger
+    logging.basicConfig(format=LOGGING_FORMAT, stream=sys.stderr, level=logging.INFO)
+
+    cli()
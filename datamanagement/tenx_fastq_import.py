@@ -15,6 +15,8 @@ import socket
 import logging
 import paramiko
 import subprocess
+import threading
+import queue
 
 import pandas as pd
 from Bio import SeqIO
@@ -46,6 +48,8 @@ CMDLINE_REGEX = r".*--fastqs=([^\s]*).*"
 CMDLINE_FASTQ_REGEX = r".+/((\d{6}_[\w]{8}_[\d]{4}_[\w]+)/.+)"
 BIGWIGS_BASE_PATH = "/brcwork/patientdata"
 TENX_FASTQ_TMP_DIR = '/shahlab/archive/fastq_tmp'
+TRANSFER_NUM_UPLOADS = 4
+TRANSFER_MAX_TMP_BYTES = 200 * 1024 * 1024 * 1024
 COLOSSUS_SEQUENCING_MAP = {
     "NextSeq500": "N500",
     "HiSeq-28": "H2500",
@@ -298,12 +302,39 @@ def upload_to_blob(blob_name, source_path, storage, storage_client):
     return blob_path
 
 
-def transfer_fastq(fastq_path_info, output_dir, storage, sequencing_centre, sftp_client=None):
+def _fetch_fastq(source_path, tmp_dest_path):
+    """
+    Copies a FASTQ from a remote server to a local temp path with rsync
+
+    Args:
+        source_path:    (str) remote path including the host
+        tmp_dest_path:  (str) local destination path
+    """
+    cmd = [
+        "rsync",
+        "-avPL",
+        source_path,
+        tmp_dest_path
+    ]
+    logging.info("Copying tmp file to {}".format(tmp_dest_path))
+    subprocess.check_call(cmd)
+
+
+def transfer_fastq(
+        fastq_path_info, output_dir, storage, sequencing_centre, sftp_client=None,
+        num_uploads=TRANSFER_NUM_UPLOADS, max_tmp_bytes=TRANSFER_MAX_TMP_BYTES,
+        fastq_callback=None):
     """
     Transfers FASTQ files from remote server to Azure storage. If the files are on a different
     machine than the local machine, the FASTQs are first transferred to the local and then 
     uploaded to Azure from the tmp directory
 
+    Transfers are pipelined: remote fetches run ahead of concurrent uploads
+    through a bounded queue, and each tmp file is removed once its upload
+    completes.  Fetching waits while the tmp files not yet uploaded would
+    exceed max_tmp_bytes, a single file larger than the cap is still fetched
+    once all other tmp files are uploaded.
+
     Args:
         fastq_path_info:    (dataframe) holds source path, destination path, and fastq name
                             for each fastq for the library
@@ -311,6 +342,10 @@ def transfer_fastq(fastq_path_info, output_dir, storage, sequencing_centre, sftp
         storage_name:       (str) name of the azure storage in tantalus
         sftp_client:        (object) sftp client if the file is 
                             on a remote server
+        num_uploads:        (int) number of concurrent uploads
+        max_tmp_bytes:      (int) maximum size of tmp files awaiting upload
+        fastq_callback:     (callable) called with the local path of each fastq
+                            before it is uploaded
 
     Returns:
         blob_paths: (list) list of all the blob names added to azure
@@ -322,37 +357,100 @@ def transfer_fastq(fastq_path_info, output_dir, storage, sequencing_centre, sftp
 
     storage_client = tantalus_api.get_storage_client(storage["name"])
 
-    blob_paths = []
-    for index, row in fastq_path_info.iterrows():
-        # Transfer to tmp dir if the files are not on the local machine
-        if sftp_client:
-            if sequencing_centre == "BCCAGSC":
-                source_path = "thost:" + row["fastq_source_path"]
-            elif sequencing_centre == "UBCBRC":
-                source_path = "bigwigs:" + row["fastq_source_path"]
-
-            tmp_dest_path = os.path.join(output_dir, row["fastq_name"])
-
-            # Transfer to temp directory
-            cmd = [
-                "rsync",
-                "-avPL",
-                source_path,
-                tmp_dest_path
-            ]
-            logging.info("Copying tmp file to {}".format(tmp_dest_path))
-            subprocess.check_call(cmd)
-        else:
-            tmp_dest_path = row["fastq_source_path"]
-
-        logging.info("Uploading {} to Azure storage {}".format(row["fastq_name"], storage["name"]))
-        blob_path = upload_to_blob(
-            row["fastq_dest_path"], 
-            tmp_dest_path, 
-            storage, 
-            storage_client
-        )
-        blob_paths.append(blob_path)
+    rows = fastq_path_info[["fastq_name", "fastq_source_path", "fastq_dest_path"]].values.tolist()
+
+    blob_paths = [None] * len(rows)
+    upload_queue = queue.Queue(maxsize=num_uploads)
+    tmp_bytes = {"pending": 0}
+    tmp_bytes_changed = threading.Condition()
+    errors = []
+
+    def _release(size):
+        with tmp_bytes_changed:
+            tmp_bytes["pending"] -= size
+            tmp_bytes_changed.notify_all()
+
+    def _fetch_all():
+        try:
+            for idx, (fastq_name, fastq_source_path, fastq_dest_path) in enumerate(rows):
+                if errors:
+                    break
+
+                # Transfer to tmp dir if the files are not on the local machine
+                if not sftp_client:
+                    upload_queue.put((idx, fastq_name, fastq_dest_path, fastq_source_path, 0))
+                    continue
+
+                if sequencing_centre == "BCCAGSC":
+                    source_path = "thost:" + fastq_source_path
+                elif sequencing_centre == "UBCBRC":
+                    source_path = "bigwigs:" + fastq_source_path
+
+                tmp_dest_path = os.path.join(output_dir, fastq_name)
+                size = sftp_client.stat(fastq_source_path).st_size
+
+                with tmp_bytes_changed:
+                    tmp_bytes_changed.wait_for(
+                        lambda: errors or tmp_bytes["pending"] == 0 or tmp_bytes["pending"] + size <= max_tmp_bytes)
+                    tmp_bytes["pending"] += size
+
+                if errors:
+                    break
+
+                _fetch_fastq(source_path, tmp_dest_path)
+                upload_queue.put((idx, fastq_name, fastq_dest_path, tmp_dest_path, size))
+
+        except Exception as e:
+            logging.exception("failed to fetch fastqs")
+            errors.append(e)
+
+        finally:
+            for _ in range(num_uploads):
+                upload_queue.put(None)
+
+    def _upload_all():
+        while True:
+            item = upload_queue.get()
+            if item is None:
+                break
+
+            idx, fastq_name, fastq_dest_path, tmp_dest_path, size = item
+
+            try:
+                if errors:
+                    continue
+
+                if fastq_callback is not None:
+                    fastq_callback(tmp_dest_path)
+
+                logging.info("Uploading {} to Azure storage {}".format(fastq_name, storage["name"]))
+                blob_paths[idx] = upload_to_blob(
+                    fastq_dest_path, 
+                    tmp_dest_path, 
+                    storage, 
+                    storage_client
+                )
+
+            except Exception as e:
+                logging.exception("failed to upload {}".format(fastq_name))
+                errors.append(e)
+
+            finally:
+                if sftp_client:
+                    if os.path.exists(tmp_dest_path):
+                        os.remove(tmp_dest_path)
+                    _release(size)
+
+    threads = [threading.Thread(target=_fetch_all)]
+    threads += [threading.Thread(target=_upload_all) for _ in range(num_uploads)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise Exception("failed to transfer {} fastqs".format(len(errors))) from errors[0]
 
     return blob_paths
 
@@ -421,21 +519,48 @@ def get_brc_fastq_info(results_path, library_id, sample_id, sftp_client):
     return path_info
 
 
-def get_brc_sequencing_info(fastq_dir):
+def read_fastq_lane_info(fastq_file):
+    """
+    Reads the lane info from the first record of a fastq
+
+    Args:
+        fastq_file: (str) path to a local fastq
+    Returns:
+        (lane_number, sequencing instrument, flowcell ID) or None
+        if the file is not a fastq
+    """
+    if fastq_file.endswith(".fastq.gz"):
+        read_file = gzip.open(fastq_file, "rt")
+    elif fastq_file.endswith(".fastq"):
+        read_file = open(fastq_file, "r")
+    else:
+        return None
+
+    with read_file:
+        records = SeqIO.parse(read_file, "fastq")
+
+        # Get the lane info from the fastq
+        split_id = next(records).id.split(":")
+
+    instrument = split_id[0]
+    flowcell_id = split_id[2]
+    lane_number = split_id[3]
+
+    return lane_number, instrument, flowcell_id
+
+
+def get_brc_sequencing_info(fastq_lanes):
     """
     Gets lane info for libraries sequenced at the BRC
 
     Args:
-        fastq_dir:  (str) the local directory where the fastqs
-                    were transferred to
+        fastq_lanes:    (list) lane info read from each fastq with
+                        read_fastq_lane_info
     Returns:
         lane_infos: (list) a list of dictionaries containing lane
                     numner, sequencing instrument, and flowcell ID
                     for each lane
     """
-    if not os.path.exists(fastq_dir):
-        raise Exception("The output directory {} does not exist".format(fastq_dir))
-
     lane_number_map = {
         "1": {"lane_number": "1", "source_fastqs": []},
         "2": {"lane_number": "2", "source_fastqs": []},
@@ -443,29 +568,18 @@ def get_brc_sequencing_info(fastq_dir):
         "4": {"lane_number": "4", "source_fastqs": []}
     }
 
-    # Read each fastq in the directory
-    for fastq in os.listdir(fastq_dir):
-        fastq_file = os.path.join(fastq_dir, fastq)
-        if fastq_file.endswith(".fastq.gz"):
-            read_file = gzip.open(fastq_file, "rb")
-        elif fastq_file.endswith(".fastq"):
-            read_file = fastq_file
-        else:
+    for fastq_lane in fastq_lanes:
+        if fastq_lane is None:
             continue
-        records = SeqIO.parse(read_file, "fastq")
 
-        # Get the lane info from the fastq
-        split_id = next(records).id.split(":")
-        instrument = split_id[0]
-        flowcell_id = split_id[2]
-        lane_number = split_id[3]
+        lane_number, instrument, flowcell_id = fastq_lane
 
         lane_dict = lane_number_map[str(lane_number)]
         lane_dict["sequencing_instrument"] = instrument
         lane_dict["flowcell_id"] = flowcell_id
 
     lane_infos = []
-    for key, val in LANE_NUMBER_MAP.iteritems():
+    for key, val in lane_number_map.items():
         lane_infos.append(val)
 
     return lane_infos
@@ -516,10 +630,14 @@ def brc(**kwargs):
     # Transfer FASTQs to Azure
     storage = tantalus_api.get_storage("scrna_fastq")
     tmp_output_dir = os.path.join(TENX_FASTQ_TMP_DIR, "_".join([sample_id, kwargs["library_id"]]))
-    blob_paths = transfer_fastq(fastq_path_info_tmp, tmp_output_dir, storage, "UBCBRC", sftp_client)
+    # Read the sequencing lane info from each fastq before its tmp copy is removed
+    fastq_lanes = []
+    blob_paths = transfer_fastq(
+        fastq_path_info_tmp, tmp_output_dir, storage, "UBCBRC", sftp_client,
+        fastq_callback=lambda fastq_file: fastq_lanes.append(read_fastq_lane_info(fastq_file)))
 
     # Get the sequencing lane info
-    lane_infos = get_brc_sequencing_info(tmp_output_dir)
+    lane_infos = get_brc_sequencing_info(fastq_lanes)
 
     # Upload to tantalus
     tantalus_import(
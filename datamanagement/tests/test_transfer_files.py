@@ -0,0 +1,350 @@
+import os
+import unittest
+from unittest import mock
+
+from dbclients.tantalus import DataCorruptionError, DataMissingError
+from datamanagement import transfer_files
+
+
+SOURCE_STORAGE = {'name': 'source', 'storage_container': 'source_container'}
+DESTINATION_STORAGE = {'name': 'destination', 'storage_container': 'destination_container'}
+
+
+def _file_instance(filename, size):
+    return {
+        'id': size,
+        'filepath': '/source/' + filename,
+        'storage': SOURCE_STORAGE,
+        'file_resource': {'filename': filename, 'size': size},
+    }
+
+
+class FakeBlobClient(object):
+    """ Blob storage client with scripted copy results.
+
+    Copies start with the results in start_results for each blob, by default
+    succeeding immediately.  Polls of pending copies return the results in
+    poll_results for each blob, with None for a blob that no longer exists.
+    """
+
+    def __init__(self, sizes):
+        self.sizes = dict(sizes)
+        self.start_results = {}
+        self.poll_results = {}
+        self.started = []
+        self.polls = []
+
+    def list_properties(self, directory):
+        return [(a, b, None) for a, b in self.sizes.items() if os.path.dirname(a) == directory]
+
+    def get_url(self, blobname, container_sas=False):
+        return 'https://source/' + blobname
+
+    def start_copy(self, blobname, source_url):
+        self.started.append(blobname)
+        result = self.start_results.get(blobname, ['success']).pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def get_copy_status(self, blobnames, max_workers=8):
+        self.polls.append(sorted(blobnames))
+        copy_status = {}
+        for blobname in blobnames:
+            result = self.poll_results[blobname].pop(0)
+            if result is not None:
+                copy_status[blobname] = result
+        return copy_status
+
+
+class TestBlobCopyOrchestrator(unittest.TestCase):
+
+    def setUp(self):
+        self.file_instances = [
+            _file_instance('a/1', 10),
+            _file_instance('a/2', 20),
+            _file_instance('b/3', 30),
+        ]
+
+        self.source_client = FakeBlobClient({'a/1': 10, 'a/2': 20, 'b/3': 30})
+        self.destination_client = FakeBlobClient({})
+
+        tantalus_api = mock.Mock()
+        tantalus_api.get_storage_client.side_effect = {
+            'source': self.source_client,
+            'destination': self.destination_client,
+        }.get
+
+        self.orchestrator = transfer_files.BlobCopyOrchestrator(
+            tantalus_api, SOURCE_STORAGE, DESTINATION_STORAGE, max_workers=2)
+
+        self.completed = []
+
+        patcher = mock.patch.object(transfer_files.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _copy(self, overwrite=False):
+        return self.orchestrator.copy(
+            [(a, overwrite) for a in self.file_instances],
+            on_complete=lambda a: self.completed.append(a['file_resource']['filename']))
+
+    def test_copy(self):
+        self.destination_client.sizes = {'a/1': 10}
+
+        failed = self._copy()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(self.completed), ['a/1', 'a/2', 'b/3'])
+
+        # Existing identical blobs are not copied again
+        self.assertEqual(sorted(self.destination_client.started), ['a/2', 'b/3'])
+        self.assertEqual(self.destination_client.polls, [])
+
+    def test_pending(self):
+        self.destination_client.start_results = {'a/1': ['pending'], 'a/2': ['pending']}
+        self.destination_client.poll_results = {
+            'a/1': [('pending', None, None), ('success', None, 10)],
+            'a/2': [('success', None, 20)],
+        }
+
+        failed = self._copy()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(self.completed), ['a/1', 'a/2', 'b/3'])
+
+        # Pending copies are polled together in one request
+        self.assertEqual(self.destination_client.polls, [['a/1', 'a/2'], ['a/1']])
+
+    def test_retry(self):
+        self.destination_client.start_results = {
+            'a/1': ['pending', 'pending'],
+            'a/2': ['pending', 'success'],
+            'b/3': [Exception('start failed'), 'success'],
+        }
+        self.destination_client.poll_results = {
+            'a/1': [('failed', 'copy aborted', None), ('success', None, 10)],
+            'a/2': [('success', None, 21)],
+        }
+
+        failed = self._copy()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(self.completed), ['a/1', 'a/2', 'b/3'])
+        self.assertEqual(sorted(self.destination_client.started), ['a/1', 'a/1', 'a/2', 'a/2', 'b/3', 'b/3'])
+
+    def test_retries_exhausted(self):
+        self.destination_client.start_results = {
+            'a/1': [Exception('start failed')] * transfer_files.RETRIES,
+        }
+
+        failed = self._copy()
+
+        self.assertEqual([a['file_resource']['filename'] for a in failed], ['a/1'])
+        self.assertEqual(sorted(self.completed), ['a/2', 'b/3'])
+        self.assertEqual(self.destination_client.started.count('a/1'), transfer_files.RETRIES)
+
+    def test_pending_blob_deleted(self):
+        self.destination_client.start_results = {'a/1': ['pending', 'success']}
+        self.destination_client.poll_results = {'a/1': [None]}
+
+        failed = self._copy()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(self.destination_client.started.count('a/1'), 2)
+        self.assertIn('a/1', self.completed)
+
+    def test_on_complete_failed(self):
+        def _on_complete(file_instance):
+            if file_instance['file_resource']['filename'] == 'a/2':
+                raise Exception('registration failed')
+
+        failed = self.orchestrator.copy([(a, False) for a in self.file_instances], on_complete=_on_complete)
+
+        self.assertEqual([a['file_resource']['filename'] for a in failed], ['a/2'])
+
+    def test_source_missing(self):
+        del self.source_client.sizes['a/2']
+
+        with self.assertRaises(DataMissingError):
+            self._copy()
+
+        self.assertEqual(self.destination_client.started, [])
+
+    def test_source_size_mismatch(self):
+        self.source_client.sizes['a/2'] = 21
+
+        with self.assertRaises(DataCorruptionError):
+            self._copy()
+
+    def test_destination_size_mismatch(self):
+        self.destination_client.sizes = {'a/2': 21}
+
+        with self.assertRaises(transfer_files.FileAlreadyExists):
+            self._copy()
+
+        self.assertEqual(self.destination_client.started, [])
+
+        failed = self._copy(overwrite=True)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(self.destination_client.started), ['a/1', 'a/2', 'b/3'])
+
+
+class TestFairQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = transfer_files._FairQueue()
+
+    def test_empty(self):
+        self.assertIsNone(self.queue.get())
+
+        self.queue.put('a', 1)
+        self.assertEqual(self.queue.get(), ('a', 1))
+        self.assertIsNone(self.queue.get())
+
+    def test_rotate(self):
+        for item in (1, 2, 3):
+            self.queue.put('a', 'a{}'.format(item))
+        for item in (1, 2):
+            self.queue.put('b', 'b{}'.format(item))
+        self.queue.put('c', 'c1')
+
+        items = []
+        while True:
+            result = self.queue.get()
+            if result is None:
+                break
+            key, item = result
+            items.append(item)
+            self.queue.task_done(key)
+
+        # Items of each key in order, interleaved between keys
+        self.assertEqual(items, ['a1', 'b1', 'c1', 'a2', 'b2', 'a3'])
+
+    def test_fewest_active(self):
+        for item in (1, 2, 3):
+            self.queue.put('a', 'a{}'.format(item))
+            self.queue.put('b', 'b{}'.format(item))
+
+        self.assertEqual(self.queue.get(), ('a', 'a1'))
+        self.assertEqual(self.queue.get(), ('b', 'b1'))
+        self.assertEqual(self.queue.get(), ('a', 'a2'))
+
+        # b has fewer active transfers than a
+        self.assertEqual(self.queue.get(), ('b', 'b2'))
+
+        self.queue.task_done('a')
+        self.queue.task_done('a')
+
+        self.assertEqual(self.queue.get(), ('a', 'a3'))
+        self.assertEqual(self.queue.get(), ('b', 'b3'))
+        self.assertIsNone(self.queue.get())
+
+    def test_put_while_active(self):
+        self.queue.put('a', 'a1')
+        self.assertEqual(self.queue.get(), ('a', 'a1'))
+
+        # Keys emptied and refilled keep their active count
+        self.queue.put('a', 'a2')
+        self.queue.put('b', 'b1')
+        self.assertEqual(self.queue.get(), ('b', 'b1'))
+        self.assertEqual(self.queue.get(), ('a', 'a2'))
+
+
+def _sync_instance(filename, size, is_deleted=False, is_folder=False):
+    return {
+        'is_deleted': is_deleted,
+        'file_resource': {'filename': filename, 'size': size, 'is_folder': is_folder},
+    }
+
+
+class TestPlanSync(unittest.TestCase):
+
+    def setUp(self):
+        self.instances = {
+            'source': [
+                _sync_instance('synced', 1),
+                _sync_instance('register', 2),
+                _sync_instance('register_deleted', 3),
+                _sync_instance('missing', 4),
+                _sync_instance('size_mismatch', 5),
+                _sync_instance('source_invalid', 6),
+                _sync_instance('source_missing', 7),
+                _sync_instance('folder', 0, is_folder=True),
+            ],
+            'destination': [
+                _sync_instance('synced', 1),
+                _sync_instance('register_deleted', 3, is_deleted=True),
+                _sync_instance('extra_registered', 8),
+                _sync_instance('extra_deleted', 9, is_deleted=True),
+            ],
+        }
+
+        self.sizes = {
+            'source': {
+                'synced': 1, 'register': 2, 'register_deleted': 3, 'missing': 4,
+                'size_mismatch': 5, 'source_invalid': 60,
+            },
+            'destination': {
+                'synced': 1, 'register': 2, 'register_deleted': 3, 'size_mismatch': 50,
+                'extra_unregistered': 10,
+            },
+        }
+
+        def _list(table_name, storage__name=None, is_deleted=None, file_resource__filename__startswith=''):
+            self.assertEqual(table_name, 'file_instance')
+            return [
+                a for a in self.instances[storage__name]
+                if (is_deleted is None or a['is_deleted'] == is_deleted)
+                and a['file_resource']['filename'].startswith(file_resource__filename__startswith)]
+
+        self.storage_clients = {}
+        for storage_name in ('source', 'destination'):
+            self.storage_clients[storage_name] = mock.Mock()
+            self.storage_clients[storage_name].list_sizes.side_effect = lambda prefix, sizes=self.sizes[storage_name]: [
+                (a, b) for a, b in sizes.items() if a.startswith(prefix)]
+
+        self.tantalus_api = mock.Mock()
+        self.tantalus_api.list.side_effect = _list
+        self.tantalus_api.get_storage_client.side_effect = self.storage_clients.get
+
+    def _plan(self, prefix=''):
+        plan = transfer_files.plan_sync(self.tantalus_api, 'source', 'destination', prefix=prefix)
+
+        result = {}
+        for classification, entries in plan.items():
+            result[classification] = sorted(
+                a if classification == 'extra' else a['file_resource']['filename'] for a in entries)
+        return result
+
+    def test_plan(self):
+        self.assertEqual(self._plan(), {
+            'synced': ['synced'],
+            'register': ['register', 'register_deleted'],
+            'missing': ['missing'],
+            'size_mismatch': ['size_mismatch'],
+            'source_invalid': ['source_invalid', 'source_missing'],
+            'folder': ['folder'],
+            'extra': ['extra_registered', 'extra_unregistered'],
+        })
+
+        # Deleted source instances are not synced
+        source_filters = [a[1] for a in self.tantalus_api.list.call_args_list if a[1]['storage__name'] == 'source']
+        self.assertEqual(source_filters, [{'storage__name': 'source', 'is_deleted': False}])
+
+    def test_prefix(self):
+        self.assertEqual(self._plan(prefix='register'), {
+            'register': ['register', 'register_deleted'],
+        })
+
+        # The prefix is applied by tantalus and the storage listings
+        for call in self.tantalus_api.list.call_args_list:
+            self.assertEqual(call[1]['file_resource__filename__startswith'], 'register')
+        for storage_client in self.storage_clients.values():
+            storage_client.list_sizes.assert_called_once_with('register')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
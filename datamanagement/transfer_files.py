@@ -3,7 +3,10 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
-import datetime
+import collections
+import concurrent.futures
+import functools
+import threading
 import logging
 import os
 import subprocess
@@ -13,8 +16,12 @@ import traceback
 import shutil
 import tempfile
 from datamanagement.utils.constants import LOGGING_FORMAT
-from dbclients.tantalus import TantalusApi, NotFoundError
+from dbclients.tantalus import TantalusApi, DataCorruptionError, DataMissingError
+from dbclients.tantalus import COPY_POLL_INTERVAL, MAX_COPY_POLL_INTERVAL
 from datamanagement.utils.utils import make_dirs
+from datamanagement.utils import local_copy
+from datamanagement.utils.file_cache import FileCache
+from datamanagement.utils.transfer_budget import TransferBudget
 import click
 
 
@@ -35,6 +42,12 @@ if shutil.which('azcopy') is not None:
 else:
     azcopy = False
 
+# Default number of concurrent file transfers of multi dataset transfers
+DEFAULT_MAX_TRANSFERS = 4
+
+# Maximum number of extra files on a destination storage reported by sync
+MAX_REPORTED_EXTRA = 100
+
 
 def run_azcopy(src, dest):
     with tempfile.TemporaryDirectory() as azcopy_temp:
@@ -121,10 +134,13 @@ class AzureBlobServerDownload(object):
         self.to_storage_name = to_storage_name
         self.to_storage_prefix = to_storage_prefix
 
-    def download_from_blob(self, file_instance, overwrite=False):
+    def download_from_blob(self, file_instance, overwrite=False, progress_callback=None):
         """ Download file from blob to a server.
 
         This should be called on the from server.
+
+        A progress callback, for instance from a TransferBudget, is called with
+        bytes downloaded and total bytes, and disables the use of azcopy.
         """
         file_resource = file_instance["file_resource"]
 
@@ -160,7 +176,7 @@ class AzureBlobServerDownload(object):
                 logging.info(f'removing existing file {local_filepath}')
                 os.remove(local_filepath)
 
-        if azcopy:
+        if azcopy and progress_callback is None:
             blob_url = self.storage_client.get_url(cloud_blobname)
             run_azcopy(blob_url, local_filepath)
 
@@ -170,6 +186,7 @@ class AzureBlobServerDownload(object):
                 cloud_blobname,
                 local_filepath,
                 max_concurrency=16,
+                progress_callback=progress_callback,
             )
 
         os.chmod(local_filepath, 0o444)
@@ -186,10 +203,13 @@ class AzureBlobServerUpload(object):
         self.storage_client = tantalus_api.get_storage_client(to_storage["name"])
         self.to_storage = to_storage
 
-    def upload_to_blob(self, file_instance, overwrite=False):
+    def upload_to_blob(self, file_instance, overwrite=False, progress_callback=None):
         """Transfer a file from a server to blob.
 
         This should be called on the from server.
+
+        A progress callback, for instance from a TransferBudget, is called with
+        bytes uploaded and total bytes, and disables the use of azcopy.
         """
         file_resource = file_instance["file_resource"]
 
@@ -226,7 +246,7 @@ class AzureBlobServerUpload(object):
                 logging.info(
                     "overwriting existing file {}".format(file_resource["filename"]))
 
-        if azcopy:
+        if azcopy and progress_callback is None:
             storage_client = self.tantalus_api.get_storage_client(self.to_storage['name'])
             blob_url = storage_client.get_url(cloud_blobname, write_permission=True)
             run_azcopy(local_filepath, blob_url)
@@ -238,79 +258,226 @@ class AzureBlobServerUpload(object):
                 local_filepath,
                 max_concurrency=16,
                 timeout=10 * 60 * 64,
+                progress_callback=progress_callback or TransferProgress().print_progress,
             )
 
 
-class AzureBlobBlobTransfer(object):
-    """ Blob Upload class.
+class BlobCopyOrchestrator(object):
+    """ Server side copies between blob storages.
+
+    Many copies are started concurrently and pending copies are tracked by
+    polling the destination in batches, with a poll interval that grows
+    while no copies complete.
 
     Note: this class only works with tantalus storage as destination.
     """
 
-    def __init__(self, tantalus_api, source_storage, destination_storage):
+    def __init__(self, tantalus_api, source_storage, destination_storage, max_workers=16, max_pending=1000):
         self.tantalus_api = tantalus_api
         self.source_storage = source_storage
         self.destination_storage = destination_storage
+        self.max_workers = max_workers
+        self.max_pending = max_pending
 
-        # Start BlockBlobService for source and destination accounts
-        self.source_account = tantalus_api.get_storage_client(source_storage["name"]).blob_service
-        self.destination_account = tantalus_api.get_storage_client(destination_storage["name"]).blob_service
+        self.source_client = tantalus_api.get_storage_client(source_storage["name"])
+        self.destination_client = tantalus_api.get_storage_client(destination_storage["name"])
 
-        # Get a shared access signature for the source account so that we
-        # can read its private files
-        self.shared_access_sig = self.source_account.generate_container_shared_access_signature(
-            container_name=source_storage["storage_container"],
-            permission=ContainerPermissions.READ,
-            expiry=(datetime.datetime.utcnow() + datetime.timedelta(hours=200)),
-        )
+    def _list_properties(self, storage_client, filenames):
+        directories = sorted(set(os.path.dirname(a) for a in filenames))
 
-    def transfer(self, file_instance, overwrite=False):
-        """ Transfer function aware of source and destination Azure storages.
+        properties = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for directory_properties in executor.map(
+                    lambda directory: list(storage_client.list_properties(directory)), directories):
+                for name, size, created in directory_properties:
+                    properties[name] = size
+
+        return properties
+
+    def _check_copies(self, copies):
+        """ Check sources and existing destinations of copies.
+
+        Returns:
+            list of copies to start, list of copies already complete
         """
-        file_resource = file_instance["file_resource"]
+        filenames = [file_instance["file_resource"]["filename"] for file_instance, _ in copies]
 
-        blobname = file_resource["filename"]
-        source_container = file_instance["storage"]["storage_container"]
-        destination_container = self.destination_storage["storage_container"]
+        source_sizes = self._list_properties(self.source_client, filenames)
+        destination_sizes = self._list_properties(self.destination_client, filenames)
 
-        assert self.source_storage["storage_container"] == source_container
+        to_start = []
+        complete = []
 
-        # Check if file instance exists and size matches
-        self.tantalus_api.check_file(file_instance)
+        for file_instance, overwrite in copies:
+            file_resource = file_instance["file_resource"]
+            blobname = file_resource["filename"]
 
-        # Check any existing file, skip if the same, raise error if different
-        # and we are not overwriting
-        if self.destination_account.exists(destination_container, blobname):
-            if _check_file_same_blob(
-                    self.destination_account,
-                    file_resource, destination_container, blobname):
-                logging.info(
-                    "skipping transfer of file resource {} that matches existing file".format(
-                        file_resource["filename"]))
-                return
-            elif not overwrite:
-                error_message = "target blob {blobname} in container {container} already exists on {storage} with different size".format(
-                    blobname=blobname,
-                    container=destination_container,
-                    storage=self.destination_storage["name"],
-                )
-                raise FileAlreadyExists(error_message)
+            assert self.source_storage["storage_container"] == file_instance["storage"]["storage_container"]
+
+            # Check if file instance exists and size matches
+            if blobname not in source_sizes:
+                raise DataMissingError('file instance {} with path {} doesnt exist on storage {}'.format(
+                    file_instance['id'], file_instance['filepath'], self.source_storage['name']))
+
+            if source_sizes[blobname] != file_resource['size']:
+                raise DataCorruptionError(
+                    'file instance {} with path {} has size {} on storage {} but {} in tantalus'.format(
+                        file_instance['id'], file_instance['filepath'], source_sizes[blobname],
+                        self.source_storage['name'], file_resource['size']))
+
+            # Check any existing file, skip if the same, raise error if different
+            # and we are not overwriting
+            if blobname in destination_sizes:
+                if destination_sizes[blobname] == file_resource["size"]:
+                    logging.info(
+                        "skipping transfer of file resource {} that matches existing file".format(blobname))
+                    complete.append(file_instance)
+                    continue
+
+                elif not overwrite:
+                    raise FileAlreadyExists(
+                        "target blob {blobname} in container {container} already exists on {storage} with different size".format(
+                            blobname=blobname,
+                            container=self.destination_storage["storage_container"],
+                            storage=self.destination_storage["name"],
+                        ))
+
+                else:
+                    logging.info("overwriting existing file {}".format(blobname))
+
+            to_start.append(file_instance)
+
+        return to_start, complete
+
+    def _start_copy(self, file_instance):
+        blobname = file_instance["file_resource"]["filename"]
+        source_url = self.source_client.get_url(blobname, container_sas=True)
+        return self.destination_client.start_copy(blobname, source_url)
+
+    def copy(self, copies, on_complete=None):
+        """ Copy many files between the storages.
+
+        Args:
+            copies (list): pairs of file instance on the source storage and overwrite flag
+
+        KwArgs:
+            on_complete (callable): called with the source file instance of each completed copy
+
+        Returns:
+            list of file instances that could not be copied
+        """
+        to_start, complete = self._check_copies(copies)
+
+        to_start = collections.deque((a, 0) for a in to_start)
+        pending = {}
+        failed = []
+        complete_futures = {}
+
+        logging.info("copying {} files from {} to {}, {} already copied".format(
+            len(to_start), self.source_storage["name"], self.destination_storage["name"], len(complete)))
+
+        def _retry(file_instance, attempts, error):
+            logging.error("copy of {} failed: {}".format(file_instance["file_resource"]["filename"], error))
+            if attempts + 1 < RETRIES:
+                to_start.append((file_instance, attempts + 1))
             else:
-                logging.info(
-                    "overwriting existing file {}".format(file_resource["filename"]))
+                logging.error("Failed all retry attempts")
+                failed.append(file_instance)
 
-        # Finally, transfer the file between the blobs
-        source_sas_url = self.source_account.make_blob_url(
-            container_name=file_instance["storage"]["storage_container"],
-            blob_name=blobname,
-            sas_token=self.shared_access_sig,
-        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            def _complete(file_instance):
+                if on_complete is not None:
+                    complete_futures[executor.submit(on_complete, file_instance)] = file_instance
 
-        self.destination_account.copy_blob(
-            container_name=self.destination_storage["storage_container"],
-            blob_name=blobname,
-            copy_source=source_sas_url,
-        )
+            for file_instance in complete:
+                _complete(file_instance)
+
+            interval = COPY_POLL_INTERVAL
+
+            while to_start or pending:
+                # Start copies up to the maximum number pending
+                starting = []
+                while to_start and len(pending) + len(starting) < self.max_pending:
+                    starting.append(to_start.popleft())
+
+                start_futures = [(executor.submit(self._start_copy, a[0]), a) for a in starting]
+
+                for future, (file_instance, attempts) in start_futures:
+                    try:
+                        copy_status = future.result()
+                    except Exception as e:
+                        _retry(file_instance, attempts, e)
+                        continue
+
+                    if copy_status == 'success':
+                        _complete(file_instance)
+                    else:
+                        pending[file_instance["file_resource"]["filename"]] = (file_instance, attempts)
+
+                if not pending:
+                    continue
+
+                time.sleep(interval)
+
+                copy_status = self.destination_client.get_copy_status(list(pending), max_workers=self.max_workers)
+
+                num_finished = 0
+                for blobname, (status, status_description, size) in copy_status.items():
+                    if status == 'pending':
+                        continue
+
+                    file_instance, attempts = pending.pop(blobname)
+                    num_finished += 1
+
+                    if status != 'success':
+                        _retry(file_instance, attempts, '{} {}'.format(status, status_description))
+
+                    elif size != file_instance["file_resource"]["size"]:
+                        _retry(file_instance, attempts, 'copied size {} mismatches recorded size {}'.format(
+                            size, file_instance["file_resource"]["size"]))
+
+                    else:
+                        _complete(file_instance)
+
+                # Destination blobs deleted, or left absent by an aborted copy
+                for blobname in [a for a in pending if a not in copy_status]:
+                    file_instance, attempts = pending.pop(blobname)
+                    num_finished += 1
+                    _retry(file_instance, attempts, 'destination blob no longer exists')
+
+                # Poll more often while copies are completing, back off otherwise
+                if num_finished:
+                    interval = max(interval / 2, COPY_POLL_INTERVAL)
+                else:
+                    interval = min(interval * 2, MAX_COPY_POLL_INTERVAL)
+
+                logging.info("{} copies pending, {} waiting to start, {} failed".format(
+                    len(pending), len(to_start), len(failed)))
+
+        for future, file_instance in complete_futures.items():
+            try:
+                future.result()
+            except Exception:
+                logging.exception("failed to complete copy of {}".format(file_instance["file_resource"]["filename"]))
+                failed.append(file_instance)
+
+        return failed
+
+
+class AzureBlobBlobTransfer(object):
+    """ Blob to blob transfer class.
+
+    Note: this class only works with tantalus storage as destination.
+    """
+
+    def __init__(self, tantalus_api, source_storage, destination_storage):
+        self.orchestrator = BlobCopyOrchestrator(tantalus_api, source_storage, destination_storage)
+
+    def transfer(self, file_instance, overwrite=False):
+        """ Transfer function aware of source and destination Azure storages.
+        """
+        if self.orchestrator.copy([(file_instance, overwrite)]):
+            raise Exception("copy of {} failed".format(file_instance["file_resource"]["filename"]))
 
 
 class RsyncTransfer(object):
@@ -319,13 +486,17 @@ class RsyncTransfer(object):
     Note: this class works with a tantalus storage or directory as destination.
     """
 
-    def __init__(self, to_storage_name, to_storage_prefix, local_transfer=False):
+    def __init__(self, to_storage_name, to_storage_prefix, local_transfer=False, bytes_per_second=None):
         self.to_storage_name = to_storage_name
         self.to_storage_prefix = to_storage_prefix
         self.local_transfer = local_transfer
+        self.bytes_per_second = bytes_per_second
 
-    def rsync_file(self, file_instance, overwrite=False):
+    def rsync_file(self, file_instance, overwrite=False, progress_callback=None):
         """ Rsync a single file from one storage to another
+
+        Remote transfers are limited to bytes_per_second, and reported to the
+        progress callback once complete.
         """
         file_resource = file_instance["file_resource"]
 
@@ -353,12 +524,24 @@ class RsyncTransfer(object):
                 logging.info(f'removing existing file {local_filepath}')
                 os.remove(local_filepath)
 
-        if file_instance["storage"]["server_ip"] == self.local_transfer:
-            remote_location = remote_filepath
-        else:
-            remote_location = file_instance["storage"]["server_ip"] + ":" + remote_filepath
+        make_dirs(os.path.dirname(local_filepath.rstrip("/")))
 
-        make_dirs(os.path.dirname(local_filepath))
+        # Copy in process between storages on the same server
+        if self.local_transfer:
+            if file_instance["file_resource"]["is_folder"]:
+                local_copy.copy_folder(remote_filepath, local_filepath)
+            else:
+                local_copy.copy_file(remote_filepath, local_filepath)
+
+            if not _check_file_same_local(file_instance["file_resource"], local_filepath):
+                error_message = "transfer to {filepath} on {storage} failed".format(
+                    filepath=local_filepath, storage=self.to_storage_name
+                )
+                raise Exception(error_message)
+
+            return
+
+        remote_location = file_instance["storage"]["server_ip"] + ":" + remote_filepath
 
         subprocess_cmd = [
             "rsync",
@@ -375,6 +558,9 @@ class RsyncTransfer(object):
         if file_instance["file_resource"]["is_folder"]:
             subprocess_cmd.insert(1, "-r")
 
+        if self.bytes_per_second:
+            subprocess_cmd.insert(1, "--bwlimit={}".format(max(int(self.bytes_per_second / 1024), 1)))
+
         sys.stdout.flush()
         sys.stderr.flush()
         subprocess.check_call(subprocess_cmd, stdout=sys.stdout, stderr=sys.stderr)
@@ -385,8 +571,11 @@ class RsyncTransfer(object):
             )
             raise Exception(error_message)
 
+        if progress_callback is not None:
+            progress_callback(file_resource["size"], file_resource["size"])
 
-def get_file_transfer_function(tantalus_api, from_storage, to_storage):
+
+def get_file_transfer_function(tantalus_api, from_storage, to_storage, bytes_per_second=None):
     if from_storage["storage_type"] == "blob" and to_storage["storage_type"] == "blob":
         return AzureBlobBlobTransfer(tantalus_api, from_storage, to_storage).transfer
 
@@ -401,7 +590,8 @@ def get_file_transfer_function(tantalus_api, from_storage, to_storage):
     elif from_storage["storage_type"] == "server" and to_storage["storage_type"] == "server":
         local_transfer = (to_storage["server_ip"] == from_storage["server_ip"])
         return RsyncTransfer(
-            to_storage["name"], to_storage["prefix"], local_transfer=local_transfer).rsync_file
+            to_storage["name"], to_storage["prefix"], local_transfer=local_transfer,
+            bytes_per_second=bytes_per_second).rsync_file
 
 
 def get_cache_function(tantalus_api, from_storage, cache_directory):
@@ -426,23 +616,36 @@ def cli():
 @click.argument("tag_name")
 @click.argument("from_storage_name")
 @click.argument("to_storage_name")
-def transfer_tagged_datasets_cmd(tag_name, from_storage_name, to_storage_name):
-    transfer_tagged_datasets(tag_name, from_storage_name, to_storage_name)
+@click.option("--max_workers", type=int, default=DEFAULT_MAX_TRANSFERS)
+@click.option("--max_mbps", type=float, help="bandwidth budget in megabytes per second")
+@click.option("--storage_limit", multiple=True, help="maximum concurrent transfers of a storage as name=limit")
+def transfer_tagged_datasets_cmd(tag_name, from_storage_name, to_storage_name, max_workers=DEFAULT_MAX_TRANSFERS, max_mbps=None, storage_limit=()):
+    transfer_tagged_datasets(
+        tag_name, from_storage_name, to_storage_name, max_workers=max_workers,
+        max_bytes_per_second=max_mbps * 1024 * 1024 if max_mbps else None,
+        storage_limits=parse_storage_limits(storage_limit))
 
 
-def transfer_tagged_datasets(tag_name, from_storage_name, to_storage_name):
+def transfer_tagged_datasets(tag_name, from_storage_name, to_storage_name, max_workers=DEFAULT_MAX_TRANSFERS, max_bytes_per_second=None, storage_limits=None):
     """ Transfer a set of tagged datasets
     """
 
     tantalus_api = TantalusApi()
 
+    # Dataset file instances are resolved repeatedly while transferring datasets
+    tantalus_api.enable_dataset_cache()
+
     tag = tantalus_api.get("tag", name=tag_name)
 
-    for dataset_id in tag['sequencedataset_set']:
-        transfer_dataset(tantalus_api, dataset_id, "sequencedataset", from_storage_name, to_storage_name)
+    datasets = [(a, "sequencedataset") for a in tag['sequencedataset_set']]
+    datasets += [(a, "resultsdataset") for a in tag['resultsdataset_set']]
 
-    for dataset_id in tag['resultsdataset_set']:
-        transfer_dataset(tantalus_api, dataset_id, "resultsdataset", from_storage_name, to_storage_name)
+    failed = transfer_datasets(
+        tantalus_api, datasets, from_storage_name, to_storage_name, max_workers=max_workers,
+        max_bytes_per_second=max_bytes_per_second, storage_limits=storage_limits)
+
+    if failed:
+        raise Exception("failed to transfer {}".format(", ".join("{} {}".format(b, a) for a, b in failed)))
 
 
 @cli.command("cache_tag")
@@ -450,11 +653,13 @@ def transfer_tagged_datasets(tag_name, from_storage_name, to_storage_name):
 @click.argument("from_storage_name")
 @click.argument("cache_directory")
 @click.option("--suffix_filter", required=False)
-def cache_tagged_datasets_cmd(tag_name, from_storage_name, cache_directory, suffix_filter=None):
-    cache_tagged_datasets(tag_name, from_storage_name, cache_directory, suffix_filter=suffix_filter)
+@click.option("--max_cache_bytes", type=int, required=False)
+def cache_tagged_datasets_cmd(tag_name, from_storage_name, cache_directory, suffix_filter=None, max_cache_bytes=None):
+    cache_tagged_datasets(
+        tag_name, from_storage_name, cache_directory, suffix_filter=suffix_filter, max_cache_bytes=max_cache_bytes)
 
 
-def cache_tagged_datasets(tag_name, from_storage_name, cache_directory, suffix_filter=None):
+def cache_tagged_datasets(tag_name, from_storage_name, cache_directory, suffix_filter=None, max_cache_bytes=None):
     """ Cache a set of tagged datasets
     """
 
@@ -465,20 +670,43 @@ def cache_tagged_datasets(tag_name, from_storage_name, cache_directory, suffix_f
     for dataset_id in tag['sequencedataset_set']:
         cache_dataset(
             tantalus_api, dataset_id, "sequencedataset", from_storage_name,
-            cache_directory, suffix_filter=suffix_filter)
+            cache_directory, suffix_filter=suffix_filter, max_cache_bytes=max_cache_bytes)
 
     for dataset_id in tag['resultsdataset_set']:
         cache_dataset(
             tantalus_api, dataset_id, "resultsdataset", from_storage_name,
-            cache_directory, suffix_filter=suffix_filter)
+            cache_directory, suffix_filter=suffix_filter, max_cache_bytes=max_cache_bytes)
 
 
 RETRIES = 3
-def _transfer_files_with_retry(f_transfer, file_instance, overwrite=False):
+
+# Number of concurrent file copies between storages on the same server
+LOCAL_TRANSFER_MAX_WORKERS = 8
+
+
+def _transfer_files_with_retry(f_transfer, file_instance, overwrite=False, file_progress=None, **kwargs):
+    """ Transfer a file, retrying on failure.
+
+    Args:
+        f_transfer: transfer function
+        file_instance: file instance to transfer
+
+    KwArgs:
+        overwrite: overwrite the destination file
+        file_progress: creates a progress callback for each attempt
+
+    Returns:
+        the progress callback of the successful attempt, or None
+    """
     for retry in range(RETRIES):
+        progress = None
+        if file_progress is not None:
+            progress = file_progress()
+            kwargs['progress_callback'] = progress
+
         try:
-            f_transfer(file_instance, overwrite=overwrite)
-            break
+            f_transfer(file_instance, overwrite=overwrite, **kwargs)
+            return progress
         except Exception as e:
             logging.error("Transfer failed. Retrying.")
 
@@ -489,6 +717,44 @@ def _transfer_files_with_retry(f_transfer, file_instance, overwrite=False):
                 raise
 
 
+def _get_dataset_copies(tantalus_api, dataset_id, dataset_model, from_storage, to_storage, suffix_filter=None, overwrite=False):
+    """ Get the file instances of a dataset to transfer, and whether to overwrite each.
+    """
+    if suffix_filter is not None:
+        file_instances = tantalus_api.get_dataset_file_instances(dataset_id, dataset_model, from_storage["name"], filters={'filename__endswith': suffix_filter})
+
+    else:
+        file_instances = tantalus_api.get_dataset_file_instances(dataset_id, dataset_model, from_storage["name"])
+
+    # Instances on the destination, including deleted, from a single listing
+    other_file_instances = {}
+    for other_file_instance in tantalus_api.list(
+            "file_instance", storage__name=to_storage["name"],
+            **{"file_resource__{}__id".format(dataset_model): dataset_id}):
+        other_file_instances[other_file_instance["file_resource"]["id"]] = other_file_instance
+
+    copies = []
+    for file_instance in file_instances:
+        file_resource = file_instance["file_resource"]
+
+        other_file_instance = other_file_instances.get(file_resource["id"])
+
+        if other_file_instance is not None and not other_file_instance['is_deleted']:
+            logging.info(
+                "skipping file resource {} that already exists on storage {}".format(
+                    file_resource["filename"], to_storage["name"]
+                )
+            )
+            continue
+
+        is_deleted_overwrite = (other_file_instance is not None and other_file_instance['is_deleted'])
+        overwrite_file = overwrite or is_deleted_overwrite
+
+        copies.append((file_instance, overwrite_file))
+
+    return copies
+
+
 @cli.command("transfer")
 @click.argument("dataset_id", type=int)
 @click.argument("dataset_model", type=click.Choice(["sequencedataset", "resultsdataset"]))
@@ -498,6 +764,7 @@ def _transfer_files_with_retry(f_transfer, file_instance, overwrite=False):
 @click.option("--overwrite", is_flag=True)
 def transfer_dataset_cmd(dataset_id, dataset_model, from_storage_name, to_storage_name, suffix_filter=None, overwrite=False):
     tantalus_api = TantalusApi()
+    tantalus_api.enable_dataset_cache()
     transfer_dataset(tantalus_api, dataset_id, dataset_model, from_storage_name, to_storage_name, suffix_filter=suffix_filter, overwrite=overwrite)
 
 
@@ -517,32 +784,24 @@ def transfer_dataset(tantalus_api, dataset_id, dataset_model, from_storage_name,
 
     f_transfer = get_file_transfer_function(tantalus_api, from_storage, to_storage)
 
-    if suffix_filter is not None:
-        file_instances = tantalus_api.get_dataset_file_instances(dataset_id, dataset_model, from_storage_name, filters={'filename__endswith': suffix_filter})
+    copies = _get_dataset_copies(
+        tantalus_api, dataset_id, dataset_model, from_storage, to_storage,
+        suffix_filter=suffix_filter, overwrite=overwrite)
 
-    else:
-        file_instances = tantalus_api.get_dataset_file_instances(dataset_id, dataset_model, from_storage_name)
+    # Server side copies between blob storages are run together,
+    # registering each destination instance as its copy completes
+    if from_storage["storage_type"] == "blob" and to_storage["storage_type"] == "blob":
+        orchestrator = BlobCopyOrchestrator(tantalus_api, from_storage, to_storage)
+        failed = orchestrator.copy(
+            copies, on_complete=lambda file_instance: tantalus_api.add_instance(file_instance["file_resource"], to_storage))
+        if failed:
+            raise Exception("failed to copy {} files of {} {}".format(len(failed), dataset_model, dataset_id))
+        return
 
-    for file_instance in file_instances:
+    def _transfer(file_instance_overwrite):
+        file_instance, overwrite_file = file_instance_overwrite
         file_resource = file_instance["file_resource"]
 
-        try:
-            other_file_instance = tantalus_api.get(
-                "file_instance", file_resource=file_resource["id"], storage__name=to_storage["name"])
-        except NotFoundError:
-            other_file_instance = None
-
-        if other_file_instance is not None and not other_file_instance['is_deleted']:
-            logging.info(
-                "skipping file resource {} that already exists on storage {}".format(
-                    file_resource["filename"], to_storage["name"]
-                )
-            )
-            continue
-
-        is_deleted_overwrite = (other_file_instance is not None and other_file_instance['is_deleted'])
-        overwrite_file = overwrite or is_deleted_overwrite
-
         logging.info(
             "starting transfer {} from {} to {}".format(
                 file_resource["filename"], from_storage["name"], to_storage["name"]))
@@ -551,6 +810,385 @@ def transfer_dataset(tantalus_api, dataset_id, dataset_model, from_storage_name,
 
         tantalus_api.add_instance(file_resource, to_storage)
 
+    # Copies between storages on the same server are run concurrently
+    if from_storage["storage_type"] == "server" and to_storage["storage_type"] == "server" and \
+            to_storage["server_ip"] == from_storage["server_ip"]:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=LOCAL_TRANSFER_MAX_WORKERS) as executor:
+            list(executor.map(_transfer, copies))
+        return
+
+    for file_instance_overwrite in copies:
+        _transfer(file_instance_overwrite)
+
+
+class _FairQueue(object):
+    """ Queue of file transfers of many datasets.
+
+    Each transfer is taken from the dataset with the fewest active transfers,
+    rotating between datasets with equal numbers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = collections.OrderedDict()
+        self._active = collections.Counter()
+
+    def put(self, key, item):
+        with self._lock:
+            self._queues.setdefault(key, collections.deque()).append(item)
+
+    def get(self):
+        """ Get the next key and item, or None if the queue is empty.
+        """
+        with self._lock:
+            if not self._queues:
+                return None
+
+            key = min(self._queues, key=lambda a: self._active[a])
+            self._queues.move_to_end(key)
+
+            item = self._queues[key].popleft()
+            if not self._queues[key]:
+                del self._queues[key]
+
+            self._active[key] += 1
+
+            return key, item
+
+    def task_done(self, key):
+        with self._lock:
+            self._active[key] -= 1
+
+
+def transfer_datasets(
+        tantalus_api, datasets, from_storage_name, to_storage_name, max_workers=DEFAULT_MAX_TRANSFERS,
+        max_bytes_per_second=None, storage_limits=None, suffix_filter=None, overwrite=False):
+    """ Transfer many datasets concurrently within a bandwidth budget.
+
+    Files of all datasets are transferred by a shared pool of workers, shared
+    fairly between datasets.  Downloads and uploads are slowed to stay within
+    the bytes per second budget, rsync transfers are each given an equal share
+    of the budget.  Aggregate throughput and ETA are logged periodically.
+
+    Args:
+        tantalus_api (TantalusApi): tantalus api client
+        datasets (list): pairs of dataset id and dataset model
+        from_storage_name (str): source storage
+        to_storage_name (str): destination storage
+
+    KwArgs:
+        max_workers (int): maximum number of concurrent file transfers
+        max_bytes_per_second (float): bandwidth budget of all transfers
+        storage_limits (dict): maximum number of concurrent file transfers by storage name
+        suffix_filter (str): only transfer files with this suffix
+        overwrite (bool): overwrite existing files
+
+    Returns:
+        list of datasets with failed transfers
+    """
+    to_storage = tantalus_api.get("storage", name=to_storage_name)
+    from_storage = tantalus_api.get("storage", name=from_storage_name)
+
+    # Server side copies between blob storages do not use our bandwidth
+    if from_storage["storage_type"] == "blob" and to_storage["storage_type"] == "blob":
+        failed = []
+        for dataset_id, dataset_model in datasets:
+            try:
+                transfer_dataset(
+                    tantalus_api, dataset_id, dataset_model, from_storage_name, to_storage_name,
+                    suffix_filter=suffix_filter, overwrite=overwrite)
+            except Exception:
+                logging.exception(f'failed to transfer {dataset_model} {dataset_id}')
+                failed.append((dataset_id, dataset_model))
+        return failed
+
+    if storage_limits:
+        for storage_name in (from_storage_name, to_storage_name):
+            if storage_name in storage_limits:
+                max_workers = min(max_workers, storage_limits[storage_name])
+
+    budget = TransferBudget(max_bytes_per_second=max_bytes_per_second)
+
+    f_transfer = get_file_transfer_function(
+        tantalus_api, from_storage, to_storage,
+        bytes_per_second=budget.per_transfer_bytes_per_second(max_workers))
+
+    # Rsync limits its own rate and reports completed files
+    throttle = not (from_storage["storage_type"] == "server" and to_storage["storage_type"] == "server")
+
+    def _get_copies(dataset):
+        dataset_id, dataset_model = dataset
+        assert dataset_model in ("sequencedataset", "resultsdataset")
+
+        if tantalus_api.is_dataset_on_storage(dataset_id, dataset_model, to_storage_name):
+            logging.info(f'{dataset_model} {dataset_id} already on {to_storage_name}')
+            return []
+
+        return _get_dataset_copies(
+            tantalus_api, dataset_id, dataset_model, from_storage, to_storage,
+            suffix_filter=suffix_filter, overwrite=overwrite)
+
+    failed = set()
+    queue = _FairQueue()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for dataset, future in [(a, executor.submit(_get_copies, a)) for a in datasets]:
+            try:
+                copies = future.result()
+            except Exception:
+                logging.exception('failed to list files of {} {}'.format(dataset[1], dataset[0]))
+                failed.add(dataset)
+                continue
+
+            budget.add_planned(len(copies), sum(a[0]["file_resource"]["size"] for a in copies))
+
+            for file_instance_overwrite in copies:
+                queue.put(dataset, file_instance_overwrite)
+
+        def _worker():
+            while True:
+                next_transfer = queue.get()
+                if next_transfer is None:
+                    return
+
+                dataset, (file_instance, overwrite_file) = next_transfer
+                file_resource = file_instance["file_resource"]
+
+                try:
+                    logging.info(
+                        "starting transfer {} from {} to {}".format(
+                            file_resource["filename"], from_storage["name"], to_storage["name"]))
+
+                    progress = _transfer_files_with_retry(
+                        f_transfer, file_instance, overwrite=overwrite_file,
+                        file_progress=lambda: budget.file_progress(throttle=throttle))
+
+                    tantalus_api.add_instance(file_resource, to_storage)
+
+                    budget.complete_file(file_resource["size"], progress)
+
+                except Exception:
+                    logging.exception("failed to transfer {}".format(file_resource["filename"]))
+                    failed.add(dataset)
+
+                finally:
+                    queue.task_done(dataset)
+
+        for future in [executor.submit(_worker) for _ in range(max_workers)]:
+            future.result()
+
+    budget.report(force=True)
+
+    return [a for a in datasets if a in failed]
+
+
+def parse_storage_limits(storage_limits):
+    """ Parse storage limits of the form name=limit.
+    """
+    limits = {}
+    for storage_limit in storage_limits:
+        storage_name, limit = storage_limit.split("=")
+        limits[storage_name] = int(limit)
+    return limits
+
+
+def plan_sync(tantalus_api, from_storage_name, to_storage_name, prefix=''):
+    """ Compare two storages from bulk listings.
+
+    File instances of both storages are listed from tantalus and compared
+    with listings of both storages.  Each file instance on the source storage
+    is classified as:
+        synced: registered and intact on the destination
+        register: intact on the destination but not registered
+        missing: not on the destination
+        size_mismatch: on the destination with a different size
+        source_invalid: missing or a different size on the source
+        folder: folder resources, not synced
+    Files on the destination not registered on the source are classified as extra.
+
+    Args:
+        tantalus_api (TantalusApi): tantalus api client
+        from_storage_name (str): source storage
+        to_storage_name (str): destination storage
+
+    KwArgs:
+        prefix (str): only compare files with this filename prefix
+
+    Returns:
+        dict of classification to list of file instances, filenames for extra
+    """
+    from_storage_client = tantalus_api.get_storage_client(from_storage_name)
+    to_storage_client = tantalus_api.get_storage_client(to_storage_name)
+
+    def _list_instances(storage_name, **filters):
+        if prefix:
+            filters['file_resource__filename__startswith'] = prefix
+        instances = {}
+        for file_instance in tantalus_api.list('file_instance', storage__name=storage_name, **filters):
+            instances[file_instance['file_resource']['filename']] = file_instance
+        return instances
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        from_instances = executor.submit(_list_instances, from_storage_name, is_deleted=False)
+        to_instances = executor.submit(_list_instances, to_storage_name)
+        from_sizes = executor.submit(lambda: dict(from_storage_client.list_sizes(prefix)))
+        to_sizes = executor.submit(lambda: dict(to_storage_client.list_sizes(prefix)))
+
+        from_instances = from_instances.result()
+        to_instances = to_instances.result()
+        from_sizes = from_sizes.result()
+        to_sizes = to_sizes.result()
+
+    logging.info('listed {} instances and {} files on {}, {} instances and {} files on {}'.format(
+        len(from_instances), len(from_sizes), from_storage_name,
+        len(to_instances), len(to_sizes), to_storage_name))
+
+    plan = collections.defaultdict(list)
+
+    for filename, file_instance in from_instances.items():
+        file_resource = file_instance['file_resource']
+
+        if file_resource['is_folder']:
+            plan['folder'].append(file_instance)
+
+        elif from_sizes.get(filename) != file_resource['size']:
+            plan['source_invalid'].append(file_instance)
+
+        elif filename not in to_sizes:
+            plan['missing'].append(file_instance)
+
+        elif to_sizes[filename] != file_resource['size']:
+            plan['size_mismatch'].append(file_instance)
+
+        elif filename not in to_instances or to_instances[filename]['is_deleted']:
+            plan['register'].append(file_instance)
+
+        else:
+            plan['synced'].append(file_instance)
+
+    for filename in set(to_sizes).union(a for a in to_instances if not to_instances[a]['is_deleted']):
+        if filename not in from_instances:
+            plan['extra'].append(filename)
+
+    logging.info('sync plan from {} to {}: {}'.format(
+        from_storage_name, to_storage_name, ', '.join('{} {}'.format(len(b), a) for a, b in sorted(plan.items()))))
+
+    return plan
+
+
+def sync_storages(
+        tantalus_api, from_storage_name, to_storage_name, prefix='', max_workers=DEFAULT_MAX_TRANSFERS,
+        max_bytes_per_second=None, dry_run=False):
+    """ Transfer and register files on the source storage missing from the destination.
+
+    Only files missing or differing in size on the destination are transferred,
+    intact files on the destination missing an instance are only registered.
+
+    Args:
+        tantalus_api (TantalusApi): tantalus api client
+        from_storage_name (str): source storage
+        to_storage_name (str): destination storage
+
+    KwArgs:
+        prefix (str): only sync files with this filename prefix
+        max_workers (int): maximum number of concurrent transfers and registrations
+        max_bytes_per_second (float): bandwidth budget of all transfers
+        dry_run (bool): log planned changes without applying them
+
+    Returns:
+        sync plan from plan_sync, and list of file instances that failed
+    """
+    plan = plan_sync(tantalus_api, from_storage_name, to_storage_name, prefix=prefix)
+
+    to_transfer = [(a, False) for a in plan['missing']] + [(a, True) for a in plan['size_mismatch']]
+
+    if dry_run:
+        for file_instance, overwrite in to_transfer:
+            logging.info('would transfer {}{}'.format(
+                file_instance['file_resource']['filename'], ', overwriting' if overwrite else ''))
+        for file_instance in plan['register']:
+            logging.info('would register {}'.format(file_instance['file_resource']['filename']))
+        return plan, []
+
+    to_storage = tantalus_api.get("storage", name=to_storage_name)
+    from_storage = tantalus_api.get("storage", name=from_storage_name)
+
+    def _register(file_instance):
+        tantalus_api.add_instance(file_instance["file_resource"], to_storage)
+
+    failed = []
+
+    # Server side copies between blob storages are run together
+    if from_storage["storage_type"] == "blob" and to_storage["storage_type"] == "blob":
+        failed.extend(BlobCopyOrchestrator(tantalus_api, from_storage, to_storage).copy(
+            to_transfer, on_complete=_register))
+        to_transfer = []
+
+    budget = TransferBudget(max_bytes_per_second=max_bytes_per_second)
+    budget.add_planned(len(to_transfer), sum(a[0]["file_resource"]["size"] for a in to_transfer))
+
+    f_transfer = get_file_transfer_function(
+        tantalus_api, from_storage, to_storage,
+        bytes_per_second=budget.per_transfer_bytes_per_second(max_workers))
+
+    # Rsync limits its own rate and reports completed files
+    throttle = not (from_storage["storage_type"] == "server" and to_storage["storage_type"] == "server")
+
+    def _transfer(file_instance_overwrite):
+        file_instance, overwrite = file_instance_overwrite
+        progress = _transfer_files_with_retry(
+            f_transfer, file_instance, overwrite=overwrite,
+            file_progress=lambda: budget.file_progress(throttle=throttle))
+        _register(file_instance)
+        budget.complete_file(file_instance["file_resource"]["size"], progress)
+
+    tasks = [(_transfer, a, a[0]) for a in to_transfer] + [(_register, a, a) for a in plan['register']]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(executor.submit(f, arg), file_instance) for f, arg, file_instance in tasks]
+
+        for future, file_instance in futures:
+            try:
+                future.result()
+            except Exception:
+                logging.exception("failed to sync {}".format(file_instance["file_resource"]["filename"]))
+                failed.append(file_instance)
+
+    budget.report(force=True)
+
+    logging.info('synced {} files from {} to {}, {} failed'.format(
+        len(tasks), from_storage_name, to_storage_name, len(failed)))
+
+    return plan, failed
+
+
+@cli.command("sync")
+@click.argument("from_storage_name")
+@click.argument("to_storage_name")
+@click.option("--prefix", default='', help="only sync files with this filename prefix")
+@click.option("--max_workers", type=int, default=DEFAULT_MAX_TRANSFERS)
+@click.option("--max_mbps", type=float, help="bandwidth budget in megabytes per second")
+@click.option("--dry_run", is_flag=True)
+def sync_storages_cmd(from_storage_name, to_storage_name, prefix='', max_workers=DEFAULT_MAX_TRANSFERS, max_mbps=None, dry_run=False):
+    tantalus_api = TantalusApi()
+
+    plan, failed = sync_storages(
+        tantalus_api, from_storage_name, to_storage_name, prefix=prefix, max_workers=max_workers,
+        max_bytes_per_second=max_mbps * 1024 * 1024 if max_mbps else None, dry_run=dry_run)
+
+    for file_instance in plan['source_invalid']:
+        logging.warning('file instance {} is missing or has a different size on {}'.format(
+            file_instance['id'], from_storage_name))
+
+    for filename in sorted(plan['extra'])[:MAX_REPORTED_EXTRA]:
+        logging.warning('{} on {} is not on {}'.format(filename, to_storage_name, from_storage_name))
+    if len(plan['extra']) > MAX_REPORTED_EXTRA:
+        logging.warning('and {} more files on {} not on {}'.format(
+            len(plan['extra']) - MAX_REPORTED_EXTRA, to_storage_name, from_storage_name))
+
+    if failed:
+        raise Exception('failed to sync {} files'.format(len(failed)))
+
 
 @cli.command("cache")
 @click.argument("dataset_id", type=int)
@@ -558,15 +1196,20 @@ def transfer_dataset(tantalus_api, dataset_id, dataset_model, from_storage_name,
 @click.argument("from_storage_name")
 @click.argument("cache_directory")
 @click.option("--suffix_filter", required=False)
-def cache_dataset_cmd(dataset_id, dataset_model, from_storage_name, cache_directory, suffix_filter=None):
+@click.option("--max_cache_bytes", type=int, required=False)
+def cache_dataset_cmd(dataset_id, dataset_model, from_storage_name, cache_directory, suffix_filter=None, max_cache_bytes=None):
     tantalus_api = TantalusApi()
-    cache_dataset(tantalus_api, dataset_id, dataset_model, from_storage_name, cache_directory, suffix_filter=suffix_filter)
+    cache_dataset(
+        tantalus_api, dataset_id, dataset_model, from_storage_name, cache_directory,
+        suffix_filter=suffix_filter, max_cache_bytes=max_cache_bytes)
 
 
-def cache_dataset(tantalus_api, dataset_id, dataset_model, from_storage_name, cache_directory, suffix_filter=None):
+def cache_dataset(tantalus_api, dataset_id, dataset_model, from_storage_name, cache_directory, suffix_filter=None, max_cache_bytes=None):
     """ Cache a dataset
+
+    Files are pinned in the cache by the current process, see FileCache.release.
     """
-    cache_client = tantalus_api.get_cache_client(cache_directory)
+    cache = FileCache(cache_directory, max_bytes=max_cache_bytes)
 
     assert dataset_model in ("sequencedataset", "resultsdataset")
 
@@ -590,26 +1233,30 @@ def cache_dataset(tantalus_api, dataset_id, dataset_model, from_storage_name, ca
         logging.info("starting caching {} to {}".format(
                 filename, cache_directory))
 
-        _transfer_files_with_retry(f_transfer, file_instance)
-
-        filepath = cache_client.get_url(file_instance['file_resource']['filename'])
+        filepath = cache.fetch(
+            file_instance['file_resource'],
+            functools.partial(_transfer_files_with_retry, f_transfer, file_instance))
 
         filepaths.append(filepath)
 
     return filepaths
 
 
-def cache_file(tantalus_api, file_instance, cache_directory):
+def cache_file(tantalus_api, file_instance, cache_directory, max_cache_bytes=None):
     """ Cache a single file.
+
+    The file is pinned in the cache by the current process, see FileCache.release.
     """
+    cache = FileCache(cache_directory, max_bytes=max_cache_bytes)
+
     f_transfer = get_cache_function(tantalus_api, file_instance['storage'], cache_directory)
 
     logging.info("starting caching {} from {} to {}".format(
         file_instance['file_resource']['filename'], file_instance['storage']['name'], cache_directory))
 
-    _transfer_files_with_retry(f_transfer, file_instance)
-
-    return os.path.join(cache_directory, file_instance['file_resource']['filename'])
+    return cache.fetch(
+        file_instance['file_resource'],
+        functools.partial(_transfer_files_with_retry, f_transfer, file_instance))
 
 
 if __name__ == "__main__":
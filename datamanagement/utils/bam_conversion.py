@@ -0,0 +1,311 @@
+""" Batch decompression of CRAM and SpEC files to bams on the cluster.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import concurrent.futures
+import logging
+import os
+import socket
+import subprocess
+
+import pandas as pd
+
+from datamanagement.utils.qsub_job_submission import QsubJobBatch
+from datamanagement.utils.utils import parse_ref_genome, connect_to_client
+from dbclients.basicclient import NotFoundError
+
+# Number of concurrent input transfers and bam finalizations
+DEFAULT_MAX_FETCHES = 4
+DEFAULT_MAX_FINALIZE = 4
+
+
+def fetch_input(input_path, local_path, sftp_client=None):
+    """
+    Copies a compressed input from thost to a local path if required
+
+    Args:
+        input_path:     (string) path to the compressed file
+        local_path:     (string) local destination of the file
+        sftp_client:    (sftp object) the sftp client connected to the remote host
+
+    Returns:
+        path to the compressed file on the local machine
+    """
+    if not sftp_client:
+        return input_path
+
+    cmd = [
+        "rsync",
+        "-avPL",
+        "thost:" + input_path,
+        local_path
+    ]
+    remote_file = sftp_client.stat(input_path)
+
+    # Check if the file has been successfully transferred before
+    if not os.path.isfile(local_path) or os.path.getsize(local_path) != remote_file.st_size:
+        logging.info("Copying {} to {}".format(input_path, local_path))
+        subprocess.check_call(cmd)
+
+    return local_path
+
+
+def index_bam(bam_path):
+    """
+    Creates the bam index of a bam
+    """
+    logging.info("Creating bam index at {}".format(bam_path + '.bai'))
+    cmd = [
+        'samtools',
+        'index',
+        bam_path,
+    ]
+    subprocess.check_call(cmd)
+
+    logging.info("Successfully created bam index at {}".format(bam_path + ".bai"))
+
+
+def convert_to_bams(
+        conversions, native_spec, title, sftp_client=None, on_complete=None,
+        max_fetches=DEFAULT_MAX_FETCHES, max_finalize=DEFAULT_MAX_FINALIZE):
+    """
+    Decompresses many files to bams with one cluster queue
+
+    Inputs are fetched concurrently and each job is submitted as soon as its
+    input is available, so input transfers overlap with other jobs running on
+    the cluster. Bams are indexed and passed to on_complete as their jobs
+    finish.
+
+    Args:
+        conversions:    (list) dicts with input_path, local_input_path,
+                        output_bam_path and create_job, a callable creating
+                        the job from the local input path
+        native_spec:    (string) native specifications to use for the jobs
+        title:          (string) title of the batch used for job logs
+        sftp_client:    (sftp object) the sftp client connected to the remote host
+        on_complete:    (callable) called with each successful conversion
+        max_fetches:    (int) maximum number of concurrent input transfers
+        max_finalize:   (int) maximum number of concurrent indexing and on_complete calls
+
+    Returns:
+        failed:     (list) conversions that failed
+    """
+    failed = []
+    job_conversions = {}
+    fetch_futures = {}
+    finalize_futures = {}
+
+    def _finalize(conversion):
+        index_bam(conversion["output_bam_path"])
+
+        # Remove the local copy of a remote input
+        if sftp_client and os.path.exists(conversion["local_input_path"]):
+            os.remove(conversion["local_input_path"])
+
+        if on_complete is not None:
+            on_complete(conversion)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_fetches) as fetch_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max_finalize) as finalize_executor, \
+            QsubJobBatch(native_spec, title) as batch:
+
+        for conversion in conversions:
+            future = fetch_executor.submit(
+                fetch_input, conversion["input_path"], conversion["local_input_path"], sftp_client)
+            fetch_futures[future] = conversion
+
+        while fetch_futures or batch.pending:
+            # Submit jobs for inputs that are ready
+            for future in [a for a in fetch_futures if a.done()]:
+                conversion = fetch_futures.pop(future)
+                try:
+                    local_input_path = future.result()
+                except Exception:
+                    logging.exception("failed to fetch {}".format(conversion["input_path"]))
+                    failed.append(conversion)
+                    continue
+
+                logging.info("Converting {} to {}".format(local_input_path, conversion["output_bam_path"]))
+                try:
+                    job_name = batch.submit(conversion["create_job"](local_input_path))
+                except Exception:
+                    logging.exception("failed to submit conversion of {}".format(conversion["input_path"]))
+                    failed.append(conversion)
+                    continue
+                job_conversions[job_name] = conversion
+
+            if batch.pending:
+                finished = batch.poll()
+                if finished is None:
+                    continue
+
+                job_name, result, error = finished
+                conversion = job_conversions.pop(job_name)
+
+                if error is not None:
+                    logging.error("conversion of {} failed: {}".format(conversion["input_path"], error))
+                    failed.append(conversion)
+                    continue
+
+                logging.info("Successfully created bam at {}".format(conversion["output_bam_path"]))
+                finalize_futures[finalize_executor.submit(_finalize, conversion)] = conversion
+
+            elif fetch_futures:
+                concurrent.futures.wait(list(fetch_futures), return_when=concurrent.futures.FIRST_COMPLETED)
+
+    for future, conversion in finalize_futures.items():
+        try:
+            future.result()
+        except Exception:
+            logging.exception("failed to finalize {}".format(conversion["output_bam_path"]))
+            failed.append(conversion)
+
+    logging.info("converted {} of {} files to bams".format(
+        len(conversions) - len(failed), len(conversions)))
+
+    return failed
+
+
+def bam_exists(tantalus_api, output_bam_path, to_storage):
+    """
+    Checks if the bam exists on the to_storage and in Tantalus with the same size
+    """
+    output_bam_filename = output_bam_path[len(to_storage["prefix"]) + 1:]
+
+    # Check if a decompressed bam already exists in Tantalus
+    # and get its file size
+    try:
+        file_resource = tantalus_api.get(
+                "file_resource",
+                filename=output_bam_filename
+        )
+        file_size = file_resource["size"]
+    except NotFoundError:
+        file_size = None
+
+    return os.path.isfile(output_bam_path) and os.path.getsize(output_bam_path) == file_size
+
+
+def create_bams(
+        tantalus_api, conversions, to_storage, input_key, create_job, native_spec, title,
+        sftp_client=None, on_complete=None):
+    """
+    Creates decompressed bams and bam indices from many compressed files as a
+    single batch of cluster jobs
+
+    Each finished bam and bai is passed to on_complete, which is responsible
+    for adding them to Tantalus. Without on_complete the files are added with
+    add_files.
+
+    Args:
+        tantalus_api:   (TantalusApi) client used to check and add bams
+        conversions:    (list) dicts with input_key, output_bam_path and
+                        raw_reference_genome
+        to_storage:     (dict) the destination storage for the bams
+        input_key:      (string) key of the compressed file path in each
+                        conversion, which is also used as the extension of
+                        local copies
+        create_job:     (callable) creates the job from the local input path,
+                        reference genome and output bam path
+        native_spec:    (string) native specifications to use for the jobs
+        title:          (string) title of the batch used for job logs
+
+    KwArgs:
+        sftp_client:    (sftp object) the sftp client connected to the remote host
+        on_complete:    (callable) called with each bam that exists or was created
+
+    Returns:
+        failed:     (list) conversions that failed
+    """
+    extension = input_key.split("_")[0]
+
+    batch_conversions = []
+    for conversion in conversions:
+        output_bam_path = conversion["output_bam_path"]
+
+        if bam_exists(tantalus_api, output_bam_path, to_storage):
+            logging.warning("An uncompressed BAM file already exists at {} Skipping decompression of {} file".format(
+                output_bam_path, extension))
+            if on_complete is not None:
+                on_complete(conversion)
+            continue
+
+        reference_genome = parse_ref_genome(conversion["raw_reference_genome"])
+
+        # Make the destination directories if they don't exist
+        output_path, filename = os.path.split(output_bam_path)
+        if not os.path.exists(output_path):
+            os.makedirs(output_path)
+
+        batch_conversion = dict(conversion)
+        batch_conversion.update({
+            "input_path": conversion[input_key],
+            "local_input_path": output_bam_path + "." + extension,
+            "create_job": lambda local_path, reference_genome=reference_genome, output_bam_path=output_bam_path: create_job(
+                local_path, reference_genome, output_bam_path),
+        })
+        batch_conversions.append(batch_conversion)
+
+    def _add_files(conversion):
+        tantalus_api.add_files(
+            to_storage["name"],
+            [conversion["output_bam_path"], conversion["output_bam_path"] + ".bai"],
+            update=True,
+        )
+        logging.info("Added bam {} and bai to Tantalus".format(conversion["output_bam_path"]))
+
+    return convert_to_bams(
+        batch_conversions,
+        native_spec,
+        title,
+        sftp_client=sftp_client,
+        on_complete=on_complete if on_complete is not None else _add_files,
+    )
+
+
+def connect_sftp(from_gsc):
+    """
+    Connects to thost if the input files are from the GSC and the script is
+    not being run on thost
+    """
+    hostname = socket.gethostname()
+    if from_gsc and hostname != "txshah":
+        ssh_client = connect_to_client("10.9.208.161")
+        return ssh_client.open_sftp()
+
+    return None
+
+
+def batch_main(tantalus_api, conversions_csv, to_storage_name, input_key, create_bams, from_gsc=False):
+    """
+    Decompresses many files listed in a csv to bams using the cluster in
+    parallel, adding the bams and bam indices to Tantalus as each
+    decompression finishes
+
+    Args:
+        tantalus_api:       (TantalusApi) client used to get the storage
+        conversions_csv:    (string) csv with input_key, output_bam_path
+                            and reference_genome columns
+        to_storage_name:    (string) name of the destination storage for the bams
+        input_key:          (string) column of the compressed file paths
+        create_bams:        (callable) creates bams from conversions and the storage
+
+    KwArgs:
+        from_gsc:           (flag) whether the compressed files are from the GSC
+    """
+    sftp_client = connect_sftp(from_gsc)
+
+    conversions = pd.read_csv(conversions_csv, dtype=str)
+    conversions = conversions.rename(columns={"reference_genome": "raw_reference_genome"})
+
+    try:
+        storage = tantalus_api.get_storage(to_storage_name)
+    except NotFoundError:
+        raise Exception("Storage name {} not found on Tantalus. Please use a valid storage".format(to_storage_name))
+
+    failed = create_bams(conversions.to_dict("records"), storage, sftp_client=sftp_client)
+
+    if failed:
+        raise Exception("failed to decompress {}".format(", ".join(a[input_key] for a in failed)))
@@ -0,0 +1,272 @@
+""" Read bam headers without opening the full bam.
+
+Only the BGZF blocks containing the header text are read, using range
+requests for urls and partial reads for local files.  Parsed headers are
+cached in memory, and on disk if SISYPHUS_BAM_HEADER_CACHE is set to a
+directory, keyed by filename, size and created time.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import Request, urlopen
+
+log = logging.getLogger('sisyphus')
+
+# Size of the first read, doubled for each subsequent read
+INITIAL_READ_SIZE = 64 * 1024
+
+# Maximum size of the compressed header
+MAX_HEADER_BYTES = 64 * 1024 * 1024
+
+BAM_MAGIC = b'BAM\x01'
+
+_header_cache = {}
+_header_cache_lock = threading.Lock()
+
+
+def _read_range(url, start, end):
+    """ Read bytes start to end exclusive of a url or local path.
+    """
+    if os.path.exists(url):
+        with open(url, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    request = Request(url, headers={'Range': 'bytes={}-{}'.format(start, end - 1)})
+    return urlopen(request).read()
+
+
+def _iter_bgzf_blocks(data):
+    """ Decompress complete BGZF blocks at the start of a buffer.
+
+    Yields:
+        uncompressed block data, offset of the end of the block
+    """
+    offset = 0
+    while offset + 18 <= len(data):
+        if data[offset:offset + 4] != b'\x1f\x8b\x08\x04':
+            raise ValueError('invalid BGZF block at offset {}'.format(offset))
+
+        xlen, = struct.unpack('<H', data[offset + 10:offset + 12])
+
+        # Find the BC subfield holding the block size
+        block_size = None
+        extra = data[offset + 12:offset + 12 + xlen]
+        extra_offset = 0
+        while extra_offset + 4 <= len(extra):
+            subfield_id = extra[extra_offset:extra_offset + 2]
+            subfield_len, = struct.unpack('<H', extra[extra_offset + 2:extra_offset + 4])
+            if subfield_id == b'BC':
+                block_size, = struct.unpack('<H', extra[extra_offset + 4:extra_offset + 6])
+                block_size += 1
+            extra_offset += 4 + subfield_len
+
+        if block_size is None:
+            raise ValueError('BGZF block at offset {} has no block size'.format(offset))
+
+        if offset + block_size > len(data):
+            return
+
+        yield zlib.decompress(data[offset:offset + block_size], 31), offset + block_size
+
+        offset += block_size
+
+
+def read_bam_header_text(url):
+    """ Read the header text of a bam from a url or local path.
+
+    Args:
+        url (str): url supporting range requests, or local path
+
+    Returns:
+        header text (str)
+    """
+    compressed = b''
+    consumed = 0
+    uncompressed = b''
+    read_size = INITIAL_READ_SIZE
+
+    while True:
+        data = _read_range(url, consumed + len(compressed), consumed + len(compressed) + read_size)
+        compressed += data
+
+        block_end = 0
+        for block, block_end in _iter_bgzf_blocks(compressed):
+            uncompressed += block
+        compressed = compressed[block_end:]
+        consumed += block_end
+
+        if len(uncompressed) >= 8:
+            if uncompressed[:4] != BAM_MAGIC:
+                raise ValueError('{} is not a bam'.format(url.split('?')[0]))
+            l_text, = struct.unpack('<i', uncompressed[4:8])
+            if len(uncompressed) >= 8 + l_text:
+                return uncompressed[8:8 + l_text].decode('utf-8', errors='replace').rstrip('\x00')
+
+        if len(data) < read_size:
+            raise ValueError('truncated bam header in {}'.format(url.split('?')[0]))
+
+        if consumed + len(compressed) > MAX_HEADER_BYTES:
+            raise ValueError('bam header larger than {} bytes in {}'.format(MAX_HEADER_BYTES, url.split('?')[0]))
+
+        read_size *= 2
+
+
+def parse_bam_header(text):
+    """ Parse bam header text in a single pass.
+
+    Args:
+        text (str): header text
+
+    Returns:
+        dict of record type to list of records, HD as a single record,
+        in the same layout as pysam.AlignmentHeader.to_dict
+    """
+    header = {}
+
+    for line in text.splitlines():
+        if not line.startswith('@'):
+            continue
+
+        fields = line.split('\t')
+        record_type = fields[0][1:]
+
+        if record_type == 'CO':
+            header.setdefault('CO', []).append(line[4:])
+            continue
+
+        record = {}
+        for field in fields[1:]:
+            if ':' not in field:
+                continue
+            key, value = field.split(':', 1)
+            if record_type == 'SQ' and key == 'LN':
+                value = int(value)
+            record[key] = value
+
+        if record_type == 'HD':
+            header['HD'] = record
+        else:
+            header.setdefault(record_type, []).append(record)
+
+    return header
+
+
+def _get_disk_cache_filename(cache_key):
+    cache_dir = os.environ.get('SISYPHUS_BAM_HEADER_CACHE')
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, hashlib.sha1(cache_key.encode()).hexdigest() + '.json')
+
+
+def get_bam_header(storage_client, filename, size, created):
+    """ Get the parsed header of a bam on a storage, using cached headers if available.
+
+    Args:
+        storage_client: storage client of the bam
+        filename (str): filename of the bam relative to the storage
+        size (int): size of the bam
+        created (str): created time of the bam
+
+    Returns:
+        header dict
+    """
+    cache_key = json.dumps([storage_client.prefix, filename, size, created])
+
+    with _header_cache_lock:
+        if cache_key in _header_cache:
+            return _header_cache[cache_key]
+
+    cache_filename = _get_disk_cache_filename(cache_key)
+
+    if cache_filename is not None and os.path.exists(cache_filename):
+        with open(cache_filename) as f:
+            header = json.load(f)
+
+    else:
+        header = parse_bam_header(read_bam_header_text(storage_client.get_url(filename)))
+
+        if cache_filename is not None:
+            os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+            with open(cache_filename + '.tmp', 'w') as f:
+                json.dump(header, f)
+            os.rename(cache_filename + '.tmp', cache_filename)
+
+    with _header_cache_lock:
+        _header_cache[cache_key] = header
+
+    return header
+
+
+def inspect_bams(storage_client, filenames, max_workers=8):
+    """ Read the headers of many bams on a storage concurrently.
+
+    Sizes, created times and the presence of bam indices are obtained from
+    one listing of each directory containing several bams, and by looking up
+    the bam and its index directly for a directory containing a single bam.
+
+    Args:
+        storage_client: storage client of the bams
+        filenames (list): filenames of the bams relative to the storage
+
+    KwArgs:
+        max_workers (int): maximum number of concurrent header reads
+
+    Returns:
+        dict of filename to dict with header, size, created and has_index
+    """
+    directory_filenames = collections.defaultdict(list)
+    for filename in filenames:
+        directory_filenames[os.path.dirname(filename)].append(filename)
+
+    def _get_properties(directory):
+        # Listing a large directory for a single bam costs more
+        # than looking up the bam and its index
+        if len(directory_filenames[directory]) == 1:
+            filename = directory_filenames[directory][0]
+            for name in (filename, filename + '.bai'):
+                name_properties = storage_client.get_properties(name)
+                if name_properties is not None:
+                    size, created = name_properties
+                    yield name, size, created
+
+        else:
+            for name, size, created in storage_client.list_properties(directory):
+                yield name, size, created
+
+    properties = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for directory_properties in executor.map(
+                lambda directory: list(_get_properties(directory)), sorted(directory_filenames)):
+            for name, size, created in directory_properties:
+                properties[name] = (size, created)
+
+    missing = [a for a in filenames if a not in properties]
+    if missing:
+        raise ValueError('bams {} not found on storage {}'.format(', '.join(missing), storage_client.prefix))
+
+    def _inspect(filename):
+        size, created = properties[filename]
+        return {
+            'header': get_bam_header(storage_client, filename, size, created),
+            'size': size,
+            'created': created,
+            'has_index': filename + '.bai' in properties,
+        }
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(filenames, executor.map(_inspect, filenames)))
@@ -0,0 +1,206 @@
+""" Plan and apply bulk deletions of file instances from a storage.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import concurrent.futures
+import logging
+import pandas as pd
+
+from dbclients.tantalus import DataError
+
+log = logging.getLogger('sisyphus')
+
+MANIFEST_COLUMNS = [
+    'file_instance_id',
+    'file_resource_id',
+    'filename',
+    'filepath',
+    'size',
+    'delete_file_resource',
+    'action',
+    'reason',
+]
+
+
+def check_file_instances(tantalus_api, file_instances, max_workers=16):
+    """ Check existence and size of file instances concurrently.
+
+    Args:
+        tantalus_api (TantalusApi): tantalus api client
+        file_instances (list): file instances to check
+
+    KwArgs:
+        max_workers (int): maximum number of concurrent checks
+
+    Returns:
+        list of file instances that failed the check
+    """
+    def _check(file_instance):
+        try:
+            tantalus_api.check_file(file_instance)
+        except DataError:
+            log.exception('check file failed')
+            return file_instance
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [a for a in executor.map(_check, file_instances) if a is not None]
+
+
+def _plan_file_instance(file_instance, file_resource, check_remote=None, remote_storage_client=None):
+    """ Decide whether a single deleted file instance can be removed.
+    """
+    plan = {
+        'file_instance_id': file_instance['id'],
+        'file_resource_id': file_resource['id'],
+        'filename': file_resource['filename'],
+        'filepath': file_instance['filepath'],
+        'size': file_resource['size'],
+        'delete_file_resource': len(file_resource['file_instances']) == 1,
+        'action': 'delete',
+        'reason': None,
+    }
+
+    # Optionally check for a remote version
+    if remote_storage_client is not None:
+        remote_instance = None
+        for other_instance in file_resource['file_instances']:
+            if other_instance['storage']['name'] == check_remote:
+                remote_instance = other_instance
+
+        if not remote_instance:
+            plan['action'] = 'skip'
+            plan['reason'] = 'no other instance'
+
+        elif remote_instance['is_deleted']:
+            plan['action'] = 'skip'
+            plan['reason'] = 'other instance {} deleted'.format(remote_instance['id'])
+
+        elif not remote_storage_client.exists(file_resource['filename']):
+            plan['action'] = 'skip'
+            plan['reason'] = 'other instance {} doesnt exist'.format(remote_instance['id'])
+
+    return plan
+
+
+def plan_deleted_instances(tantalus_api, storage_name, check_remote=None, max_workers=16):
+    """ Plan the removal of file instances marked as deleted on a storage.
+
+    Args:
+        tantalus_api (TantalusApi): tantalus api client
+        storage_name (str): storage from which to remove deleted instances
+
+    KwArgs:
+        check_remote (str): only remove files with an intact instance on this storage
+        max_workers (int): maximum number of concurrent requests
+
+    Returns:
+        pandas.DataFrame of planned deletions with MANIFEST_COLUMNS
+
+    Deleted instances are retrieved in a single listing, their file
+    resources, including the list of all instances of each resource,
+    are then fetched concurrently.
+    """
+    remote_storage_client = None
+    if check_remote is not None:
+        remote_storage_client = tantalus_api.get_storage_client(check_remote)
+
+    file_instances = {}
+    for file_instance in tantalus_api.list('file_instance', storage__name=storage_name, is_deleted=True):
+        file_instances[file_instance['id']] = file_instance
+
+    log.info('planning removal of {} deleted file instances from {}'.format(
+        len(file_instances), storage_name))
+
+    def _plan(file_instance):
+        file_resource = tantalus_api.get('file_resource', id=file_instance['file_resource']['id'])
+        return _plan_file_instance(
+            file_instance, file_resource,
+            check_remote=check_remote, remote_storage_client=remote_storage_client)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        plans = list(executor.map(_plan, file_instances.values()))
+
+    plans = pd.DataFrame(plans, columns=MANIFEST_COLUMNS)
+
+    log.info('planned deletion of {} of {} file instances'.format(
+        (plans['action'] == 'delete').sum(), len(plans.index)))
+
+    return plans
+
+
+def apply_deletions(tantalus_api, storage_name, plans, dry_run=False, max_workers=16):
+    """ Delete planned files from storage and remove their models from tantalus.
+
+    Args:
+        tantalus_api (TantalusApi): tantalus api client
+        storage_name (str): storage from which to remove files
+        plans (pandas.DataFrame): planned deletions from plan_deleted_instances
+
+    KwArgs:
+        dry_run (bool): log deletions without applying them
+        max_workers (int): maximum number of concurrent requests
+
+    Returns:
+        plans, with the action and reason columns updated in place to the
+        outcome of each deletion as it is applied
+
+    Tantalus models are only deleted for files successfully removed from
+    the storage, and file resources only if their instance was deleted.
+    Failures are recorded in the plans rather than raised, so that the
+    manifest records every file removed from the storage.
+    """
+    to_delete = plans['action'] == 'delete'
+
+    if dry_run:
+        for filepath in plans.loc[to_delete, 'filepath']:
+            log.info('would delete file {}'.format(filepath))
+        plans.loc[to_delete, 'action'] = 'would delete'
+        return plans
+
+    storage_client = tantalus_api.get_storage_client(storage_name)
+
+    filenames = list(plans.loc[to_delete, 'filename'])
+
+    log.info('deleting {} files from {}'.format(len(filenames), storage_name))
+    failed_filenames = set(storage_client.delete_many(filenames, max_workers=max_workers))
+
+    failed = to_delete & plans['filename'].isin(failed_filenames)
+    plans.loc[failed, 'action'] = 'failed'
+    plans.loc[failed, 'reason'] = 'storage deletion failed'
+
+    deleted = to_delete & ~failed
+    plans.loc[deleted, 'action'] = 'deleted'
+    plans.loc[deleted, 'reason'] = 'tantalus models not deleted'
+
+    # Delete the instance models, then the file resources with no other instances
+    failed_instance_ids = set(tantalus_api.bulk_delete(
+        'file_instance', plans.loc[deleted, 'file_instance_id'].tolist(), max_workers=max_workers))
+
+    instance_failed = deleted & plans['file_instance_id'].isin(failed_instance_ids)
+    plans.loc[instance_failed, 'action'] = 'failed'
+    plans.loc[instance_failed, 'reason'] = 'deleted from storage, tantalus file instance deletion failed'
+
+    instance_deleted = deleted & ~instance_failed
+    plans.loc[instance_deleted, 'reason'] = None
+
+    delete_resource = instance_deleted & plans['delete_file_resource']
+    failed_resource_ids = set(tantalus_api.bulk_delete(
+        'file_resource', plans.loc[delete_resource, 'file_resource_id'].tolist(), max_workers=max_workers))
+
+    resource_failed = delete_resource & plans['file_resource_id'].isin(failed_resource_ids)
+    plans.loc[resource_failed, 'action'] = 'failed'
+    plans.loc[resource_failed, 'reason'] = 'deleted from storage, tantalus file resource deletion failed'
+
+    log.info('deleted {} files with size {} bytes, {} failed'.format(
+        deleted.sum(), plans.loc[deleted, 'size'].sum(), (plans['action'] == 'failed').sum()))
+
+    return plans
+
+
+def write_manifest(plans, manifest_filename):
+    """ Write a deletion manifest as csv.
+    """
+    plans.to_csv(manifest_filename, index=False)
+    log.info('wrote deletion manifest to {}'.format(manifest_filename))
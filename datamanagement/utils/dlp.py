@@ -131,6 +131,13 @@ def create_sequence_dataset_models(
             )
         dataset_info[dataset_name].append(info)
 
+    # Add all files to tantalus
+    added_files = tantalus_api.add_files(
+        storage_name,
+        [info["filepath"] for info in file_info],
+        update=update,
+    )
+
     # Create datasets
     dataset_ids = set()
     for dataset_name, infos in dataset_info.items():
@@ -199,11 +206,7 @@ def create_sequence_dataset_models(
             if "read_end" in info:
                 sequence_file_info["read_end"] = info["read_end"]
 
-            file_resource, file_instance = tantalus_api.add_file(
-                storage_name,
-                info["filepath"],
-                update=update,
-            )
+            file_resource, file_instance = added_files[info["filepath"]]
 
             sequence_file_info = tantalus_api.get_or_create(
                 "sequence_file_info",
@@ -0,0 +1,249 @@
+""" Size bounded local cache of tantalus files.
+
+Cached files are stored at their filename relative to the cache directory,
+and tracked in an index in the cache directory keyed by file resource id,
+size, created time and checksum when known.  Least recently used files are
+evicted when the cache exceeds its byte budget, except for files pinned by
+a running process or being downloaded.  The index is protected by a file lock so that several
+processes can share a cache directory.
+
+The byte budget defaults to SISYPHUS_CACHE_MAX_BYTES if set, otherwise the
+cache is unbounded.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+import portalocker
+
+log = logging.getLogger('sisyphus')
+
+INDEX_DIRNAME = '.sisyphus_cache'
+
+# Seconds between checks of a file being cached by another process
+WAIT_INTERVAL = 10
+
+# Seconds to wait for the index lock
+LOCK_TIMEOUT = 600
+
+# Cache paths being downloaded by threads of this process
+_downloads = set()
+_downloads_lock = threading.Lock()
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _file_key(file_resource):
+    return {
+        'file_resource_id': file_resource['id'],
+        'size': file_resource['size'],
+        'created': file_resource.get('created'),
+        'checksum': file_resource.get('checksum'),
+    }
+
+
+class FileCache(object):
+    """ Local cache of tantalus files with LRU eviction. """
+
+    def __init__(self, cache_directory, max_bytes=None):
+        if max_bytes is None and os.environ.get('SISYPHUS_CACHE_MAX_BYTES'):
+            max_bytes = int(os.environ['SISYPHUS_CACHE_MAX_BYTES'])
+
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+
+        index_directory = os.path.join(cache_directory, INDEX_DIRNAME)
+        os.makedirs(index_directory, exist_ok=True)
+
+        self.index_filename = os.path.join(index_directory, 'index.json')
+        self.lock_filename = os.path.join(index_directory, 'lock')
+
+    def get_filepath(self, filename):
+        return os.path.join(self.cache_directory, filename)
+
+    @contextlib.contextmanager
+    def _locked_index(self):
+        with portalocker.Lock(self.lock_filename, timeout=LOCK_TIMEOUT):
+            try:
+                with open(self.index_filename) as f:
+                    index = json.load(f)
+            except (IOError, ValueError):
+                index = {}
+
+            yield index
+
+            with open(self.index_filename + '.tmp', 'w') as f:
+                json.dump(index, f)
+            os.replace(self.index_filename + '.tmp', self.index_filename)
+
+    @staticmethod
+    def _live_pins(entry):
+        return [pid for pid in entry['pins'] if _is_running(pid)]
+
+    def _is_downloading(self, filename, entry):
+        """ Check if a file is being downloaded by a running process, or by
+        another thread of this process.
+        """
+        pid = entry['downloading']
+
+        if not pid:
+            return False
+
+        if pid == os.getpid():
+            with _downloads_lock:
+                return self.get_filepath(filename) in _downloads
+
+        return _is_running(pid)
+
+    def _evict(self, index, required_bytes, max_bytes):
+        """ Remove least recently used unpinned files until required_bytes fit in max_bytes.
+        """
+        if max_bytes is None:
+            return
+
+        total_bytes = sum(entry['size'] for entry in index.values())
+
+        for filename, entry in sorted(index.items(), key=lambda a: a[1]['last_used']):
+            if total_bytes + required_bytes <= max_bytes:
+                return
+
+            if self._is_downloading(filename, entry) or self._live_pins(entry):
+                continue
+
+            log.info('evicting {} from cache {}'.format(filename, self.cache_directory))
+
+            filepath = self.get_filepath(filename)
+            if os.path.lexists(filepath):
+                os.remove(filepath)
+
+            total_bytes -= entry['size']
+            del index[filename]
+
+        if total_bytes + required_bytes > max_bytes:
+            log.warning('cache {} exceeds budget of {} bytes, {} bytes in use or pinned'.format(
+                self.cache_directory, max_bytes, total_bytes))
+
+    def _acquire(self, file_resource):
+        """ Look up a file, reserving space for it if it is not cached.
+
+        Returns:
+            'cached', 'reserved', or 'wait' if another process or thread is caching the file
+        """
+        filename = file_resource['filename']
+        key = _file_key(file_resource)
+        pid = os.getpid()
+
+        with self._locked_index() as index:
+            entry = index.get(filename)
+
+            if entry is not None and entry['key'] == key:
+                if self._is_downloading(filename, entry):
+                    return 'wait'
+
+                if not entry['downloading'] and os.path.isfile(self.get_filepath(filename)):
+                    entry['last_used'] = time.time()
+                    entry['pins'] = sorted(set(self._live_pins(entry) + [pid]))
+                    return 'cached'
+
+            # Stale, missing, or abandoned by a failed process, files not in
+            # the index are kept and reused by the download if the size matches
+            if entry is not None:
+                if os.path.lexists(self.get_filepath(filename)):
+                    os.remove(self.get_filepath(filename))
+                del index[filename]
+
+            self._evict(index, file_resource['size'], self.max_bytes)
+
+            index[filename] = {
+                'key': key,
+                'size': file_resource['size'],
+                'last_used': time.time(),
+                'pins': [pid],
+                'downloading': pid,
+            }
+
+            with _downloads_lock:
+                _downloads.add(self.get_filepath(filename))
+
+            return 'reserved'
+
+    def _complete(self, filename, success):
+        with self._locked_index() as index:
+            with _downloads_lock:
+                _downloads.discard(self.get_filepath(filename))
+
+            if filename not in index:
+                return
+
+            if success:
+                index[filename]['downloading'] = None
+            else:
+                del index[filename]
+
+    def fetch(self, file_resource, f_download):
+        """ Get the path to a cached file, downloading it if necessary.
+
+        The file is pinned by the current process until released.
+
+        Args:
+            file_resource (dict): file resource to cache
+            f_download (callable): called with overwrite to download the file to its cache path
+
+        Returns:
+            path to the cached file
+        """
+        filename = file_resource['filename']
+
+        while True:
+            state = self._acquire(file_resource)
+
+            if state == 'cached':
+                log.info('using cached {}'.format(filename))
+                return self.get_filepath(filename)
+
+            if state == 'reserved':
+                break
+
+            log.info('waiting for {} to be cached by another process or thread'.format(filename))
+            time.sleep(WAIT_INTERVAL)
+
+        try:
+            f_download(overwrite=True)
+        except BaseException:
+            self._complete(filename, False)
+            raise
+
+        self._complete(filename, True)
+
+        return self.get_filepath(filename)
+
+    def release(self, filenames):
+        """ Unpin files pinned by the current process, allowing their eviction.
+        """
+        pid = os.getpid()
+
+        with self._locked_index() as index:
+            for filename in filenames:
+                if filename in index:
+                    index[filename]['pins'] = [a for a in self._live_pins(index[filename]) if a != pid]
+
+    def clear(self):
+        """ Remove all unpinned files from the cache.
+        """
+        with self._locked_index() as index:
+            self._evict(index, 0, 0)
@@ -0,0 +1,195 @@
+""" Copy files between storages on the same server without rsync.
+
+The cheapest available method is used for each file: a hardlink for
+read only files on the same filesystem, a reflink or copy_file_range on
+filesystems supporting them, and otherwise a copy of the file in chunks
+by several threads.  Copies are given the permissions and modification
+times that rsync --chmod=D555,F444 --times would give them.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import concurrent.futures
+import errno
+import fcntl
+import logging
+import os
+import stat
+import uuid
+
+log = logging.getLogger('sisyphus')
+
+# ioctl request cloning a file on btrfs, xfs and other reflink capable filesystems
+FICLONE = 0x40049409
+
+# Chunk size and number of threads for in process copies
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+COPY_THREADS = 4
+
+FILE_MODE = 0o444
+DIRECTORY_MODE = 0o555
+
+# Errors indicating a copy method is unsupported for a pair of files
+_UNSUPPORTED_ERRNOS = set([
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EBADF,
+])
+
+
+def _is_unsupported(error):
+    return error.errno in _UNSUPPORTED_ERRNOS
+
+
+def _try_reflink(source_fd, destination_fd):
+    try:
+        fcntl.ioctl(destination_fd, FICLONE, source_fd)
+    except OSError as e:
+        if _is_unsupported(e):
+            return False
+        raise
+    return True
+
+
+def _try_copy_file_range(source_fd, destination_fd, size):
+    if not hasattr(os, 'copy_file_range'):
+        return False
+
+    offset = 0
+    while offset < size:
+        try:
+            copied = os.copy_file_range(source_fd, destination_fd, size - offset, offset, offset)
+        except OSError as e:
+            if offset == 0 and _is_unsupported(e):
+                return False
+            raise
+
+        if copied == 0:
+            raise IOError('unexpected end of file after {} of {} bytes'.format(offset, size))
+
+        offset += copied
+
+    return True
+
+
+def _copy_chunks(source_fd, destination_fd, size, num_threads=COPY_THREADS):
+    def _copy_chunk(offset):
+        end = min(offset + COPY_CHUNK_SIZE, size)
+        while offset < end:
+            data = os.pread(source_fd, min(end - offset, 8 * 1024 * 1024), offset)
+            if not data:
+                raise IOError('unexpected end of file after {} of {} bytes'.format(offset, size))
+            offset += os.pwrite(destination_fd, data, offset)
+
+    offsets = range(0, size, COPY_CHUNK_SIZE)
+
+    if len(offsets) <= 1:
+        for offset in offsets:
+            _copy_chunk(offset)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        list(executor.map(_copy_chunk, offsets))
+
+
+def _copy_data(source_filepath, destination_filepath, size):
+    """ Copy file contents using the cheapest supported method.
+
+    Returns:
+        name of the method used
+    """
+    with open(source_filepath, 'rb') as source, open(destination_filepath, 'wb') as destination:
+        source_fd = source.fileno()
+        destination_fd = destination.fileno()
+
+        if size > 0 and _try_reflink(source_fd, destination_fd):
+            return 'reflink'
+
+        os.ftruncate(destination_fd, size)
+
+        if _try_copy_file_range(source_fd, destination_fd, size):
+            return 'copy_file_range'
+
+        _copy_chunks(source_fd, destination_fd, size)
+
+        return 'copy'
+
+
+def copy_file(source_filepath, destination_filepath):
+    """ Copy a file to a path on the same server.
+
+    The destination is written to a temporary file and renamed into place,
+    with mode 444 and the access and modification times of the source.
+
+    Args:
+        source_filepath (str): file to copy, symlinks are followed
+        destination_filepath (str): destination path, replaced if it exists
+
+    Returns:
+        name of the method used
+    """
+    source_stat = os.stat(source_filepath)
+
+    temp_filepath = os.path.join(
+        os.path.dirname(destination_filepath),
+        '.{}.{}.tmp'.format(os.path.basename(destination_filepath), uuid.uuid4().hex[:8]))
+
+    try:
+        method = None
+
+        # Hardlinks share permissions and times with the source, so are only
+        # used for files that are already read only
+        destination_stat = os.stat(os.path.dirname(destination_filepath))
+        if (source_stat.st_dev == destination_stat.st_dev and
+                stat.S_IMODE(source_stat.st_mode) == FILE_MODE):
+            try:
+                os.link(os.path.realpath(source_filepath), temp_filepath)
+                method = 'hardlink'
+            except OSError as e:
+                if not _is_unsupported(e) and e.errno != errno.EMLINK:
+                    raise
+
+        if method is None:
+            method = _copy_data(source_filepath, temp_filepath, source_stat.st_size)
+            os.chmod(temp_filepath, FILE_MODE)
+            os.utime(temp_filepath, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+
+        os.replace(temp_filepath, destination_filepath)
+
+    finally:
+        if os.path.lexists(temp_filepath):
+            os.remove(temp_filepath)
+
+    log.debug('copied {} to {} by {}'.format(source_filepath, destination_filepath, method))
+
+    return method
+
+
+def copy_folder(source_directory, destination_directory):
+    """ Copy a directory tree to a path on the same server.
+
+    Files are copied with copy_file, directories are given mode 555 and the
+    modification times of the source once their contents are copied.
+    """
+    directories = []
+
+    for root, dirnames, filenames in os.walk(source_directory, followlinks=True):
+        relative_root = os.path.relpath(root, source_directory)
+        destination_root = os.path.normpath(os.path.join(destination_directory, relative_root))
+
+        os.makedirs(destination_root, exist_ok=True)
+        directories.append((root, destination_root))
+
+        for filename in filenames:
+            copy_file(os.path.join(root, filename), os.path.join(destination_root, filename))
+
+    # Deepest directories first, so that setting times is not undone by later writes
+    for source_root, destination_root in reversed(directories):
+        source_stat = os.stat(source_root)
+        os.chmod(destination_root, DIRECTORY_MODE)
+        os.utime(destination_root, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
@@ -3,6 +3,7 @@ import sys
 import logging
 import datetime
 import pypeliner.helpers
+from pypeliner.execqueue.base import ReceiveError
 from pypeliner.execqueue.qsub import AsyncQsubJobQueue
 from datamanagement.utils.constants import LOGGING_FORMAT
 
@@ -10,6 +11,90 @@ from datamanagement.utils.constants import LOGGING_FORMAT
 logging.basicConfig(format=LOGGING_FORMAT, stream=sys.stderr, level=logging.INFO)
 
 
+class QsubJobBatch(object):
+    """
+    A single pypeliner queue to which many jobs are submitted and tracked
+    concurrently. The queue is not thread safe, submit and poll should be
+    called from the same thread.
+    """
+    def __init__(self, native_spec, title, mem=10):
+        self.queue = AsyncQsubJobQueue(modules=(sys.modules[__name__], ), native_spec=native_spec)
+        self.mem = mem
+        self.num_submitted = 0
+
+        current_time = datetime.datetime.now().strftime('%d-%m-%Y_%S-%M-%H')
+        self.temps_dir = os.path.join('tmp', title + "_" + current_time)
+
+    def __enter__(self):
+        self.queue.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.queue.__exit__(exc_type, exc_value, traceback)
+
+    @property
+    def pending(self):
+        return self.queue.length
+
+    def submit(self, job):
+        """
+        Submits a job to the cluster
+
+        Args:
+            job:    the job object to run
+
+        Returns:
+            job_name:   unique name of the job within the batch
+        """
+        job_name = "{}_{}".format(job.name.replace(" ", "_"), self.num_submitted)
+        self.num_submitted += 1
+
+        # Create the temp directory for the job output logs
+        temps_dir = os.path.join(self.temps_dir, job_name)
+        pypeliner.helpers.makedirs(temps_dir)
+
+        logging.info("Submitting job {} to the cluster".format(job_name))
+        self.queue.send({'mem': self.mem}, job_name, job, temps_dir)
+
+        return job_name
+
+    def _receive(self, job_name):
+        try:
+            result = self.queue.receive(job_name)
+        except ReceiveError as e:
+            return job_name, None, e
+
+        if not result.finished:
+            return job_name, result, Exception("job {} did not finish".format(job_name))
+
+        return job_name, result, None
+
+    def wait(self):
+        """
+        Waits for any submitted job to finish
+
+        Returns:
+            job_name, result, error: error is None if the job succeeded
+        """
+        return self._receive(self.queue.wait())
+
+    def poll(self):
+        """
+        Checks for a finished job, waiting at most one cluster polling period
+
+        Returns:
+            job_name, result, error for a finished job, or None
+        """
+        for i in range(2):
+            for job_name, job in list(self.queue.jobs.items()):
+                if job.finished:
+                    return self._receive(job_name)
+            if i == 0:
+                self.queue.qstat.update(self.queue.jobs)
+
+        return None
+
+
 def submit_qsub_job(job, native_spec, **kwargs):
     """
     Creates a queue and submits the job to the cluster. Waits for the job to 
@@ -19,27 +104,11 @@ def submit_qsub_job(job, native_spec, **kwargs):
         job:            the job object to run
         native_spec:    native specifications to use for the job
     """
-    # Create the pypeliner queue object to submit the job
-    queue = AsyncQsubJobQueue(modules=(sys.modules[__name__], ), native_spec=native_spec)
-    
-    current_time = datetime.datetime.now().strftime('%d-%m-%Y_%S-%M-%H')
-    dir_name = kwargs["title"] + "_" + current_time
-
-    # Create the temp directory for all output logs
-    temps_dir = os.path.join('tmp', dir_name)
-    pypeliner.helpers.makedirs(temps_dir)
-    
-    logging.info("Submitting job to the cluster")
-    queue.send({'mem': 10}, job.name, job, temps_dir)
-    job_name = None
-    
-    # Wait for the job to finish
-    while True:
-        job_name = queue.wait()
-        if job_name is not None:
-            break
-        os.sleep(10)
-    
-    result = queue.receive(job_name)
-    
-    assert result.finished == True
\ No newline at end of file
+    with QsubJobBatch(native_spec, kwargs["title"]) as batch:
+        batch.submit(job)
+
+        # Wait for the job to finish
+        job_name, result, error = batch.wait()
+
+    if error is not None:
+        raise error
@@ -61,6 +61,7 @@ class CramToBamJob(object):
         self.cram_path = cram_path
         self.ref = ref
         self.out_path = out_path
+        self.started = True
         self.finished = False
         self.name = "cram decompression"
 
@@ -0,0 +1,99 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from datamanagement.utils.bam_header import BAM_MAGIC, parse_bam_header, read_bam_header_text
+
+
+HEADER_TEXT = '\n'.join([
+    '@HD\tVN:1.6\tSO:coordinate',
+    '@SQ\tSN:1\tLN:249250621',
+    '@SQ\tSN:2\tLN:243199373',
+    '@RG\tID:A\tSM:SA123\tLB:A90652A\tPU:HGTJJCCXX_1',
+    '@RG\tID:B\tSM:SA123\tLB:A90652A\tPU:HGTJJCCXX_2',
+    '@PG\tID:bwa\tPN:bwa\tVN:0.7.17',
+    '@CO\tfirst comment',
+    '@CO\tsecond comment',
+]) + '\n'
+
+
+def _bgzf_block(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    block_size = 26 + len(compressed)
+    return (
+        b'\x1f\x8b\x08\x04' + b'\x00' * 4 + b'\x00\xff' +
+        struct.pack('<H', 6) + b'BC' + struct.pack('<HH', 2, block_size - 1) +
+        compressed +
+        struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data)))
+
+
+def _bam_data(text):
+    encoded = text.encode('utf-8')
+    return BAM_MAGIC + struct.pack('<i', len(encoded)) + encoded + struct.pack('<i', 0)
+
+
+class TestParseBamHeader(unittest.TestCase):
+
+    def test_parse(self):
+        header = parse_bam_header(HEADER_TEXT)
+
+        self.assertEqual(header['HD'], {'VN': '1.6', 'SO': 'coordinate'})
+        self.assertEqual(header['SQ'], [
+            {'SN': '1', 'LN': 249250621},
+            {'SN': '2', 'LN': 243199373},
+        ])
+        self.assertEqual([a['ID'] for a in header['RG']], ['A', 'B'])
+        self.assertEqual(header['RG'][0]['PU'], 'HGTJJCCXX_1')
+        self.assertEqual(header['PG'], [{'ID': 'bwa', 'PN': 'bwa', 'VN': '0.7.17'}])
+        self.assertEqual(header['CO'], ['first comment', 'second comment'])
+
+    def test_values_with_colons(self):
+        header = parse_bam_header('@PG\tID:bwa\tCL:bwa mem -R @RG\\tID:A ref.fa\n')
+        self.assertEqual(header['PG'][0]['CL'], 'bwa mem -R @RG\\tID:A ref.fa')
+
+    def test_empty(self):
+        self.assertEqual(parse_bam_header(''), {})
+
+
+class TestReadBamHeaderText(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, data):
+        filepath = os.path.join(self.directory, 'test.bam')
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        return filepath
+
+    def test_read(self):
+        data = _bam_data(HEADER_TEXT)
+
+        # Header split across several blocks
+        filepath = self._write(b''.join(_bgzf_block(data[a:a + 50]) for a in range(0, len(data), 50)))
+
+        self.assertEqual(read_bam_header_text(filepath), HEADER_TEXT)
+
+    def test_not_bam(self):
+        filepath = self._write(_bgzf_block(b'not a bam file'))
+
+        with self.assertRaises(ValueError):
+            read_bam_header_text(filepath)
+
+    def test_truncated(self):
+        data = _bam_data(HEADER_TEXT)
+        filepath = self._write(_bgzf_block(data[:40]))
+
+        with self.assertRaises(ValueError):
+            read_bam_header_text(filepath)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+from unittest import mock
+
+from datamanagement.utils import cleanup
+
+
+def _instance(id, storage_name, file_resource_id, is_deleted=True):
+    return {
+        'id': id,
+        'storage': {'name': storage_name},
+        'file_resource': {'id': file_resource_id},
+        'filepath': '/{}/file{}'.format(storage_name, file_resource_id),
+        'is_deleted': is_deleted,
+    }
+
+
+class TestCleanup(unittest.TestCase):
+
+    def setUp(self):
+        # Resource 1 only on local, 2 also intact on remote, 3 also deleted
+        # on remote, 4 also on remote but missing from remote storage
+        self.instances = {
+            1: _instance(1, 'local', 1),
+            2: _instance(2, 'local', 2),
+            3: _instance(3, 'local', 3),
+            4: _instance(4, 'local', 4),
+            12: _instance(12, 'remote', 2, is_deleted=False),
+            13: _instance(13, 'remote', 3),
+            14: _instance(14, 'remote', 4, is_deleted=False),
+        }
+
+        self.file_resources = {}
+        for file_resource_id in (1, 2, 3, 4):
+            self.file_resources[file_resource_id] = {
+                'id': file_resource_id,
+                'filename': 'file{}'.format(file_resource_id),
+                'size': file_resource_id * 10,
+                'file_instances': [
+                    a for a in self.instances.values() if a['file_resource']['id'] == file_resource_id],
+            }
+
+        def _list(table_name, storage__name=None, is_deleted=None):
+            self.assertEqual(table_name, 'file_instance')
+            return [
+                a for a in self.instances.values()
+                if a['storage']['name'] == storage__name and a['is_deleted'] == is_deleted]
+
+        def _get(table_name, id=None):
+            self.assertEqual(table_name, 'file_resource')
+            return self.file_resources[id]
+
+        self.remote_storage_client = mock.Mock()
+        self.remote_storage_client.exists.side_effect = lambda filename: filename != 'file4'
+
+        self.local_storage_client = mock.Mock()
+        self.local_storage_client.delete_many.return_value = []
+
+        self.tantalus_api = mock.Mock()
+        self.tantalus_api.list.side_effect = _list
+        self.tantalus_api.get.side_effect = _get
+        self.tantalus_api.get_storage_client.side_effect = {
+            'local': self.local_storage_client,
+            'remote': self.remote_storage_client,
+        }.get
+        self.tantalus_api.bulk_delete.return_value = []
+
+    def _actions(self, plans):
+        actions = {}
+        for plan in plans.to_dict('records'):
+            reason = plan['reason'] if isinstance(plan['reason'], str) else None
+            actions[plan['file_instance_id']] = (plan['action'], reason)
+        return actions
+
+    def test_plan(self):
+        plans = cleanup.plan_deleted_instances(self.tantalus_api, 'local')
+
+        self.assertEqual(list(plans.columns), cleanup.MANIFEST_COLUMNS)
+        self.assertEqual(sorted(plans['file_instance_id']), [1, 2, 3, 4])
+        self.assertTrue((plans['action'] == 'delete').all())
+
+        plans = plans.set_index('file_instance_id')
+        self.assertTrue(plans.loc[1, 'delete_file_resource'])
+        self.assertFalse(plans.loc[2, 'delete_file_resource'])
+        self.assertEqual(plans.loc[2, 'filename'], 'file2')
+        self.assertEqual(plans.loc[2, 'size'], 20)
+
+    def test_plan_check_remote(self):
+        plans = cleanup.plan_deleted_instances(self.tantalus_api, 'local', check_remote='remote')
+
+        self.assertEqual(self._actions(plans), {
+            1: ('skip', 'no other instance'),
+            2: ('delete', None),
+            3: ('skip', 'other instance 13 deleted'),
+            4: ('skip', 'other instance 14 doesnt exist'),
+        })
+
+    def test_apply(self):
+        plans = cleanup.plan_deleted_instances(self.tantalus_api, 'local', check_remote='remote')
+
+        cleanup.apply_deletions(self.tantalus_api, 'local', plans)
+
+        self.local_storage_client.delete_many.assert_called_once_with(['file2'], max_workers=16)
+        self.assertEqual(self.tantalus_api.bulk_delete.call_args_list, [
+            mock.call('file_instance', [2], max_workers=16),
+            mock.call('file_resource', [], max_workers=16),
+        ])
+        self.assertEqual(self._actions(plans)[2], ('deleted', None))
+
+    def test_apply_failures(self):
+        plans = cleanup.plan_deleted_instances(self.tantalus_api, 'local')
+
+        self.local_storage_client.delete_many.return_value = ['file2']
+
+        def _bulk_delete(table_name, ids, max_workers=None):
+            return {'file_instance': [3], 'file_resource': [1]}[table_name]
+
+        self.tantalus_api.bulk_delete.side_effect = _bulk_delete
+
+        cleanup.apply_deletions(self.tantalus_api, 'local', plans)
+
+        # Models are not deleted for files that remain on the storage
+        self.assertEqual(
+            sorted(self.tantalus_api.bulk_delete.call_args_list[0][0][1]), [1, 3, 4])
+
+        # Only resources with no other instance whose instance was deleted
+        self.assertEqual(self.tantalus_api.bulk_delete.call_args_list[1][0][1], [1])
+
+        self.assertEqual(self._actions(plans), {
+            1: ('failed', 'deleted from storage, tantalus file resource deletion failed'),
+            2: ('failed', 'storage deletion failed'),
+            3: ('failed', 'deleted from storage, tantalus file instance deletion failed'),
+            4: ('deleted', None),
+        })
+
+    def test_dry_run(self):
+        plans = cleanup.plan_deleted_instances(self.tantalus_api, 'local', check_remote='remote')
+
+        cleanup.apply_deletions(self.tantalus_api, 'local', plans, dry_run=True)
+
+        self.local_storage_client.delete_many.assert_not_called()
+        self.tantalus_api.bulk_delete.assert_not_called()
+        self.assertEqual(self._actions(plans)[2], ('would delete', None))
+        self.assertEqual(self._actions(plans)[1], ('skip', 'no other instance'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from datamanagement.utils import file_cache
+from datamanagement.utils.file_cache import FileCache
+
+
+DEAD_PID = 2 ** 22 + 1
+
+
+def _is_running(pid):
+    return pid != DEAD_PID
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.downloads = []
+
+        patcher = mock.patch.object(file_cache, '_is_running', _is_running)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _file_resource(self, id, size):
+        return {'id': id, 'filename': 'dir/file{}'.format(id), 'size': size}
+
+    def _fetch(self, cache, file_resource):
+        def _download(overwrite=False):
+            self.downloads.append(file_resource['filename'])
+            filepath = cache.get_filepath(file_resource['filename'])
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with open(filepath, 'wb') as f:
+                f.write(b'x' * file_resource['size'])
+
+        return cache.fetch(file_resource, _download)
+
+    def _cached_filenames(self, cache):
+        with cache._locked_index() as index:
+            return sorted(index)
+
+    def test_fetch(self):
+        cache = FileCache(self.directory)
+        file_resource = self._file_resource(1, 10)
+
+        filepath = self._fetch(cache, file_resource)
+        self.assertEqual(filepath, os.path.join(self.directory, 'dir/file1'))
+        self.assertEqual(os.path.getsize(filepath), 10)
+
+        self.assertEqual(self._fetch(cache, file_resource), filepath)
+        self.assertEqual(self.downloads, ['dir/file1'])
+
+    def test_changed_file(self):
+        cache = FileCache(self.directory)
+
+        self._fetch(cache, self._file_resource(1, 10))
+        self._fetch(cache, self._file_resource(1, 20))
+
+        self.assertEqual(self.downloads, ['dir/file1', 'dir/file1'])
+        self.assertEqual(os.path.getsize(cache.get_filepath('dir/file1')), 20)
+
+    def test_failed_download(self):
+        cache = FileCache(self.directory)
+
+        def _download(overwrite=False):
+            raise Exception('failed')
+
+        with self.assertRaises(Exception):
+            cache.fetch(self._file_resource(1, 10), _download)
+
+        self.assertEqual(self._cached_filenames(cache), [])
+
+    def test_evict_least_recently_used(self):
+        cache = FileCache(self.directory, max_bytes=25)
+
+        self._fetch(cache, self._file_resource(1, 10))
+        self._fetch(cache, self._file_resource(2, 10))
+        cache.release(['dir/file1', 'dir/file2'])
+
+        self._fetch(cache, self._file_resource(3, 10))
+
+        self.assertEqual(self._cached_filenames(cache), ['dir/file2', 'dir/file3'])
+        self.assertFalse(os.path.exists(cache.get_filepath('dir/file1')))
+
+    def test_pinned_not_evicted(self):
+        cache = FileCache(self.directory, max_bytes=15)
+
+        self._fetch(cache, self._file_resource(1, 10))
+        self._fetch(cache, self._file_resource(2, 10))
+
+        self.assertEqual(self._cached_filenames(cache), ['dir/file1', 'dir/file2'])
+
+        cache.clear()
+        self.assertEqual(self._cached_filenames(cache), ['dir/file1', 'dir/file2'])
+
+        cache.release(['dir/file1', 'dir/file2'])
+        cache.clear()
+        self.assertEqual(self._cached_filenames(cache), [])
+
+    def test_evict_abandoned_download(self):
+        cache = FileCache(self.directory, max_bytes=15)
+
+        with cache._locked_index() as index:
+            index['dir/file1'] = {
+                'key': file_cache._file_key(self._file_resource(1, 10)),
+                'size': 10,
+                'last_used': 0.,
+                'pins': [DEAD_PID],
+                'downloading': DEAD_PID,
+            }
+
+        self._fetch(cache, self._file_resource(2, 10))
+
+        self.assertEqual(self._cached_filenames(cache), ['dir/file2'])
+
+    def test_download_by_other_thread(self):
+        cache = FileCache(self.directory)
+        file_resource = self._file_resource(1, 10)
+
+        self.assertEqual(cache._acquire(file_resource), 'reserved')
+        self.assertEqual(cache._acquire(file_resource), 'wait')
+
+        cache._complete(file_resource['filename'], False)
+        self.assertEqual(cache._acquire(file_resource), 'reserved')
+
+        cache._complete(file_resource['filename'], False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from datamanagement.utils import local_copy
+
+
+class TestLocalCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for root, dirnames, filenames in os.walk(self.directory):
+            os.chmod(root, 0o755)
+        shutil.rmtree(self.directory)
+
+    def _write(self, filename, data, mode=0o644):
+        filepath = os.path.join(self.directory, filename)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        os.chmod(filepath, mode)
+        os.utime(filepath, (1000000000, 1000000000))
+        return filepath
+
+    def _check_copy(self, source_filepath, destination_filepath):
+        with open(source_filepath, 'rb') as source, open(destination_filepath, 'rb') as destination:
+            self.assertEqual(source.read(), destination.read())
+
+        destination_stat = os.stat(destination_filepath)
+        self.assertEqual(stat.S_IMODE(destination_stat.st_mode), local_copy.FILE_MODE)
+        self.assertEqual(destination_stat.st_mtime, os.stat(source_filepath).st_mtime)
+
+    def test_copy_file(self):
+        source_filepath = self._write('source', b'data' * 1000)
+        destination_filepath = os.path.join(self.directory, 'destination')
+
+        method = local_copy.copy_file(source_filepath, destination_filepath)
+
+        self.assertNotEqual(method, 'hardlink')
+        self._check_copy(source_filepath, destination_filepath)
+
+        # No temporary files are left behind
+        self.assertEqual(sorted(os.listdir(self.directory)), ['destination', 'source'])
+
+    def test_hardlink_read_only(self):
+        source_filepath = self._write('source', b'data', mode=local_copy.FILE_MODE)
+        destination_filepath = os.path.join(self.directory, 'destination')
+
+        method = local_copy.copy_file(source_filepath, destination_filepath)
+
+        self.assertEqual(method, 'hardlink')
+        self.assertTrue(os.path.samefile(source_filepath, destination_filepath))
+
+    def test_replace_existing(self):
+        source_filepath = self._write('source', b'new data')
+        destination_filepath = self._write('destination', b'old', mode=local_copy.FILE_MODE)
+
+        local_copy.copy_file(source_filepath, destination_filepath)
+
+        self._check_copy(source_filepath, destination_filepath)
+
+    def test_copy_chunks(self):
+        data = os.urandom(10000)
+        source_filepath = self._write('source', data)
+        destination_filepath = os.path.join(self.directory, 'destination')
+
+        with mock.patch.object(local_copy, '_try_reflink', return_value=False), \
+                mock.patch.object(local_copy, '_try_copy_file_range', return_value=False), \
+                mock.patch.object(local_copy, 'COPY_CHUNK_SIZE', 1024):
+            method = local_copy.copy_file(source_filepath, destination_filepath)
+
+        self.assertEqual(method, 'copy')
+        self._check_copy(source_filepath, destination_filepath)
+
+    def test_copy_empty(self):
+        source_filepath = self._write('source', b'')
+        destination_filepath = os.path.join(self.directory, 'destination')
+
+        local_copy.copy_file(source_filepath, destination_filepath)
+
+        self._check_copy(source_filepath, destination_filepath)
+
+    def test_copy_folder(self):
+        self._write('source/a', b'a')
+        self._write('source/sub/b', b'b')
+        self._write('source/sub/sub/c', b'c')
+
+        source_directory = os.path.join(self.directory, 'source')
+        destination_directory = os.path.join(self.directory, 'destination')
+
+        local_copy.copy_folder(source_directory, destination_directory)
+
+        for filename in ('a', 'sub/b', 'sub/sub/c'):
+            self._check_copy(
+                os.path.join(source_directory, filename),
+                os.path.join(destination_directory, filename))
+
+        for directory in ('', 'sub', 'sub/sub'):
+            directory_stat = os.stat(os.path.join(destination_directory, directory))
+            self.assertEqual(stat.S_IMODE(directory_stat.st_mode), local_copy.DIRECTORY_MODE)
+            self.assertEqual(directory_stat.st_mtime, os.stat(os.path.join(source_directory, directory)).st_mtime)
+
+
+if __name__ == '__main__':
+    unittest.main()
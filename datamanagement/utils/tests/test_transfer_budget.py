@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+
+from datamanagement.utils import transfer_budget
+from datamanagement.utils.transfer_budget import TransferBudget
+
+
+class TestTransferBudget(unittest.TestCase):
+
+    def test_progress(self):
+        budget = TransferBudget()
+        budget.add_planned(2, 300)
+
+        progress = budget.file_progress()
+        progress(50, 100)
+        progress(100, 100)
+        budget.complete_file(100, progress)
+
+        self.assertEqual(progress.transferred, 100)
+        self.assertEqual(budget.transferred_bytes, 100)
+        self.assertEqual(budget.completed_files, 1)
+        self.assertEqual(budget.skipped_bytes, 0)
+
+        # A file that was not transferred is skipped
+        budget.complete_file(200)
+
+        self.assertEqual(budget.completed_files, 2)
+        self.assertEqual(budget.skipped_bytes, 200)
+
+    def test_progress_not_decreasing(self):
+        budget = TransferBudget()
+
+        progress = budget.file_progress()
+        progress(100, 100)
+        progress(50, 100)
+
+        self.assertEqual(budget.transferred_bytes, 100)
+
+    def test_throttle(self):
+        budget = TransferBudget(max_bytes_per_second=100)
+
+        with mock.patch.object(transfer_budget.time, 'sleep') as sleep:
+            budget.file_progress(throttle=False)(300, 300)
+            sleep.assert_not_called()
+
+            budget.file_progress()(300, 300)
+            sleep.assert_called_once()
+            self.assertAlmostEqual(sleep.call_args[0][0], 3., places=1)
+
+    def test_unlimited(self):
+        budget = TransferBudget()
+
+        with mock.patch.object(transfer_budget.time, 'sleep') as sleep:
+            budget.file_progress()(10 ** 9, 10 ** 9)
+            sleep.assert_not_called()
+
+    def test_per_transfer_bytes_per_second(self):
+        self.assertIsNone(TransferBudget().per_transfer_bytes_per_second(4))
+        self.assertEqual(TransferBudget(max_bytes_per_second=100).per_transfer_bytes_per_second(4), 25)
+        self.assertEqual(TransferBudget(max_bytes_per_second=100).per_transfer_bytes_per_second(0), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+""" Shared bandwidth budget and progress reporting for concurrent transfers.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import logging
+import threading
+import time
+
+log = logging.getLogger('sisyphus')
+
+# Seconds between aggregate progress reports
+REPORT_INTERVAL = 30
+
+
+def _as_gb(num_bytes):
+    return round(num_bytes / (1024.0 * 1024.0 * 1024.0), 2)
+
+
+class FileProgress(object):
+    """ Progress callback of a single file, reporting to a TransferBudget.
+
+    Called with the bytes transferred so far and the total bytes of the file.
+    """
+
+    def __init__(self, budget, throttle=True):
+        self.budget = budget
+        self.throttle = throttle
+        self.transferred = 0
+
+    def __call__(self, current, total):
+        delta = current - self.transferred
+        self.transferred = current
+        if delta > 0:
+            self.budget.record(delta, throttle=self.throttle)
+
+
+class TransferBudget(object):
+    """ Bytes per second budget and aggregate progress of concurrent transfers.
+
+    Transfers report bytes through FileProgress callbacks, and are slowed
+    down by sleeping in the callback when the budget is exceeded.
+    """
+
+    def __init__(self, max_bytes_per_second=None, report_interval=REPORT_INTERVAL):
+        self.max_bytes_per_second = max_bytes_per_second
+        self.report_interval = report_interval
+
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._last_report = self._start
+        self._last_refill = self._start
+        self._tokens = 0.
+
+        self.planned_files = 0
+        self.planned_bytes = 0
+        self.completed_files = 0
+        self.skipped_bytes = 0
+        self.transferred_bytes = 0
+
+    def add_planned(self, num_files, num_bytes):
+        """ Add files to the total used for the ETA.
+        """
+        with self._lock:
+            self.planned_files += num_files
+            self.planned_bytes += num_bytes
+
+    def record(self, num_bytes, throttle=True):
+        """ Record bytes transferred, sleeping as required to stay within the budget.
+        """
+        delay = 0.
+
+        with self._lock:
+            self.transferred_bytes += num_bytes
+
+            if throttle and self.max_bytes_per_second:
+                # Token bucket allowing a burst of one second, a deficit is
+                # paid for by the caller sleeping
+                now = time.time()
+                self._tokens = min(
+                    self._tokens + (now - self._last_refill) * self.max_bytes_per_second,
+                    self.max_bytes_per_second)
+                self._last_refill = now
+                self._tokens -= num_bytes
+                if self._tokens < 0:
+                    delay = -self._tokens / self.max_bytes_per_second
+
+        self.report()
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def file_progress(self, throttle=True):
+        """ Create a progress callback for a file.
+
+        KwArgs:
+            throttle (bool): sleep in the callback to stay within the budget,
+                false for transfers that limit their own rate
+        """
+        return FileProgress(self, throttle=throttle)
+
+    def complete_file(self, size, file_progress=None):
+        """ Record completion of a file, bytes not transferred were skipped.
+        """
+        transferred = file_progress.transferred if file_progress is not None else 0
+
+        with self._lock:
+            self.completed_files += 1
+            self.skipped_bytes += max(size - transferred, 0)
+
+        self.report()
+
+    def per_transfer_bytes_per_second(self, num_transfers):
+        """ Share of the budget of each of a number of concurrent transfers.
+        """
+        if not self.max_bytes_per_second:
+            return None
+        return self.max_bytes_per_second / max(num_transfers, 1)
+
+    def report(self, force=False):
+        """ Log aggregate throughput and ETA, at most once per report interval.
+        """
+        with self._lock:
+            now = time.time()
+            if not force and now < self._last_report + self.report_interval:
+                return
+            self._last_report = now
+
+            elapsed = now - self._start
+            rate = self.transferred_bytes / elapsed if elapsed > 0 else 0.
+            remaining = max(self.planned_bytes - self.skipped_bytes - self.transferred_bytes, 0)
+
+            eta = "NA"
+            if rate > 0:
+                eta = "{:.0f}s".format(remaining / rate)
+
+            message = "{}/{} files, {}/{} GB transferred, {} GB skipped, {:.2f} MB/s, eta {}".format(
+                self.completed_files, self.planned_files,
+                _as_gb(self.transferred_bytes), _as_gb(self.planned_bytes - self.skipped_bytes),
+                _as_gb(self.skipped_bytes), rate / (1024. * 1024.), eta)
+
+        log.info(message)
@@ -4,9 +4,12 @@
 from __future__ import absolute_import
 from __future__ import division
 import coreapi
+import copy
+import datetime
 import json
 from coreapi.codecs import JSONCodec, TextCodec
 from datamanagement.utils.django_json_encoder import DjangoJSONEncoder
+from dbclients.profiling import get_profiler, profiling_enabled
 from openapi_codec import OpenAPICodec
 import requests
 import pandas as pd
@@ -14,6 +17,8 @@ import time
 import logging
 import traceback
 import random
+import threading
+import concurrent.futures
 
 log = logging.getLogger('sisyphus')
 
@@ -30,12 +35,133 @@ class FieldMismatchError(Exception):
     pass
 
 
+class BulkError(Exception):
+    """ Some items of a bulk request failed, after all items were attempted.
+
+    Attributes:
+        failed (list): items that failed
+        results (list): results in the same order as the items, None for failed items
+    """
+
+    def __init__(self, message, failed, results):
+        super(BulkError, self).__init__(message)
+        self.failed = failed
+        self.results = results
+
+
+# Schema types of fields whose string values are never compared as timestamps
+NON_TIMESTAMP_SCHEMA_TYPES = ("Integer", "Number", "Boolean", "Array")
+
+
+class _ExpectedValue(object):
+    """ Expected value of a field, with set and timestamp forms parsed once. """
+
+    def __init__(self, value):
+        self.value = value
+
+        self.set = None
+        if not isinstance(value, (str, bytes, dict)):
+            try:
+                self.set = set(value)
+            except TypeError:
+                pass
+
+        self.timestamp = None
+        if value and isinstance(value, (str, datetime.date)):
+            try:
+                self.timestamp = pd.Timestamp(value)
+            except (ValueError, TypeError):
+                pass
+
+
+def _match_value(result_value, expected, parse_timestamps):
+    """ Compare a result field to an expected value.
+
+    Returns:
+        is_equal (bool), compared result value
+    """
+    # Response has nested foreign key relationship
+    if type(result_value) is dict:
+        result_value = result_value.get("id", result_value)
+
+    # Response has nested or non nested many to many
+    elif type(result_value) is list:
+        result_value = set(a["id"] if type(a) is dict else a for a in result_value)
+        return result_value == expected.set, result_value
+
+    if result_value == expected.value:
+        return True, result_value
+
+    # Response is a timestamp
+    if parse_timestamps and expected.timestamp is not None and result_value and isinstance(result_value, str):
+        try:
+            result_value = pd.Timestamp(result_value)
+        except (ValueError, TypeError):
+            return False, result_value
+        return result_value == expected.timestamp, result_value
+
+    return False, result_value
+
+
+class FieldMatcher(object):
+    """ Check result fields against expected values.
+
+    Nested foreign keys are compared by id, many to many fields as sets and
+    strings as timestamps if the expected value is a timestamp.
+    """
+
+    def __init__(self, table_name, fields, timestamp_fields):
+        self.table_name = table_name
+        self.fields = [
+            (field_name, _ExpectedValue(field_value), field_name in timestamp_fields)
+            for field_name, field_value in fields.items()]
+
+    def mismatches(self, result):
+        """ Fields of a result not equal to their expected values.
+
+        Yields:
+            field name, compared result value, expected value
+        """
+        for field_name, expected, parse_timestamps in self.fields:
+            if field_name not in result:
+                raise Exception(
+                    "field {} not in {}".format(field_name, self.table_name)
+                )
+
+            is_equal, result_value = _match_value(result[field_name], expected, parse_timestamps)
+
+            if not is_equal:
+                yield field_name, result_value, expected.value
+
+    def matches(self, result):
+        for _ in self.mismatches(result):
+            return False
+        return True
+
+
 class BasicAPIClient(object):
     """ Basic API class. """
 
     # Parameters used for pagination. Change this in subclasses.
     pagination_param_names = ()
 
+    # Page size parameter for keyset pagination, listings of endpoints with
+    # id__gt and ordering filters are ordered by id and paged by the last id
+    # seen. Set this in subclasses to enable keyset pagination.
+    keyset_page_size_param = None
+
+    # Initial and limits of the keyset page size, adapted to keep the latency
+    # of each page near the target
+    keyset_initial_page_size = 1000
+    keyset_min_page_size = 100
+    keyset_max_page_size = 10000
+    keyset_target_page_seconds = 2.
+
+    # Tables cached by id when the identity map is enabled, mapped to the
+    # model they serve so that changes through one endpoint invalidate the
+    # others. Change this in subclasses.
+    identity_map_tables = {}
+
     def __init__(self, api_url, username=None, password=None):
         """ Set up authentication using basic authentication.
         """
@@ -48,6 +174,16 @@ class BasicAPIClient(object):
         # Tell Tantalus we're sending JSON
         self.session.headers.update({"content-type": "application/json"})
 
+        # Sessions for worker threads making concurrent requests
+        self._thread_local = threading.local()
+
+        # Fields compared as timestamps by matchers, by table and field set
+        self._timestamp_fields = {}
+
+        # Objects fetched by id, keyed by table and id, if enabled
+        self._identity_map = None
+        self._identity_map_lock = threading.Lock()
+
         # Record the base API URL
         self.base_api_url = api_url
 
@@ -61,7 +197,16 @@ class BasicAPIClient(object):
 
         decoders = [OpenAPICodec(), JSONCodec(), TextCodec()]
 
-        self.coreapi_client = coreapi.Client(auth=auth, decoders=decoders)
+        coreapi_session = requests.Session()
+
+        # Optionally record all requests made by both sessions
+        self.profiler = None
+        if profiling_enabled():
+            self.profiler = get_profiler()
+            self.profiler.instrument(self.session, self.base_api_url)
+            self.profiler.instrument(coreapi_session, self.base_api_url)
+
+        self.coreapi_client = coreapi.Client(auth=auth, decoders=decoders, session=coreapi_session)
         retries = 5
         for retry in range(retries):
             try:
@@ -83,9 +228,88 @@ class BasicAPIClient(object):
                     log.error("Failed all retry attempts")
                     raise
 
+    def enable_identity_map(self):
+        """ Cache objects of identity_map_tables fetched by id for the rest of the run.
+
+        Cached objects are invalidated by updates and deletes made through this
+        client, changes made by other clients are not seen.
+        """
+        with self._identity_map_lock:
+            if self._identity_map is None:
+                self._identity_map = {}
+
+    def clear_identity_map(self):
+        with self._identity_map_lock:
+            if self._identity_map is not None:
+                self._identity_map.clear()
+
+    def _invalidate_identity_map(self, table_name, id):
+        model_name = self.identity_map_tables.get(table_name)
+
+        if self._identity_map is None or model_name is None:
+            return
+
+        with self._identity_map_lock:
+            for alias_name, alias_model_name in self.identity_map_tables.items():
+                if alias_model_name == model_name:
+                    self._identity_map.pop((alias_name, str(id)), None)
+
+    def _on_write(self, table_name):
+        """ Called after each create, update or delete made through this
+        client, whether or not it succeeded.  Override in subclasses to
+        invalidate cached results.
+        """
+        pass
+
+    def _get_by_id(self, table_name, id):
+        """ Get a resource from its detail endpoint, using the identity map if enabled. """
+
+        key = (table_name, str(id))
+        use_identity_map = self._identity_map is not None and table_name in self.identity_map_tables
+
+        if use_identity_map:
+            with self._identity_map_lock:
+                result = self._identity_map.get(key)
+            if result is not None:
+                return copy.deepcopy(result)
+
+        endpoint_url = self.join_urls(self.base_api_url, table_name, str(id))
+
+        r = self._get_thread_session().get(
+            endpoint_url)
+
+        if r.status_code == 404:
+            raise NotFoundError("no object for {}, {}".format(table_name, {"id": id}))
+
+        if not r.ok:
+            raise Exception('failed with error: "{}", reason: "{}"'.format(
+                r.reason, r.text))
+
+        result = r.json()
+
+        if use_identity_map:
+            with self._identity_map_lock:
+                self._identity_map[key] = copy.deepcopy(result)
+
+        return result
+
     def get(self, table_name, **fields):
         """ Check if a resource exists and if so return it. """
 
+        # Lookups by id use the detail endpoint, other fields are checked on the result
+        if (fields.get("id") is not None and "read" in self.coreapi_schema[table_name] and
+                not any("__" in a for a in fields)):
+            try:
+                result = self._get_by_id(table_name, fields["id"])
+            except NotFoundError:
+                raise NotFoundError("no object for {}, {}".format(table_name, fields))
+
+            matcher = self.get_field_matcher(table_name, {a: fields[a] for a in fields if a != "id"})
+            if not matcher.matches(result):
+                raise NotFoundError("no object for {}, {}".format(table_name, fields))
+
+            return result
+
         list_results = self.list(table_name, **fields)
 
         try:
@@ -139,12 +363,89 @@ class BasicAPIClient(object):
         """
         params["page"] += 1
 
-    def filter(self, table_name, filters):
+    def _supports_keyset(self, table_name, get_params):
+        if self.keyset_page_size_param is None:
+            return False
+
+        list_field_names = set(field.name for field in self.coreapi_schema[table_name]["list"].fields)
+        keyset_params = {"id__gt", "ordering", self.keyset_page_size_param}
+
+        return keyset_params.issubset(list_field_names) and not keyset_params.intersection(get_params)
+
+    def _list_keyset(self, table_name, get_params, cursor=None):
+        """ List results ordered by id, paged by the last id seen.
+
+        Results are consistent under concurrent inserts and deletes, and the
+        cost of each page does not grow with depth.
+        """
+        get_params = dict(get_params)
+        get_params["ordering"] = "id"
+
+        page_size = self.keyset_initial_page_size
+
+        while True:
+            get_params[self.keyset_page_size_param] = page_size
+            if cursor is not None:
+                get_params["id__gt"] = cursor
+
+            start = time.time()
+            list_results = self.coreapi_client.action(
+                self.coreapi_schema, [table_name, "list"], params=get_params)
+            elapsed = time.time() - start
+
+            for result in list_results["results"]:
+                yield result
+
+            if list_results.get("next") is None or not list_results["results"]:
+                break
+
+            cursor = list_results["results"][-1]["id"]
+
+            # Adapt the page size to the observed latency
+            if elapsed < self.keyset_target_page_seconds / 2:
+                page_size = min(page_size * 2, self.keyset_max_page_size)
+            elif elapsed > self.keyset_target_page_seconds:
+                page_size = max(page_size // 2, self.keyset_min_page_size)
+
+    def _list_results(self, table_name, get_params, cursor=None):
+        """ List results, with keyset pagination if supported by the endpoint.
+        """
+        if self._supports_keyset(table_name, get_params):
+            for result in self._list_keyset(table_name, get_params, cursor=cursor):
+                yield result
+            return
+
+        if cursor is not None:
+            raise ValueError("cursor not supported for {}".format(table_name))
+
+        get_params = dict(get_params)
+
+        # Add in pagination params
+        self.get_list_pagination_initial_params(get_params)
+
+        while True:
+            list_results = self.coreapi_client.action(
+                self.coreapi_schema, [table_name, "list"], params=get_params)
+
+            for result in list_results["results"]:
+                yield result
+
+            if list_results.get("next") is None:
+                break
+
+            # Set up for the next page
+            self.get_list_pagination_next_page_params(get_params)
+
+    def filter(self, table_name, filters, cursor=None):
         """ List resources in from endpoint with given filter fields.
 
         Args:
             table_name (str): the name of the table to query
             filters (dict): the name and value to filter by
+
+        KwArgs:
+            cursor (int): resume a keyset paginated listing after the result with this id,
+                usually the id of the last result processed by an interrupted listing
         """
         list_field_names = set()
         for field in self.coreapi_schema[table_name]["list"].fields:
@@ -158,21 +459,42 @@ class BasicAPIClient(object):
                 raise Exception(f'unsupported filter field {field_name}')
             get_params[field_name] = filters[field_name]
 
-        # Add in pagination params
-        self.get_list_pagination_initial_params(get_params)
+        for result in self._list_results(table_name, get_params, cursor=cursor):
+            yield result
 
-        while True:
-            list_results = self.coreapi_client.action(
-                self.coreapi_schema, [table_name, "list"], params=get_params)
+    def get_field_matcher(self, table_name, fields):
+        """ Get a matcher checking results of a table against expected field values.
 
-            for result in list_results["results"]:
-                yield result
+        Whether string fields are compared as timestamps is decided once per
+        table and set of fields from the schema of the table.
 
-            if list_results.get("next") is None:
-                break
+        Args:
+            table_name (str): name of the table
+            fields (dict): field names and expected values
 
-            # Set up for the next page
-            self.get_list_pagination_next_page_params(get_params)
+        Returns:
+            FieldMatcher
+        """
+        key = (table_name, frozenset(fields))
+
+        timestamp_fields = self._timestamp_fields.get(key)
+
+        if timestamp_fields is None:
+            schema_types = {}
+            for action in ("create", "partial_update"):
+                try:
+                    action_fields = self.coreapi_schema[table_name][action].fields
+                except KeyError:
+                    continue
+                for field in action_fields:
+                    schema_types.setdefault(field.name, type(field.schema).__name__)
+
+            timestamp_fields = frozenset(
+                a for a in fields if schema_types.get(a) not in NON_TIMESTAMP_SCHEMA_TYPES)
+
+            self._timestamp_fields[key] = timestamp_fields
+
+        return FieldMatcher(table_name, fields, timestamp_fields)
 
     def list(self, table_name, **fields):
         """ List resources in from endpoint with given filter fields. """
@@ -194,81 +516,19 @@ class BasicAPIClient(object):
                 raise ValueError("field {} not accepted for {}".format(
                     field_name, table_name))
 
-        # Add in pagination params
-        self.get_list_pagination_initial_params(get_params)
-
-        while True:
-            list_results = self.coreapi_client.action(
-                self.coreapi_schema, [table_name, "list"], params=get_params
-            )
+        # Fields applied as filters by the server need no checking, related
+        # model fields are not checked
+        matcher = self.get_field_matcher(table_name, {
+            a: fields[a] for a in fields if "__" not in a and a not in filter_fields})
 
-            for result in list_results["results"]:
-
-                filtered = False
-                for field_name, field_value in fields.items():
-                    # Currently no support for checking related model fields
-                    if "__" in field_name:
-                        continue
-
-                    if field_name not in result:
-                        raise Exception(
-                            "field {} not in {}".format(field_name, table_name)
-                        )
-
-                    result_field = result[field_name]
-
-                    # Response has nested foreign key relationship
-                    try:
-                        result_field = result[field_name]["id"]
-                    except (TypeError, KeyError):
-                        pass
-
-                    # Response has nested many to many
-                    many = False
-                    try:
-                        result_field = [a["id"] for a in result[field_name]]
-                        many = True
-                    except TypeError:
-                        pass
-
-                    # Response is non nested many to many
-                    try:
-                        result_field = [a+0 for a in result[field_name]]
-                        many = True
-                    except TypeError:
-                        pass
-
-                    # Response is a timestamp
-                    try:
-                        if result[field_name] and isinstance(result[field_name], str):
-                            result_field = pd.Timestamp(result[field_name])
-                            field_value = pd.Timestamp(field_value)
-                    except (ValueError, TypeError):
-                        pass
-
-                    if many:
-                        result_field = set(result_field)
-                        field_value = set(field_value)
-
-                    if result_field != field_value:
-                        if result_field in filter_fields:
-                            raise FieldMismatchError(
-                                "field {} mismatches for model {}, set to {} not {}".format(
-                                    field_name, result["id"], result_field, field_value
-                                )
-                            )
-                        else:
-                            filtered = True
-                            continue
-
-                if not filtered:
-                    yield result
-
-            if list_results.get("next") is None:
-                break
+        if not matcher.fields:
+            for result in self._list_results(table_name, get_params):
+                yield result
+            return
 
-            # Set up for the next page
-            self.get_list_pagination_next_page_params(get_params)
+        for result in self._list_results(table_name, get_params):
+            if matcher.matches(result):
+                yield result
 
     def create(self, table_name, fields, keys, get_existing=False, do_update=False):
         """ Create the resource and return it.
@@ -304,61 +564,23 @@ class BasicAPIClient(object):
 
         # No existing record found, attempt create
         if result is None:
-            return self.coreapi_client.action(
-                self.coreapi_schema, [table_name, "create"], params=fields), False
+            try:
+                return self.coreapi_client.action(
+                    self.coreapi_schema, [table_name, "create"], params=fields), False
+            finally:
+                self._on_write(table_name)
 
         # Record exists, check equality
         is_equal = True
-        for field_name, field_value in fields.items():
-            if field_name not in result:
-                raise Exception(
-                    "field {} not in {}".format(field_name, table_name)
-                )
-
-            result_field = result[field_name]
-
-            # Response has nested foreign key relationship
-            try:
-                result_field = result[field_name]["id"]
-            except (TypeError, KeyError):
-                pass
-
-            # Response has nested many to many
-            many = False
-            try:
-                result_field = [a["id"] for a in result[field_name]]
-                many = True
-            except TypeError:
-                pass
-
-            # Response is non nested many to many
-            try:
-                result_field = [a+0 for a in result[field_name]]
-                many = True
-            except TypeError:
-                pass
-
-            # Response is a timestamp
-            try:
-                if result[field_name] and isinstance(result[field_name], str):
-                    result_field = pd.Timestamp(result[field_name])
-                    field_value = pd.Timestamp(field_value)
-            except (ValueError, TypeError):
-                pass
-
-            if many:
-                result_field = set(result_field)
-                field_value = set(field_value)
+        for field_name, result_field, field_value in self.get_field_matcher(table_name, fields).mismatches(result):
+            is_equal = False
 
-            if result_field != field_value:
-                is_equal = False
-
-                if not do_update:
-                    raise FieldMismatchError(
-                        "field {} mismatches for {} model {}, set to {} not {}".format(
-                            field_name, table_name, result["id"], result_field, field_value
-                        )
+            if not do_update:
+                raise FieldMismatchError(
+                    "field {} mismatches for {} model {}, set to {} not {}".format(
+                        field_name, table_name, result["id"], result_field, field_value
                     )
+                )
 
         # If not equal, update
         if not is_equal:
@@ -376,45 +598,244 @@ class BasicAPIClient(object):
         except NotFoundError:
             pass
 
-        return self.coreapi_client.action(
-            self.coreapi_schema, [table_name, "create"], params=fields
-        )
+        try:
+            return self.coreapi_client.action(
+                self.coreapi_schema, [table_name, "create"], params=fields
+            )
+        finally:
+            self._on_write(table_name)
 
     @staticmethod
     def join_urls(*pieces):
         """Join pieces of an URL together safely."""
         return '/'.join(s.strip('/') for s in pieces) + '/'
 
-    def update(self, table_name, id=None, **fields):
-        """ Create the resource and return it. """
+    def _get_thread_session(self):
+        """ Get a session for use by the current thread.
 
-        if id is None:
-            raise ValueError('must specify id of existing model')
+        Worker threads used for concurrent requests each get their own
+        session with the same auth and headers as the main session.
+        """
+        if threading.current_thread() is threading.main_thread():
+            return self.session
+
+        session = getattr(self._thread_local, 'session', None)
+
+        if session is None:
+            session = requests.Session()
+            session.auth = self.session.auth
+            session.headers.update(self.session.headers)
+            if self.profiler is not None:
+                self.profiler.instrument(session, self.base_api_url)
+            self._thread_local.session = session
+
+        return session
+
+    def _patch(self, table_name, id, fields):
+        """ Send a PATCH request and return the response body. """
+
+        self._invalidate_identity_map(table_name, id)
 
         endpoint_url = self.join_urls(self.base_api_url, table_name, str(id))
 
         payload = json.dumps(fields, cls=DjangoJSONEncoder)
 
-        r = self.session.patch(
-            endpoint_url,
-            data=payload)
+        try:
+            r = self._get_thread_session().patch(
+                endpoint_url,
+                data=payload)
+        finally:
+            self._on_write(table_name)
 
         if not r.ok:
             raise Exception('failed with error: "{}", reason: "{}", data: "{}"'.format(
                 r.reason, r.text, payload))
 
-        return self.get(table_name, id=id)
+        return r.json()
+
+    def update(self, table_name, id=None, **fields):
+        """ Update the resource and return it.
+
+        The returned object is the PATCH response, in which related models
+        are ids rather than the nested objects returned by get.  Use get with
+        the id if nested fields are required.
+        """
 
-    def delete(self, table_name, id=None):
         if id is None:
             raise ValueError('must specify id of existing model')
 
+        return self._patch(table_name, id, fields)
+
+    def _post(self, table_name, fields):
+        """ Send a POST request and return the response body. """
+
+        endpoint_url = self.join_urls(self.base_api_url, table_name)
+
+        payload = json.dumps(fields, cls=DjangoJSONEncoder)
+
+        try:
+            r = self._get_thread_session().post(
+                endpoint_url,
+                data=payload)
+        finally:
+            self._on_write(table_name)
+
+        if not r.ok:
+            raise Exception('failed with error: "{}", reason: "{}", data: "{}"'.format(
+                r.reason, r.text, payload))
+
+        return r.json()
+
+    def bulk_create(self, table_name, records, max_workers=8):
+        """ Create many resources concurrently.
+
+        Args:
+            table_name (str): name of the table
+            records (iterable of dict): field names and values for new records
+
+        Kwargs:
+            max_workers (int): maximum number of concurrent requests
+
+        Returns:
+            list of created objects in the same order as records
+        """
+
+        records = list(records)
+
+        results = self._run_concurrently(
+            lambda fields: self._post(table_name, fields),
+            records, max_workers, '{} creations'.format(table_name))
+
+        log.info('created {} {} models'.format(len(records), table_name))
+
+        return results
+
+    def _run_concurrently(self, func, items, max_workers, description):
+        """ Call func on each item from a bounded thread pool.
+
+        Args:
+            func (callable): function taking a single item
+            items (list): items to process
+            max_workers (int): maximum number of concurrent requests
+            description (str): description of the items for logging
+
+        Returns:
+            list of results in the same order as items
+
+        All items are attempted, failures are logged and a BulkError listing
+        the failed items is raised once the remaining items have completed.
+        """
+        results = [None] * len(items)
+        errors = []
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(func, item): idx
+                for idx, item in enumerate(items)}
+
+            for future in concurrent.futures.as_completed(futures):
+                idx = futures[future]
+                try:
+                    results[idx] = future.result()
+                except Exception as e:
+                    log.error('{} failed for {}: {}'.format(description, items[idx], e))
+                    errors.append(idx)
+
+        if errors:
+            raise BulkError(
+                '{} failed for {} of {} items'.format(description, len(errors), len(items)),
+                [items[idx] for idx in sorted(errors)],
+                results)
+
+        return results
+
+    def bulk_patch(self, table_name, updates, max_workers=8):
+        """ Update many resources concurrently.
+
+        Args:
+            table_name (str): name of the table
+            updates (iterable of dict): fields to update, each including the id
+
+        Kwargs:
+            max_workers (int): maximum number of concurrent requests
+
+        Returns:
+            list of updated objects in the same order as updates, with related
+            models as ids as for update
+
+        Raises:
+            BulkError listing the updates that failed, once all updates are attempted
+        """
+
+        updates = [dict(a) for a in updates]
+
+        for fields in updates:
+            if fields.get('id') is None:
+                raise ValueError('must specify id of existing model')
+
+        def _patch_fields(fields):
+            fields = dict(fields)
+            id = fields.pop('id')
+            return self._patch(table_name, id, fields)
+
+        results = self._run_concurrently(
+            _patch_fields, updates, max_workers, '{} updates'.format(table_name))
+
+        log.info('updated {} {} models'.format(len(updates), table_name))
+
+        return results
+
+    def _delete(self, table_name, id):
+        """ Send a DELETE request. """
+
+        self._invalidate_identity_map(table_name, id)
+
         endpoint_url = self.join_urls(self.base_api_url, table_name, str(id))
 
-        r = self.session.delete(
-            endpoint_url)
+        try:
+            r = self._get_thread_session().delete(
+                endpoint_url)
+        finally:
+            self._on_write(table_name)
 
         if not r.ok:
             raise Exception('failed with error: "{}", reason: "{}"'.format(
                 r.reason, r.text))
 
+    def delete(self, table_name, id=None):
+        if id is None:
+            raise ValueError('must specify id of existing model')
+
+        self._delete(table_name, id)
+
+    def bulk_delete(self, table_name, ids, max_workers=8):
+        """ Delete many resources concurrently.
+
+        Args:
+            table_name (str): name of the table
+            ids (iterable of int): ids of the models to delete
+
+        Kwargs:
+            max_workers (int): maximum number of concurrent requests
+
+        Returns:
+            list of ids that could not be deleted
+
+        All deletions are attempted, failures are logged and returned.
+        """
+
+        ids = list(ids)
+
+        def _delete_id(id):
+            try:
+                self._delete(table_name, id)
+            except Exception as e:
+                log.error('{} deletion failed for {}: {}'.format(table_name, id, e))
+                return id
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            failed = [a for a in executor.map(_delete_id, ids) if a is not None]
+
+        log.info('deleted {} {} models, {} failed'.format(len(ids) - len(failed), table_name, len(failed)))
+
+        return failed
@@ -0,0 +1,269 @@
+""" Opt-in request instrumentation for the REST API clients.
+
+Set SISYPHUS_PROFILE_REQUESTS=1 to record every HTTP request made by a
+BasicAPIClient.  A report of request counts, latency histograms, pages
+fetched, bytes received and the call sites responsible for the most
+expensive requests is logged at exit or when the process receives
+SIGUSR1.  Set SISYPHUS_PROFILE_OUTPUT to a filename to additionally
+write the report as json.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import atexit
+import collections
+import json
+import logging
+import os
+import signal
+import threading
+import traceback
+
+try:
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from urlparse import urlparse, parse_qs
+
+log = logging.getLogger('sisyphus')
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., float('inf'))
+
+# Number of (table, action) pairs and call sites shown in the report
+TOP_OFFENDERS = 10
+TOP_CALL_SITES = 5
+
+# Query parameters of a page of a listing, with page number or keyset
+# pagination, the first keyset page having only a page size
+PAGE_PARAMS = ('page', 'id__gt', 'page_size')
+
+# Number of frames outside the client libraries used to identify a call site
+CALL_SITE_DEPTH = 3
+
+# Frames from these modules are skipped when summarizing a call site
+_LIBRARY_PATHS = (
+    os.path.dirname(os.path.abspath(__file__)),
+    os.sep + 'requests' + os.sep,
+    os.sep + 'coreapi' + os.sep,
+    os.sep + 'urllib3' + os.sep,
+)
+
+
+def profiling_enabled():
+    """ Check whether request profiling was requested in the environment.
+    """
+    return os.environ.get('SISYPHUS_PROFILE_REQUESTS', '').lower() in ('1', 'true', 'yes')
+
+
+def _get_call_site():
+    """ Summarize the stack outside of the client libraries as a string.
+    """
+    frames = [
+        f for f in traceback.extract_stack()
+        if not any(p in os.path.abspath(f[0]) for p in _LIBRARY_PATHS)
+    ]
+
+    frames = frames[-CALL_SITE_DEPTH:]
+
+    return ' <- '.join(reversed([
+        '{}:{} {}'.format(os.path.basename(f[0]), f[1], f[2]) for f in frames
+    ]))
+
+
+class RequestStats(object):
+    """ Accumulated statistics for a single table and action. """
+
+    def __init__(self):
+        self.count = 0
+        self.pages = 0
+        self.bytes_received = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+        self.call_sites = collections.Counter()
+
+    def add(self, elapsed, num_bytes, is_page, call_site):
+        self.count += 1
+        self.bytes_received += num_bytes
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        if is_page:
+            self.pages += 1
+        for idx, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self.histogram[idx] += 1
+                break
+        self.call_sites[call_site] += 1
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'pages': self.pages,
+            'bytes_received': self.bytes_received,
+            'total_time': self.total_time,
+            'mean_time': self.total_time / self.count if self.count else 0.,
+            'max_time': self.max_time,
+            'histogram': dict(zip([str(b) for b in LATENCY_BUCKETS], self.histogram)),
+            'call_sites': self.call_sites.most_common(TOP_CALL_SITES),
+        }
+
+
+class RequestProfiler(object):
+    """ Collects statistics on requests made through instrumented sessions. """
+
+    def __init__(self):
+        # Reentrant, the SIGUSR1 handler dumps the report on the main thread
+        # and may interrupt it while it holds the lock in record
+        self.lock = threading.RLock()
+        self.stats = collections.defaultdict(RequestStats)
+        self.base_paths = []
+
+    def instrument(self, session, base_api_url):
+        """ Add a response hook recording requests made by a session.
+
+        Args:
+            session (requests.Session): session to instrument
+            base_api_url (str): api url, used to identify the table of a request
+        """
+        base_path = urlparse(base_api_url).path.rstrip('/') + '/'
+        if base_path not in self.base_paths:
+            self.base_paths.append(base_path)
+
+        session.hooks['response'].append(self._response_hook)
+
+    def _classify(self, method, url):
+        """ Get the table and action of a request from its method and url.
+        """
+        parsed = urlparse(url)
+
+        path = parsed.path
+        for base_path in self.base_paths:
+            if path.startswith(base_path):
+                path = path[len(base_path):]
+                break
+
+        pieces = [a for a in path.split('/') if a]
+        table_name = pieces[0] if pieces else path
+        has_id = len(pieces) > 1
+
+        method = method.upper()
+        if method == 'GET':
+            action = 'read' if has_id else 'list'
+        elif method == 'POST':
+            action = 'create'
+        elif method in ('PATCH', 'PUT'):
+            action = 'update'
+        elif method == 'DELETE':
+            action = 'delete'
+        else:
+            action = method.lower()
+
+        query = parse_qs(parsed.query)
+        is_page = action == 'list' and any(a in query for a in PAGE_PARAMS)
+
+        return table_name, action, is_page
+
+    def _response_hook(self, response, *args, **kwargs):
+        table_name, action, is_page = self._classify(response.request.method, response.url)
+
+        self.record(
+            table_name,
+            action,
+            response.elapsed.total_seconds(),
+            len(response.content or b''),
+            is_page=is_page,
+        )
+
+        return response
+
+    def record(self, table_name, action, elapsed, num_bytes, is_page=False):
+        """ Record a single request.
+
+        Args:
+            table_name (str): table queried
+            action (str): one of list, read, create, update, delete
+            elapsed (float): request latency in seconds
+            num_bytes (int): size of the response body
+
+        KwArgs:
+            is_page (bool): request fetched a page of a listing
+        """
+        call_site = _get_call_site()
+
+        with self.lock:
+            self.stats[(table_name, action)].add(elapsed, num_bytes, is_page, call_site)
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+    def summary(self):
+        """ Get the statistics sorted by total time, most expensive first.
+
+        Returns:
+            list of dict
+        """
+        with self.lock:
+            items = sorted(self.stats.items(), key=lambda a: -a[1].total_time)
+            summary = []
+            for (table_name, action), stats in items:
+                entry = {'table': table_name, 'action': action}
+                entry.update(stats.to_dict())
+                summary.append(entry)
+
+        return summary
+
+    def dump(self, output_filename=None):
+        """ Log a report of the collected statistics.
+
+        KwArgs:
+            output_filename (str): additionally write the summary as json
+        """
+        summary = self.summary()
+
+        total_count = sum(a['count'] for a in summary)
+        total_time = sum(a['total_time'] for a in summary)
+        total_bytes = sum(a['bytes_received'] for a in summary)
+
+        log.info('request profile: {} requests, {:.2f}s, {} bytes received'.format(
+            total_count, total_time, total_bytes))
+
+        for entry in summary[:TOP_OFFENDERS]:
+            log.info('{table} {action}: {count} requests, {pages} pages, {bytes_received} bytes, '
+                     'total {total_time:.2f}s, mean {mean_time:.3f}s, max {max_time:.3f}s'.format(**entry))
+            log.info('  latency histogram: {}'.format(', '.join(
+                '<={}s: {}'.format(b, n) for b, n in entry['histogram'].items() if n)))
+            for call_site, count in entry['call_sites']:
+                log.info('  {} from {}'.format(count, call_site))
+
+        if output_filename is not None:
+            with open(output_filename, 'w') as f:
+                json.dump(summary, f, indent=2)
+
+    def install_handlers(self):
+        """ Dump the report at exit and on SIGUSR1.
+        """
+        output_filename = os.environ.get('SISYPHUS_PROFILE_OUTPUT')
+
+        atexit.register(self.dump, output_filename=output_filename)
+
+        # Signal handlers can only be set from the main thread
+        if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump(output_filename=output_filename))
+
+
+_profiler = None
+
+
+def get_profiler():
+    """ Get the process wide profiler, installing the report handlers on first use.
+    """
+    global _profiler
+
+    if _profiler is None:
+        _profiler = RequestProfiler()
+        _profiler.install_handlers()
+
+    return _profiler
@@ -9,10 +9,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import concurrent.futures
+import hashlib
 import json
 import logging
 import os
 import shutil
+import threading
 
 import azure.storage.blob as azureblob
 import azure.storage.blob._shared_access_signature as blob_sas
@@ -36,6 +40,30 @@ TANTALUS_API_URL = os.environ.get(
     'TANTALUS_API_URL',
     "https://tantalus.canadacentral.cloudapp.azure.com/api/")
 
+# Maximum number of subrequests in an azure blob batch request
+BLOB_BATCH_SIZE = 256
+
+# Default block size and number of concurrent block uploads per blob
+BLOB_BLOCK_SIZE = 32 * 1024 * 1024
+BLOB_UPLOAD_CONCURRENCY = 8
+
+# Maximum number of blocks in a block blob
+BLOB_MAX_BLOCKS = 50000
+
+# Lifetime of sas tokens and of the cached user delegation keys used to sign them,
+# cached container sas tokens are renewed within the refresh margin of expiry
+SAS_LIFETIME = datetime.timedelta(hours=12)
+SAS_REFRESH_MARGIN = datetime.timedelta(hours=1)
+DELEGATION_KEY_LIFETIME = datetime.timedelta(hours=36)
+
+# Initial and maximum seconds between polls of pending server side copies
+COPY_POLL_INTERVAL = 1
+MAX_COPY_POLL_INTERVAL = 60
+
+# Number of pending copies in a directory above which the directory is listed
+# rather than querying the properties of each blob
+COPY_LISTING_THRESHOLD = 8
+
 
 class BlobStorageClient(object):
     def __init__(self, storage_account, storage_container, prefix):
@@ -57,7 +85,11 @@ class BlobStorageClient(object):
             storage_account_url,
             storage_account_token)
 
-        self.blob_service.MAX_BLOCK_SIZE = 64 * 1024 * 1024
+        self._delegation_key = None
+        self._delegation_key_expiry = None
+        self._delegation_key_lock = threading.Lock()
+        self._container_sas = {}
+
 
     def get_size(self, blobname):
         blob_client = self.blob_service.get_blob_client(self.storage_container, blobname)
@@ -70,31 +102,92 @@ class BlobStorageClient(object):
         created_time = blob.last_modified.isoformat()
         return created_time
 
-    def get_url(self, blobname, write_permission=False):
+    def _get_user_delegation_key(self, valid_until):
+        """ Get a cached user delegation key valid until at least valid_until.
+        """
+        with self._delegation_key_lock:
+            if self._delegation_key is None or self._delegation_key_expiry < valid_until:
+                start_time = datetime.datetime.utcnow()
+                expiry_time = start_time + DELEGATION_KEY_LIFETIME
+
+                self._delegation_key = self.blob_service.get_user_delegation_key(
+                    key_start_time=start_time,
+                    key_expiry_time=expiry_time
+                )
+                self._delegation_key_expiry = expiry_time
+
+            return self._delegation_key
+
+    def get_container_sas(self, write_permission=False):
+        """ Get a container scoped sas token for bulk operations.
+
+        The token is cached and reused until shortly before it expires.
+
+        KwArgs:
+            write_permission (bool): allow writes and deletes
+
+        Returns:
+            sas token (str)
+        """
+        now = datetime.datetime.utcnow()
+
+        with self._delegation_key_lock:
+            cached = self._container_sas.get(write_permission)
+            if cached is not None and cached[1] - SAS_REFRESH_MARGIN > now:
+                return cached[0]
 
         if write_permission:
-            permissions = azureblob.BlobSasPermissions(read=True, write=True, create=True, delete=True)
+            permissions = azureblob.ContainerSasPermissions(read=True, write=True, create=True, delete=True, list=True)
         else:
-            permissions = azureblob.BlobSasPermissions(read=True)
+            permissions = azureblob.ContainerSasPermissions(read=True, list=True)
 
-        start_time = datetime.datetime.utcnow()
-        expiry_time = datetime.datetime.utcnow() + datetime.timedelta(hours=12)
+        expiry_time = now + SAS_LIFETIME
 
-        token = self.blob_service.get_user_delegation_key(
-            key_start_time=start_time,
-            key_expiry_time=expiry_time
-        )
-
-        sas_token = blob_sas.generate_blob_sas(
+        sas_token = blob_sas.generate_container_sas(
             self.storage_account,
             self.storage_container,
-            blobname,
-            user_delegation_key=token,
+            user_delegation_key=self._get_user_delegation_key(expiry_time),
             permission=permissions,
-            start=start_time,
+            start=now,
             expiry=expiry_time,
         )
 
+        with self._delegation_key_lock:
+            self._container_sas[write_permission] = (sas_token, expiry_time)
+
+        return sas_token
+
+    def get_url(self, blobname, write_permission=False, container_sas=False):
+        """ Get a url to a blob including a sas token.
+
+        Tokens are signed locally from a cached user delegation key.
+
+        KwArgs:
+            write_permission (bool): allow writes and deletes
+            container_sas (bool): use the cached container scoped sas token
+        """
+        if container_sas:
+            sas_token = self.get_container_sas(write_permission=write_permission)
+
+        else:
+            if write_permission:
+                permissions = azureblob.BlobSasPermissions(read=True, write=True, create=True, delete=True)
+            else:
+                permissions = azureblob.BlobSasPermissions(read=True)
+
+            start_time = datetime.datetime.utcnow()
+            expiry_time = start_time + SAS_LIFETIME
+
+            sas_token = blob_sas.generate_blob_sas(
+                self.storage_account,
+                self.storage_container,
+                blobname,
+                user_delegation_key=self._get_user_delegation_key(expiry_time),
+                permission=permissions,
+                start=start_time,
+                expiry=expiry_time,
+            )
+
         protocol = "https"
         primary_endpoint = "{}.blob.core.windows.net".format(self.storage_account)
 
@@ -112,6 +205,38 @@ class BlobStorageClient(object):
         blob_client = self.blob_service.get_blob_client(self.storage_container, blobname)
         blob_client.delete_blob()
 
+    def delete_many(self, blobnames, max_workers=4):
+        """ Delete blobs using concurrent batch requests.
+
+        Args:
+            blobnames (list): names of blobs to delete
+
+        KwArgs:
+            max_workers (int): maximum number of concurrent batch requests
+
+        Returns:
+            list of blobnames that could not be deleted, blobs that
+            do not exist are considered deleted
+        """
+        container_client = self.blob_service.get_container_client(self.storage_container)
+
+        def _delete_batch(batch):
+            responses = container_client.delete_blobs(*batch, raise_on_any_failure=False)
+            return [
+                blobname for blobname, response in zip(batch, responses)
+                if response.status_code not in (202, 404)]
+
+        batches = [
+            blobnames[idx:idx + BLOB_BATCH_SIZE]
+            for idx in range(0, len(blobnames), BLOB_BATCH_SIZE)]
+
+        failed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch_failed in executor.map(_delete_batch, batches):
+                failed.extend(batch_failed)
+
+        return failed
+
     def open_file(self, blobname):
         url = self.get_url(blobname)
         return urlopen(url)
@@ -132,22 +257,158 @@ class BlobStorageClient(object):
         for blob in container_blobs:
             yield blob.name
 
+    def list_properties(self, directory):
+        """ List size and created time of blobs directly within a directory.
+
+        Args:
+            directory (str): directory relative to the container
+
+        Yields:
+            blobname, size, created
+        """
+        container_client = self.blob_service.get_container_client(self.storage_container)
+
+        prefix = directory.rstrip('/') + '/' if directory else ''
+
+        for blob in container_client.walk_blobs(name_starts_with=prefix, delimiter='/'):
+            if isinstance(blob, azureblob.BlobPrefix):
+                continue
+            yield blob.name, blob.size, blob.last_modified.isoformat()
+
+    def get_properties(self, blobname):
+        """ Get the size and created time of a blob with one request.
+
+        Args:
+            blobname (str): name of the blob
+
+        Returns:
+            size, created or None if the blob does not exist
+        """
+        properties = self._get_properties(blobname)
+        if properties is None:
+            return None
+        return properties.size, properties.last_modified.isoformat()
+
+    def list_sizes(self, prefix=''):
+        """ List the size of all blobs with a prefix, in one paged listing.
+
+        Args:
+            prefix (str): blobname prefix
+
+        Yields:
+            blobname, size
+        """
+        container_client = self.blob_service.get_container_client(self.storage_container)
+
+        for blob in container_client.list_blobs(name_starts_with=prefix or None):
+            yield blob.name, blob.size
+
     def write_data(self, blobname, stream):
         stream.seek(0)
         blob_client = self.blob_service.get_blob_client(self.storage_container, blobname)
         return blob_client.upload_blob(stream, overwrite=True)
 
-    def create(self, blobname, filepath, update=False, max_concurrency=None, timeout=None):
+    def _get_properties(self, blobname):
+        blob_client = self.blob_service.get_blob_client(self.storage_container, blobname)
+
+        try:
+            return blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+
+    def upload_blocks(
+            self, blobname, filepath, block_size=None, max_concurrency=None, timeout=None,
+            progress_callback=None):
+        """ Upload a file as a block blob with concurrent block uploads.
+
+        Args:
+            blobname (str): name of the blob
+            filepath (str): path of the local file
+
+        KwArgs:
+            block_size (int): size of each block, increased if the file would need too many blocks
+            max_concurrency (int): maximum number of concurrent block uploads
+            timeout (int): timeout in seconds for each block upload
+            progress_callback (callable): called with bytes uploaded and total bytes
+
+        Files no larger than one block are uploaded with a single request.
+        Block ids are derived from the file size, modification time and block
+        size, blocks staged by a previous failed upload of the same file are
+        not uploaded again.
+        """
+        if block_size is None:
+            block_size = BLOB_BLOCK_SIZE
+        if max_concurrency is None:
+            max_concurrency = BLOB_UPLOAD_CONCURRENCY
+
+        stat = os.stat(filepath)
+        filesize = stat.st_size
+
+        while filesize > block_size * BLOB_MAX_BLOCKS:
+            block_size *= 2
+
         kwargs = {}
-        if max_concurrency:
-            kwargs['max_concurrency'] = max_concurrency
         if timeout:
             kwargs['timeout'] = timeout
 
-        if self.exists(blobname):
+        blob_client = self.blob_service.get_blob_client(self.storage_container, blobname)
+
+        if filesize <= block_size:
+            with open(filepath, 'rb') as f:
+                blob_client.upload_blob(f, overwrite=True, max_concurrency=max_concurrency, **kwargs)
+            if progress_callback is not None:
+                progress_callback(filesize, filesize)
+            return
+
+        upload_key = hashlib.md5('{}:{}:{}'.format(
+            filesize, stat.st_mtime_ns, block_size).encode()).hexdigest()[:16]
+
+        blocks = []
+        for idx, offset in enumerate(range(0, filesize, block_size)):
+            block_id = '{}-{:08d}'.format(upload_key, idx)
+            blocks.append((block_id, offset, min(block_size, filesize - offset)))
+
+        # Blocks staged but not committed by a previous attempt
+        try:
+            _, uncommitted = blob_client.get_block_list('uncommitted')
+            staged = {block.id: block.size for block in uncommitted}
+        except ResourceNotFoundError:
+            staged = {}
+
+        remaining = [a for a in blocks if staged.get(a[0]) != a[2]]
+
+        if len(remaining) < len(blocks):
+            log.info("resuming upload of {}, {} of {} blocks already staged".format(
+                blobname, len(blocks) - len(remaining), len(blocks)))
+
+        progress_lock = threading.Lock()
+        progress = {'uploaded': filesize - sum(a[2] for a in remaining)}
+
+        def _stage_block(block):
+            block_id, offset, length = block
+            with open(filepath, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+            blob_client.stage_block(block_id, data, length=length, **kwargs)
+            if progress_callback is not None:
+                with progress_lock:
+                    progress['uploaded'] += length
+                    progress_callback(progress['uploaded'], filesize)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            list(executor.map(_stage_block, remaining))
+
+        blob_client.commit_block_list([azureblob.BlobBlock(block_id=a[0]) for a in blocks], **kwargs)
+
+    def create(
+            self, blobname, filepath, update=False, max_concurrency=None, timeout=None,
+            block_size=None, progress_callback=None):
+        blob = self._get_properties(blobname)
+
+        if blob is not None:
             log.info("{} already exists on {}".format(blobname, self.prefix))
 
-            blobsize = self.get_size(blobname)
+            blobsize = blob.size
             filesize = os.path.getsize(filepath)
 
             if blobsize == filesize:
@@ -160,29 +421,123 @@ class BlobStorageClient(object):
 
         log.info("Creating blob {} from path {}".format(blobname, filepath))
 
+        self.upload_blocks(
+            blobname, filepath,
+            block_size=block_size,
+            max_concurrency=max_concurrency,
+            timeout=timeout,
+            progress_callback=progress_callback,
+        )
+
+    def create_many(self, files, update=False, max_workers=16, **kwargs):
+        """ Create many blobs concurrently.
+
+        Args:
+            files (list): pairs of blobname and filepath
+
+        KwArgs:
+            update (bool): update blobs that differ in size from the local file
+            max_workers (int): maximum number of concurrent files
+            kwargs: additional arguments to create
+
+        Returns:
+            list of blobnames that could not be created
+        """
+        def _create(blobname_filepath):
+            blobname, filepath = blobname_filepath
+            try:
+                self.create(blobname, filepath, update=update, **kwargs)
+            except Exception:
+                log.exception('failed to create {}'.format(blobname))
+                return blobname
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return [a for a in executor.map(_create, files) if a is not None]
+
+    def start_copy(self, blobname, source_url):
+        """ Start a server side copy of a url to a blob.
+
+        Returns:
+            copy status, 'success' or 'pending'
+        """
         blob_client = self.blob_service.get_blob_client(self.storage_container, blobname)
+        return blob_client.start_copy_from_url(source_url)['copy_status']
+
+    def get_copy_status(self, blobnames, max_workers=8):
+        """ Get the copy status of many blobs.
+
+        Blobs in directories with many queried blobs are obtained from one
+        listing of the directory, other blobs are queried individually.
+
+        Args:
+            blobnames (list): blobs to query
+
+        KwArgs:
+            max_workers (int): maximum number of concurrent requests
 
-        with open(filepath, "rb") as stream:
-            blob_client.upload_blob(stream, overwrite=True)
+        Returns:
+            dict of blobname to copy status, status description and size,
+            blobs that do not exist are omitted
+        """
+        container_client = self.blob_service.get_container_client(self.storage_container)
+
+        directories = collections.defaultdict(list)
+        for blobname in blobnames:
+            directories[os.path.dirname(blobname)].append(blobname)
+
+        def _list_directory(directory):
+            prefix = directory + '/' if directory else ''
+            return [
+                blob for blob in container_client.walk_blobs(name_starts_with=prefix, include=['copy'], delimiter='/')
+                if not isinstance(blob, azureblob.BlobPrefix)]
+
+        def _get_blob(blobname):
+            properties = self._get_properties(blobname)
+            return [properties] if properties is not None else []
+
+        requests = []
+        for directory, directory_blobnames in directories.items():
+            if len(directory_blobnames) > COPY_LISTING_THRESHOLD:
+                requests.append((_list_directory, directory))
+            else:
+                requests.extend((_get_blob, a) for a in directory_blobnames)
+
+        queried = set(blobnames)
+        status = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for blobs in executor.map(lambda request: request[0](request[1]), requests):
+                for blob in blobs:
+                    if blob.name in queried:
+                        status[blob.name] = (blob.copy.status, blob.copy.status_description, blob.size)
+
+        return status
 
     def copy(self, blobname, new_blobname, wait=False):
-        url = self.get_url(blobname)
-        blob_client = self.blob_service.get_blob_client(self.storage_container, new_blobname)
-        copy_props = blob_client.start_copy_from_url(url)
-        if wait:
-            while copy_props.status != 'success':
-                time.sleep(1)
-                blob = blob_client.get_blob_properties(self.storage_container, new_blobname)
-                copy_props = blob.properties.copy
+        blob_status = self.start_copy(new_blobname, self.get_url(blobname))
+
+        interval = COPY_POLL_INTERVAL
+        while wait and blob_status != 'success':
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_COPY_POLL_INTERVAL)
+
+            copy_props = self.blob_service.get_blob_client(
+                self.storage_container, new_blobname).get_blob_properties().copy
+            blob_status = copy_props.status
+
+            if blob_status in ('failed', 'aborted'):
+                raise Exception('copy of {} to {} {}: {}'.format(
+                    blobname, new_blobname, blob_status, copy_props.status_description))
 
     def download(
-            self, blob_name, destination_file_path, max_concurrency=None, timeout=None
+            self, blob_name, destination_file_path, max_concurrency=None, timeout=None, progress_callback=None
     ):
         """
         download data from blob storage
         :param container_name: blob container name
         :param blob_name: blob path
         :param destination_file_path: path to download the file to
+        :param progress_callback: called with bytes downloaded and total bytes, chunks are then downloaded sequentially
         :return: azure.storage.blob.baseblobservice.Blob instance with content properties and metadata
         """
         kwargs = {}
@@ -195,7 +550,14 @@ class BlobStorageClient(object):
             blob_client = self.blob_service.get_blob_client(self.storage_container, blob_name)
             with open(destination_file_path, "wb") as my_blob:
                 download_stream = blob_client.download_blob(**kwargs)
-                my_blob.write(download_stream.readall())
+                if progress_callback is None:
+                    download_stream.readinto(my_blob)
+                else:
+                    downloaded = 0
+                    for chunk in download_stream.chunks():
+                        my_blob.write(chunk)
+                        downloaded += len(chunk)
+                        progress_callback(downloaded, download_stream.size)
             blob = blob_client.get_blob_properties()
         except Exception as exc:
             print("Error downloading {} from {}".format(blob_name, self.storage_container))
@@ -229,6 +591,31 @@ class ServerStorageClient(object):
     def delete(self, filename):
         os.remove(self.get_url(filename))
 
+    def delete_many(self, filenames, max_workers=16):
+        """ Delete files concurrently.
+
+        Args:
+            filenames (list): names of files to delete
+
+        KwArgs:
+            max_workers (int): maximum number of concurrent deletions
+
+        Returns:
+            list of filenames that could not be deleted, files that
+            do not exist are considered deleted
+        """
+        def _delete(filename):
+            try:
+                self.delete(filename)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                log.exception('failed to delete {}'.format(filename))
+                return filename
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return [a for a in executor.map(_delete, filenames) if a is not None]
+
     def open_file(self, filename):
         filepath = os.path.join(self.storage_directory, filename)
         return open(filepath)
@@ -242,6 +629,65 @@ class ServerStorageClient(object):
             for filename in files:
                 yield os.path.join(root, filename)
 
+    def list_properties(self, directory):
+        """ List size and created time of files directly within a directory.
+
+        Args:
+            directory (str): directory relative to the storage directory
+
+        Yields:
+            filename, size, created
+        """
+        try:
+            entries = list(os.scandir(os.path.join(self.storage_directory, directory)))
+        except FileNotFoundError:
+            return
+
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            # TODO: this is currently fixed at pacific time
+            created = pd.Timestamp(time.ctime(stat.st_mtime), tz="Canada/Pacific").isoformat()
+            yield os.path.join(directory, entry.name), stat.st_size, created
+
+    def get_properties(self, filename):
+        """ Get the size and created time of a file.
+
+        Args:
+            filename (str): filename relative to the storage directory
+
+        Returns:
+            size, created or None if the file does not exist
+        """
+        try:
+            stat = os.stat(os.path.join(self.storage_directory, filename))
+        except FileNotFoundError:
+            return None
+        # TODO: this is currently fixed at pacific time
+        created = pd.Timestamp(time.ctime(stat.st_mtime), tz="Canada/Pacific").isoformat()
+        return stat.st_size, created
+
+    def list_sizes(self, prefix=''):
+        """ List the size of all files with a prefix.
+
+        Args:
+            prefix (str): filename prefix
+
+        Yields:
+            filename, size
+        """
+        for root, dirs, files in os.walk(os.path.join(self.storage_directory, os.path.dirname(prefix))):
+            for filename in files:
+                filepath = os.path.join(root, filename)
+                filename = os.path.relpath(filepath, self.storage_directory)
+                if not filename.startswith(prefix):
+                    continue
+                try:
+                    yield filename, os.path.getsize(filepath)
+                except FileNotFoundError:
+                    continue
+
     def write_data(self, filename, stream):
         stream.seek(0)
         filepath = os.path.join(self.storage_directory, filename)
@@ -272,6 +718,30 @@ class ServerStorageClient(object):
         if not os.path.samefile(filepath, tantalus_filepath):
             shutil.copy(filepath, tantalus_filepath)
 
+    def create_many(self, files, update=False, max_workers=16):
+        """ Create many storage files concurrently.
+
+        Args:
+            files (list): pairs of filename and filepath
+
+        KwArgs:
+            update (bool): update files that differ in size from the local file
+            max_workers (int): maximum number of concurrent files
+
+        Returns:
+            list of filenames that could not be created
+        """
+        def _create(filename_filepath):
+            filename, filepath = filename_filepath
+            try:
+                self.create(filename, filepath, update=update)
+            except Exception:
+                log.exception('failed to create {}'.format(filename))
+                return filename
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return [a for a in executor.map(_create, files) if a is not None]
+
     def copy(self, filename, new_filename, wait=None):
         filepath = os.path.join(self.storage_directory, filename)
         new_filepath = os.path.join(self.storage_directory, new_filename)
@@ -307,6 +777,31 @@ class DataNotOnStorageError(Exception):
 class TantalusApi(BasicAPIClient):
     """Tantalus API class."""
 
+    # Listings of endpoints filterable by id__gt and ordering are paged by id
+    keyset_page_size_param = "page_size"
+
+    # Tables cached by id when the identity map is enabled, by model
+    identity_map_tables = {
+        "storage": "storage",
+        "sample": "sample",
+        "dna_library": "dna_library",
+        "sequencing_lane": "sequencing_lane",
+        "sequencedataset": "sequencedataset",
+        "sequence_dataset": "sequencedataset",
+        "resultsdataset": "resultsdataset",
+        "results": "resultsdataset",
+    }
+
+    # Tables whose changes invalidate memoized dataset file instances
+    dataset_cache_tables = (
+        "file_instance",
+        "file_resource",
+        "sequencedataset",
+        "sequence_dataset",
+        "resultsdataset",
+        "results",
+    )
+
     def __init__(self):
         """Set up authentication using basic authentication.
 
@@ -324,6 +819,16 @@ class TantalusApi(BasicAPIClient):
         self.cached_storages = {}
         self.cached_storage_clients = {}
 
+        # Memoized dataset file instances and datasets found on storages once
+        # enabled, cleared by any change to dataset_cache_tables through this client
+        self._dataset_cache_lock = threading.Lock()
+        self._dataset_file_instances = None
+        self._datasets_on_storage = None
+
+        # Analysis status transitions are appended to this json lines file if set
+        self.analysis_transition_log = os.environ.get("TANTALUS_ANALYSIS_TRANSITION_LOG")
+        self._analysis_transition_lock = threading.Lock()
+
     def get_list_pagination_initial_params(self, params):
         """ Get initial pagination parameters specific to this API.
 
@@ -524,12 +1029,11 @@ class TantalusApi(BasicAPIClient):
 
             # Delete all existing instances
             file_instances = self.list("file_instance", file_resource=file_resource["id"])
+            file_instances = self.bulk_patch(
+                'file_instance',
+                [dict(id=f['id'], is_deleted=True) for f in file_instances],
+            )
             for file_instance in file_instances:
-                file_instance = self.update(
-                    'file_instance',
-                    id=file_instance['id'],
-                    is_deleted=True,
-                )
                 log.info('deleted file instance {}'.format(file_instance['id']))
 
             # Update the file properties
@@ -578,6 +1082,179 @@ class TantalusApi(BasicAPIClient):
 
         return self._add_or_update_file(storage_name, filename, update=update)
 
+    def _get_storage_properties(self, storage_name, filenames, max_workers=8):
+        """ Get size and created time of many files from directory listings.
+
+        Args:
+            storage_name: storage in which the files reside
+            filenames: storage relative filenames
+
+        Returns:
+            dict of filename to (size, created), missing files are omitted
+        """
+        storage_client = self.get_storage_client(storage_name)
+
+        directories = set(os.path.dirname(a) for a in filenames)
+        filenames = set(filenames)
+
+        def _list_directory(directory):
+            return [a for a in storage_client.list_properties(directory) if a[0] in filenames]
+
+        properties = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for listing in executor.map(_list_directory, directories):
+                for filename, size, created in listing:
+                    properties[filename] = (size, created)
+
+        return properties
+
+    def _get_file_resources_by_filename(self, filenames, max_workers=8):
+        """ Get existing file resources for many filenames.
+
+        Args:
+            filenames: storage relative filenames
+
+        Returns:
+            dict of filename to file resource
+
+        File resources are listed once per top level directory if the api
+        supports filtering by filename prefix, otherwise each filename is
+        queried individually.
+        """
+        list_field_names = set(f.name for f in self.coreapi_schema['file_resource']['list'].fields)
+
+        filenames = set(filenames)
+
+        def _list_directory(directory):
+            return list(self.list('file_resource', filename__startswith=directory + '/'))
+
+        def _list_filename(filename):
+            return list(self.list('file_resource', filename=filename))
+
+        # Sorted by path components, subdirectories follow their parent and
+        # are covered by its listing
+        directories = sorted(set(os.path.dirname(a) for a in filenames), key=lambda a: a.split('/'))
+
+        queries = []
+        listed_directory = None
+        for directory in directories:
+            if directory and 'filename__startswith' in list_field_names:
+                if listed_directory is not None and directory.startswith(listed_directory + '/'):
+                    continue
+                queries.append((_list_directory, directory))
+                listed_directory = directory
+            else:
+                queries.extend((_list_filename, a) for a in filenames if os.path.dirname(a) == directory)
+
+        file_resources = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for results in executor.map(lambda q: q[0](q[1]), queries):
+                for file_resource in results:
+                    if file_resource['filename'] in filenames:
+                        file_resources[file_resource['filename']] = file_resource
+
+        return file_resources
+
+    def add_files(self, storage_name, filepaths, update=False, skip_missing=False, max_workers=8):
+        """ Create file resources and file instances for many files in the given storage.
+
+        Args:
+            storage_name: storage for file instances
+            filepaths: full paths to files
+
+        Kwargs:
+            update: update files that exist with different size
+            skip_missing: skip files missing from the storage instead of raising
+            max_workers: maximum number of concurrent requests
+
+        Returns:
+            dict of filepath to (file_resource, file_instance)
+
+        Equivalent to calling add_file for each filepath.  Sizes and
+        created times are taken from one listing per directory, existing
+        file resources are retrieved in batches and missing file resources
+        and instances are created concurrently.  If update=False, raises
+        FieldMismatchError before adding any file if an existing file
+        resource has a different size.
+        """
+        storage = self.get_storage(storage_name)
+        storage_client = self.get_storage_client(storage_name)
+
+        filenames = {}
+        for filepath in filepaths:
+            filenames[filepath] = self.get_file_resource_filename(storage_name, filepath)
+
+        log.info('adding {} files in storage {}'.format(len(filenames), storage_name))
+
+        properties = self._get_storage_properties(storage_name, filenames.values(), max_workers=max_workers)
+
+        for filepath, filename in list(filenames.items()):
+            if filename in properties:
+                continue
+            if skip_missing:
+                log.warning('skipping missing file: {}'.format(filename))
+                del filenames[filepath]
+            elif storage_client.exists(filename):
+                properties[filename] = (storage_client.get_size(filename), storage_client.get_created_time(filename))
+            else:
+                raise DataMissingError('file {} doesnt exist on storage {}'.format(filename, storage_name))
+
+        file_resources = self._get_file_resources_by_filename(filenames.values(), max_workers=max_workers)
+
+        # Check for existing files with different sizes before adding any files
+        mismatched = set()
+        for filename in filenames.values():
+            if filename in file_resources and file_resources[filename]['size'] != properties[filename][0]:
+                if not update:
+                    raise FieldMismatchError('file resource {} with filename {} has size {} not {}'.format(
+                        file_resources[filename]['id'], filename, file_resources[filename]['size'],
+                        properties[filename][0]))
+                mismatched.add(filename)
+
+        # Create missing file resources
+        new_filenames = sorted(set(a for a in filenames.values() if a not in file_resources))
+        new_file_resources = self.bulk_create(
+            'file_resource',
+            [dict(filename=a, created=properties[a][1], size=properties[a][0]) for a in new_filenames],
+            max_workers=max_workers,
+        )
+        for filename, file_resource in zip(new_filenames, new_file_resources):
+            file_resource.setdefault('file_instances', [])
+            file_resources[filename] = file_resource
+
+        # Find existing instances on this storage
+        file_instances = {}
+        for filename in set(filenames.values()) - mismatched:
+            for file_instance in file_resources[filename].get('file_instances', []):
+                if file_instance['storage']['id'] == storage['id']:
+                    file_instances[filename] = file_instance
+
+        # Create missing and undelete deleted instances
+        create_filenames = sorted(set(filenames.values()) - mismatched - set(file_instances))
+        created_instances = self.bulk_create(
+            'file_instance',
+            [dict(file_resource=file_resources[a]['id'], storage=storage['id']) for a in create_filenames],
+            max_workers=max_workers,
+        )
+        file_instances.update(zip(create_filenames, created_instances))
+
+        undelete_filenames = sorted(a for a in file_instances if file_instances[a]['is_deleted'])
+        undeleted_instances = self.bulk_patch(
+            'file_instance',
+            [dict(id=file_instances[a]['id'], is_deleted=False) for a in undelete_filenames],
+            max_workers=max_workers,
+        )
+        file_instances.update(zip(undelete_filenames, undeleted_instances))
+
+        # Files with changed sizes take the slower update path
+        for filename in mismatched:
+            file_resources[filename], file_instances[filename] = self._add_or_update_file(
+                storage_name, filename, update=True)
+
+        return {
+            filepath: (file_resources[filename], file_instances[filename])
+            for filepath, filename in filenames.items()}
+
     def update_file(self, file_instance):
         """
         Update a file resource to match the file pointed
@@ -641,12 +1318,11 @@ class TantalusApi(BasicAPIClient):
         """
 
         file_instances = self.list("file_instance", file_resource=file_resource["id"])
+        file_instances = self.bulk_patch(
+            "file_instance",
+            [dict(id=f["id"], is_deleted=True) for f in file_instances],
+        )
         for file_instance in file_instances:
-            file_instance = self.update(
-                "file_instance",
-                id=file_instance["id"],
-                is_deleted=True,
-            )
             logging.info(f"deleted file instance {file_instance['id']}")
 
         for dataset_type in ("sequencedataset", "resultsdataset"):
@@ -691,14 +1367,11 @@ class TantalusApi(BasicAPIClient):
 
         # Delete all other instances
         other_file_instances = self.list("file_instance", file_resource=file_resource["id"])
+        other_file_instances = self.bulk_patch(
+            'file_instance',
+            [dict(id=f['id'], is_deleted=True) for f in other_file_instances if f['id'] != file_instance['id']],
+        )
         for other_file_instance in other_file_instances:
-            if other_file_instance['id'] == file_instance['id']:
-                continue
-            other_file_instance = self.update(
-                'file_instance',
-                id=other_file_instance['id'],
-                is_deleted=True,
-            )
             log.info('deleted file instance {}'.format(other_file_instance['id']))
 
     def add_instance(self, file_resource, storage):
@@ -720,56 +1393,77 @@ class TantalusApi(BasicAPIClient):
         )
 
         if file_instance['is_deleted']:
-            file_instance = self.update(
+            self.update(
                 'file_instance',
                 id=file_instance['id'],
                 is_deleted=False,
             )
 
-        return file_instance
+            # Keep the nested storage and file resource of the existing instance
+            file_instance['is_deleted'] = False
 
-    def get_dataset_file_instances(self, dataset_id, dataset_model, storage_name, filters=None):
-        """
-        Given a dataset get all file instances.
+        return file_instance
 
-        Note: file_resource and sequence_dataset are added as fields
-        to the file_instances
+    def count(self, table_name, **fields):
+        """ Count resources matching filter fields with a single request.
 
         Args:
-            dataset_id (int): primary key of sequencedataset or resultsdataset
-            dataset_model (str): model type, sequencedataset or resultsdataset
-            storage_name (str): name of the storage for which to retrieve file instances
-
-        KwArgs:
-            filters (dict): additional filters such as filename extension
+            table_name (str): name of the table
+            fields: filter fields, which must be supported by the endpoint
 
         Returns:
-            file_instances (list)
+            int
         """
+        if not self._supports_filters(table_name, fields):
+            raise ValueError("fields {} not accepted for {}".format(', '.join(fields), table_name))
 
-        if filters == None:
-            filters = {}
+        params = dict(fields)
+        params["page_size"] = 1
+        params["page"] = 1
 
-        file_resources = self.get_dataset_file_resources(dataset_id, dataset_model, filters)
+        return self.coreapi_client.action(self.coreapi_schema, [table_name, "list"], params=params)["count"]
 
-        if dataset_model == 'sequencedataset':
-            file_instances = self.list(
-                'file_instance',
-                file_resource__sequencedataset__id=dataset_id,
-                storage__name=storage_name,
-                is_deleted=False,
-            )
+    def _supports_filters(self, table_name, field_names):
+        list_field_names = set(field.name for field in self.coreapi_schema[table_name]["list"].fields)
+        return all(a in list_field_names for a in field_names)
 
-        elif dataset_model == 'resultsdataset':
-            file_instances = self.list(
-                'file_instance',
-                file_resource__resultsdataset__id=dataset_id,
-                storage__name=storage_name,
-                is_deleted=False,
-            )
+    def _get_dataset_cache_key(self, dataset_id, dataset_model, storage_name, filters):
+        return (dataset_model, dataset_id, storage_name, json.dumps(filters, sort_keys=True, default=str))
 
-        else:
-            raise ValueError('unrecognized dataset model {}'.format(dataset_model))
+    def _on_write(self, table_name):
+        if table_name in self.dataset_cache_tables:
+            self.clear_dataset_cache()
+
+    def enable_dataset_cache(self):
+        """ Memoize get_dataset_file_instances and is_dataset_on_storage for the rest of the run.
+
+        Memoized results are cleared by changes to dataset_cache_tables made
+        through this client, changes made by other clients are not seen.
+        """
+        with self._dataset_cache_lock:
+            if self._dataset_file_instances is None:
+                self._dataset_file_instances = {}
+                self._datasets_on_storage = set()
+
+    def clear_dataset_cache(self):
+        """ Clear dataset file instances memoized by get_dataset_file_instances and is_dataset_on_storage.
+        """
+        with self._dataset_cache_lock:
+            if self._dataset_file_instances is not None:
+                self._dataset_file_instances.clear()
+                self._datasets_on_storage.clear()
+
+    def _join_dataset_file_instances(self, dataset_id, dataset_model, storage_name, filters):
+        """ Join file resources and file instances of a dataset listed separately.
+        """
+        file_resources = self.get_dataset_file_resources(dataset_id, dataset_model, filters)
+
+        file_instances = self.list(
+            'file_instance',
+            storage__name=storage_name,
+            is_deleted=False,
+            **{'file_resource__{}__id'.format(dataset_model): dataset_id}
+        )
 
         file_instances = dict([(f['file_resource']['id'], f) for f in file_instances])
 
@@ -790,6 +1484,69 @@ class TantalusApi(BasicAPIClient):
 
         return filtered_file_instances
 
+    def get_dataset_file_instances(self, dataset_id, dataset_model, storage_name, filters=None):
+        """
+        Given a dataset get all file instances.
+
+        Note: file_resource and sequence_dataset are added as fields
+        to the file_instances
+
+        Args:
+            dataset_id (int): primary key of sequencedataset or resultsdataset
+            dataset_model (str): model type, sequencedataset or resultsdataset
+            storage_name (str): name of the storage for which to retrieve file instances
+
+        KwArgs:
+            filters (dict): additional filters such as filename extension
+
+        Returns:
+            file_instances (list)
+
+        File resource filters are applied to the file instance listing, and
+        completeness is checked against a count of the file resources, falling
+        back to joining separate listings if the filters are not supported.
+        Once enabled with enable_dataset_cache, results are memoized until file
+        instances, file resources or datasets are changed through the client.
+        """
+
+        if filters == None:
+            filters = {}
+
+        if dataset_model not in ('sequencedataset', 'resultsdataset'):
+            raise ValueError('unrecognized dataset model {}'.format(dataset_model))
+
+        cache_key = self._get_dataset_cache_key(dataset_id, dataset_model, storage_name, filters)
+
+        with self._dataset_cache_lock:
+            if self._dataset_file_instances is not None and cache_key in self._dataset_file_instances:
+                return list(self._dataset_file_instances[cache_key])
+
+        instance_filters = {'file_resource__' + a: b for a, b in filters.items()}
+        instance_filters['file_resource__{}__id'.format(dataset_model)] = dataset_id
+
+        resource_filters = dict(filters)
+        resource_filters['{}__id'.format(dataset_model)] = dataset_id
+
+        if self._supports_filters('file_instance', instance_filters) and self._supports_filters('file_resource', resource_filters):
+            file_instances = {}
+            for file_instance in self.list('file_instance', storage__name=storage_name, is_deleted=False, **instance_filters):
+                file_instances[file_instance['file_resource']['id']] = file_instance
+
+            file_instances = [file_instances[a] for a in sorted(file_instances)]
+
+            # Identify the missing file resources if any
+            if len(file_instances) < self.count('file_resource', **resource_filters):
+                file_instances = self._join_dataset_file_instances(dataset_id, dataset_model, storage_name, filters)
+
+        else:
+            file_instances = self._join_dataset_file_instances(dataset_id, dataset_model, storage_name, filters)
+
+        with self._dataset_cache_lock:
+            if self._dataset_file_instances is not None:
+                self._dataset_file_instances[cache_key] = file_instances
+
+        return list(file_instances)
+
     def get_dataset_file_resources(self, dataset_id, dataset_model, filters=None):
         """
         Given a dataset get all file resources.
@@ -828,15 +1585,159 @@ class TantalusApi(BasicAPIClient):
 
         Returns:
             bool
+
+        Compares counts of file resources and file instances on the storage,
+        datasets found on the storage are memoized as for
+        get_dataset_file_instances.
         """
 
-        try:
-            self.get_dataset_file_instances(dataset_id, dataset_model, storage_name)
+        if dataset_model not in ('sequencedataset', 'resultsdataset'):
+            raise ValueError('unrecognized dataset model {}'.format(dataset_model))
 
-        except DataNotOnStorageError:
-            return False
+        cache_key = self._get_dataset_cache_key(dataset_id, dataset_model, storage_name, {})
+
+        with self._dataset_cache_lock:
+            if self._datasets_on_storage is not None and (
+                    cache_key in self._datasets_on_storage or cache_key in self._dataset_file_instances):
+                return True
+
+        instance_filters = {
+            'file_resource__{}__id'.format(dataset_model): dataset_id,
+            'storage__name': storage_name,
+            'is_deleted': False,
+        }
+
+        resource_filters = {'{}__id'.format(dataset_model): dataset_id}
+
+        if self._supports_filters('file_instance', instance_filters) and self._supports_filters('file_resource', resource_filters):
+            is_on_storage = self.count('file_instance', **instance_filters) >= self.count('file_resource', **resource_filters)
+
+        else:
+            try:
+                self.get_dataset_file_instances(dataset_id, dataset_model, storage_name)
+                is_on_storage = True
+            except DataNotOnStorageError:
+                is_on_storage = False
+
+        if is_on_storage:
+            with self._dataset_cache_lock:
+                if self._datasets_on_storage is not None:
+                    self._datasets_on_storage.add(cache_key)
+
+        return is_on_storage
+
+    def set_analysis_status(self, analysis_id, status, last_updated=None):
+        """
+        Set the status and last updated time of an analysis in a single request.
+
+        Args:
+            analysis_id (int): primary key of the analysis
+            status (str): new status
+
+        KwArgs:
+            last_updated (str): isoformat timestamp, defaults to now
+
+        Returns:
+            analysis (dict), with related models as ids as for update
+        """
+        if last_updated is None:
+            last_updated = datetime.datetime.now().isoformat()
+
+        return self.update('analysis', id=analysis_id, status=status, last_updated=last_updated)
+
+    def transition_analysis(self, analysis, status, last_updated=None):
+        """
+        Set the status and last updated time of an analysis and record the transition.
+
+        Args:
+            analysis (dict): analysis, updated in place
+            status (str): new status
+
+        KwArgs:
+            last_updated (str): isoformat timestamp, defaults to now
+        """
+        previous_status = analysis['status']
+
+        updated = self.set_analysis_status(analysis['id'], status, last_updated=last_updated)
+
+        # Keep the nested representation, the update response has related models as ids
+        analysis['status'] = updated['status']
+        analysis['last_updated'] = updated['last_updated']
+
+        log.info('analysis {} status {} -> {} at {}'.format(
+            analysis['id'], previous_status, analysis['status'], analysis['last_updated']))
+
+        self._record_analysis_transitions([(analysis['id'], previous_status, analysis['status'], analysis['last_updated'])])
+
+    def _record_analysis_transitions(self, transitions):
+        if self.analysis_transition_log is None:
+            return
+
+        with self._analysis_transition_lock, open(self.analysis_transition_log, 'a') as f:
+            for analysis_id, previous_status, status, last_updated in transitions:
+                f.write(json.dumps({
+                    'analysis': analysis_id,
+                    'previous_status': previous_status,
+                    'status': status,
+                    'last_updated': last_updated,
+                }) + '\n')
+
+    def get_analysis_transitions(self, analysis_id=None):
+        """
+        Get status transitions recorded in analysis_transition_log.
+
+        KwArgs:
+            analysis_id (int): only transitions of this analysis
+
+        Returns:
+            transitions (list of dict), with analysis, previous_status, status
+            and last_updated, oldest first
+        """
+        if self.analysis_transition_log is None:
+            raise ValueError('no analysis transition log, set TANTALUS_ANALYSIS_TRANSITION_LOG')
+
+        transitions = []
+        if not os.path.exists(self.analysis_transition_log):
+            return transitions
+
+        with open(self.analysis_transition_log) as f:
+            for line in f:
+                transition = json.loads(line)
+                if analysis_id is None or transition['analysis'] == analysis_id:
+                    transitions.append(transition)
+
+        return transitions
+
+    def set_analyses_status(self, analysis_ids, status, last_updated=None, max_workers=8):
+        """
+        Set the status and last updated time of many analyses concurrently.
+
+        Args:
+            analysis_ids (list of int): primary keys of the analyses
+            status (str): new status
+
+        KwArgs:
+            last_updated (str): isoformat timestamp, defaults to now
+            max_workers (int): maximum number of concurrent requests
+
+        Returns:
+            analyses (list of dict), with related models as ids as for update
+
+        Transitions are recorded without the previous status, which is not
+        fetched.
+        """
+        if last_updated is None:
+            last_updated = datetime.datetime.now().isoformat()
+
+        analyses = self.bulk_patch(
+            'analysis',
+            [dict(id=a, status=status, last_updated=last_updated) for a in analysis_ids],
+            max_workers=max_workers,
+        )
+
+        self._record_analysis_transitions([(a['id'], None, a['status'], a['last_updated']) for a in analyses])
 
-        return True
+        return analyses
 
     def tag(self, name, sequencedataset_set=(), resultsdataset_set=()):
         """
@@ -0,0 +1,170 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from dbclients.basicclient import BasicAPIClient, FieldMismatchError
+from dbclients.tantalus import TantalusApi, DataMissingError
+
+
+STORAGE = {'id': 1, 'name': 'storage', 'prefix': '/data', 'storage_type': 'server'}
+OTHER_STORAGE = {'id': 2, 'name': 'other'}
+
+CREATED = '2020-01-01T00:00:00+00:00'
+
+
+class TestAddFiles(unittest.TestCase):
+
+    def setUp(self):
+        with mock.patch.object(BasicAPIClient, '__init__', return_value=None):
+            self.tantalus_api = TantalusApi()
+
+        self.tantalus_api.coreapi_schema = {
+            'file_resource': {'list': SimpleNamespace(fields=[
+                SimpleNamespace(name='filename'),
+                SimpleNamespace(name='filename__startswith'),
+            ])},
+        }
+
+        # Files on the storage, by storage relative filename
+        self.storage_files = {}
+
+        self.storage_client = mock.Mock()
+        self.storage_client.list_properties.side_effect = lambda directory: [
+            (a, b, CREATED) for a, b in self.storage_files.items() if a.startswith(directory + '/')]
+        self.storage_client.exists.side_effect = lambda filename: filename in self.storage_files
+
+        self.tantalus_api.cached_storages = {'storage': STORAGE}
+        self.tantalus_api.cached_storage_clients = {'storage': self.storage_client}
+
+        # File resources in tantalus
+        self.file_resources = []
+        self.list_calls = []
+
+        def _list(table_name, **filters):
+            self.assertEqual(table_name, 'file_resource')
+            self.list_calls.append(filters)
+            for file_resource in self.file_resources:
+                if 'filename__startswith' in filters and file_resource['filename'].startswith(filters['filename__startswith']):
+                    yield file_resource
+                elif filters.get('filename') == file_resource['filename']:
+                    yield file_resource
+
+        self.next_id = 100
+
+        def _bulk_create(table_name, items, max_workers=None):
+            results = []
+            for item in items:
+                result = dict(item, id=self.next_id)
+                if table_name == 'file_instance':
+                    result['is_deleted'] = False
+                results.append(result)
+                self.next_id += 1
+            return results
+
+        def _bulk_patch(table_name, items, max_workers=None):
+            return [dict(item) for item in items]
+
+        self.tantalus_api.list = mock.Mock(side_effect=_list)
+        self.tantalus_api.bulk_create = mock.Mock(side_effect=_bulk_create)
+        self.tantalus_api.bulk_patch = mock.Mock(side_effect=_bulk_patch)
+
+    def _created(self, table_name):
+        items = []
+        for call in self.tantalus_api.bulk_create.call_args_list:
+            if call[0][0] == table_name:
+                items.extend(call[0][1])
+        return items
+
+    def _patched(self):
+        items = []
+        for call in self.tantalus_api.bulk_patch.call_args_list:
+            items.extend(call[0][1])
+        return items
+
+    def test_new_files(self):
+        self.storage_files = {'a/1.bam': 10, 'a/1.bam.bai': 2, 'a/b/2.bam': 20}
+
+        results = self.tantalus_api.add_files('storage', ['/data/a/1.bam', '/data/a/1.bam.bai', '/data/a/b/2.bam'])
+
+        self.assertEqual(
+            sorted((a['filename'], a['size']) for a in self._created('file_resource')),
+            [('a/1.bam', 10), ('a/1.bam.bai', 2), ('a/b/2.bam', 20)])
+        self.assertEqual(len(self._created('file_instance')), 3)
+        self.assertEqual(self._patched(), [])
+
+        file_resource, file_instance = results['/data/a/b/2.bam']
+        self.assertEqual(file_resource['filename'], 'a/b/2.bam')
+        self.assertEqual(file_instance['file_resource'], file_resource['id'])
+        self.assertEqual(file_instance['storage'], STORAGE['id'])
+
+        # One storage listing per directory, and one tantalus listing
+        # covering the subdirectory
+        self.assertEqual(
+            sorted(a[0][0] for a in self.storage_client.list_properties.call_args_list), ['a', 'a/b'])
+        self.assertEqual(self.list_calls, [{'filename__startswith': 'a/'}])
+
+    def test_existing_instance(self):
+        self.storage_files = {'a/1.bam': 10}
+        file_instance = {'id': 5, 'storage': STORAGE, 'is_deleted': False}
+        self.file_resources = [{'id': 3, 'filename': 'a/1.bam', 'size': 10, 'file_instances': [file_instance]}]
+
+        results = self.tantalus_api.add_files('storage', ['/data/a/1.bam'])
+
+        self.assertEqual(results['/data/a/1.bam'], (self.file_resources[0], file_instance))
+        self.assertEqual(self._created('file_resource'), [])
+        self.assertEqual(self._created('file_instance'), [])
+        self.assertEqual(self._patched(), [])
+
+    def test_undelete_instance(self):
+        self.storage_files = {'a/1.bam': 10}
+        file_instance = {'id': 5, 'storage': STORAGE, 'is_deleted': True}
+        self.file_resources = [{'id': 3, 'filename': 'a/1.bam', 'size': 10, 'file_instances': [file_instance]}]
+
+        results = self.tantalus_api.add_files('storage', ['/data/a/1.bam'])
+
+        self.assertEqual(self._created('file_resource'), [])
+        self.assertEqual(self._created('file_instance'), [])
+        self.assertEqual(self._patched(), [{'id': 5, 'is_deleted': False}])
+        self.assertEqual(results['/data/a/1.bam'][1]['is_deleted'], False)
+
+    def test_instance_on_other_storage(self):
+        self.storage_files = {'a/1.bam': 10}
+        file_instance = {'id': 5, 'storage': OTHER_STORAGE, 'is_deleted': False}
+        self.file_resources = [{'id': 3, 'filename': 'a/1.bam', 'size': 10, 'file_instances': [file_instance]}]
+
+        self.tantalus_api.add_files('storage', ['/data/a/1.bam'])
+
+        self.assertEqual(self._created('file_resource'), [])
+        self.assertEqual(self._created('file_instance'), [{'file_resource': 3, 'storage': STORAGE['id']}])
+
+    def test_size_mismatch(self):
+        self.storage_files = {'a/1.bam': 10, 'a/2.bam': 20}
+        self.file_resources = [{'id': 3, 'filename': 'a/1.bam', 'size': 11, 'file_instances': []}]
+
+        with self.assertRaises(FieldMismatchError):
+            self.tantalus_api.add_files('storage', ['/data/a/1.bam', '/data/a/2.bam'])
+
+        # No files are added if any file mismatches
+        self.tantalus_api.bulk_create.assert_not_called()
+        self.tantalus_api.bulk_patch.assert_not_called()
+
+    def test_missing_file(self):
+        self.storage_files = {'a/1.bam': 10}
+
+        with self.assertRaises(DataMissingError):
+            self.tantalus_api.add_files('storage', ['/data/a/1.bam', '/data/a/2.bam'])
+
+        self.tantalus_api.bulk_create.assert_not_called()
+
+        results = self.tantalus_api.add_files('storage', ['/data/a/1.bam', '/data/a/2.bam'], skip_missing=True)
+
+        self.assertEqual(list(results), ['/data/a/1.bam'])
+        self.assertEqual([a['filename'] for a in self._created('file_resource')], ['a/1.bam'])
+
+    def test_not_in_storage(self):
+        with self.assertRaises(ValueError):
+            self.tantalus_api.add_files('storage', ['/other/a/1.bam'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+from dbclients.basicclient import FieldMatcher, _ExpectedValue, _match_value
+
+
+class TestMatchValue(unittest.TestCase):
+
+    def test_foreign_key(self):
+        self.assertEqual(_match_value({'id': 3, 'name': 'A'}, _ExpectedValue(3), False), (True, 3))
+        self.assertEqual(_match_value({'id': 3, 'name': 'A'}, _ExpectedValue(4), False), (False, 3))
+        self.assertEqual(_match_value(3, _ExpectedValue(3), False), (True, 3))
+
+    def test_many_to_many(self):
+        self.assertEqual(_match_value([{'id': 1}, {'id': 2}], _ExpectedValue([2, 1]), False), (True, {1, 2}))
+        self.assertEqual(_match_value([1, 2], _ExpectedValue({1, 2}), False), (True, {1, 2}))
+        self.assertEqual(_match_value([1, 2, 2], _ExpectedValue([1, 2]), False), (True, {1, 2}))
+        self.assertEqual(_match_value([1], _ExpectedValue([1, 2]), False), (False, {1}))
+        self.assertEqual(_match_value([], _ExpectedValue([]), False), (True, set()))
+
+    def test_timestamp(self):
+        expected = _ExpectedValue('2020-01-01T00:00:00+00:00')
+
+        is_equal, _ = _match_value('2020-01-01T00:00:00Z', expected, True)
+        self.assertTrue(is_equal)
+
+        is_equal, _ = _match_value('2020-01-02T00:00:00Z', expected, True)
+        self.assertFalse(is_equal)
+
+        # Only compared as timestamps for timestamp fields
+        is_equal, _ = _match_value('2020-01-01T00:00:00Z', expected, False)
+        self.assertFalse(is_equal)
+
+        is_equal, _ = _match_value('not a timestamp', expected, True)
+        self.assertFalse(is_equal)
+
+    def test_numeric(self):
+        self.assertEqual(_match_value(5, _ExpectedValue(5), True), (True, 5))
+        self.assertEqual(_match_value(5.5, _ExpectedValue(5.5), True), (True, 5.5))
+        self.assertEqual(_match_value(6, _ExpectedValue(5), True), (False, 6))
+        self.assertEqual(_match_value('5', _ExpectedValue(5), True), (False, '5'))
+
+        # Numeric strings are not parsed as timestamps for non timestamp fields
+        self.assertEqual(_match_value('2020-01-01', _ExpectedValue('2020'), False), (False, '2020-01-01'))
+
+
+class TestFieldMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = FieldMatcher(
+            'file_instance',
+            {
+                'storage': 2,
+                'file_resources': [1, 2],
+                'created': '2020-01-01T00:00:00+00:00',
+                'size': 100,
+            },
+            ['created'],
+        )
+
+        self.result = {
+            'id': 10,
+            'storage': {'id': 2, 'name': 'storage'},
+            'file_resources': [{'id': 2}, {'id': 1}],
+            'created': '2020-01-01T00:00:00Z',
+            'size': 100,
+        }
+
+    def test_matches(self):
+        self.assertTrue(self.matcher.matches(self.result))
+        self.assertEqual(list(self.matcher.mismatches(self.result)), [])
+
+    def test_mismatches(self):
+        self.result['size'] = 200
+        self.result['file_resources'] = [{'id': 1}]
+
+        self.assertFalse(self.matcher.matches(self.result))
+        self.assertEqual(
+            list(self.matcher.mismatches(self.result)),
+            [('file_resources', {1}, [1, 2]), ('size', 200, 100)])
+
+    def test_missing_field(self):
+        del self.result['size']
+
+        with self.assertRaises(Exception):
+            self.matcher.matches(self.result)
+
+
+if __name__ == '__main__':
+    unittest.main()
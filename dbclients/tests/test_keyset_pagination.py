@@ -0,0 +1,116 @@
+import itertools
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from dbclients.basicclient import BasicAPIClient
+from dbclients.tantalus import TantalusApi
+
+
+def _fields(*names):
+    return SimpleNamespace(fields=[SimpleNamespace(name=a) for a in names])
+
+
+class FakeServer(object):
+    """ List endpoint paging by id__gt and page_size, or by page number. """
+
+    def __init__(self, results):
+        self.results = results
+        self.requests = []
+
+    def action(self, schema, keys, params=None):
+        table_name, action = keys
+        self.requests.append(dict(params))
+
+        results = [a for a in self.results if a['value'] == params.get('value', a['value'])]
+
+        if 'id__gt' in params or params.get('ordering') == 'id':
+            results = sorted(results, key=lambda a: a['id'])
+            results = [a for a in results if a['id'] > params.get('id__gt', 0)]
+            page = results[:params['page_size']]
+            has_next = len(results) > len(page)
+
+        else:
+            start = (params['page'] - 1) * params['page_size']
+            page = results[start:start + params['page_size']]
+            has_next = len(results) > start + len(page)
+
+        return {'results': page, 'next': 'next' if has_next else None}
+
+
+class TestKeysetPagination(unittest.TestCase):
+
+    def setUp(self):
+        with mock.patch.object(BasicAPIClient, '__init__', return_value=None):
+            self.tantalus_api = TantalusApi()
+
+        self.tantalus_api.coreapi_schema = {
+            'file_instance': {'list': _fields('value', 'id__gt', 'ordering', 'page', 'page_size')},
+            'sample': {'list': _fields('value', 'page', 'page_size')},
+        }
+        self.tantalus_api._timestamp_fields = {}
+        self.tantalus_api._identity_map = None
+        self.tantalus_api.keyset_initial_page_size = 3
+
+        # Unordered ids with gaps
+        self.results = [{'id': a, 'value': a % 2} for a in (7, 3, 12, 1, 5, 20, 8, 2, 15, 9)]
+        self.server = FakeServer(self.results)
+        self.tantalus_api.coreapi_client = self.server
+
+    def test_keyset(self):
+        results = list(self.tantalus_api.list('file_instance'))
+
+        self.assertEqual([a['id'] for a in results], sorted(a['id'] for a in self.results))
+
+        for request in self.server.requests:
+            self.assertEqual(request['ordering'], 'id')
+            self.assertNotIn('page', request)
+
+        self.assertNotIn('id__gt', self.server.requests[0])
+        self.assertEqual(self.server.requests[1]['id__gt'], 3)
+
+    def test_filter(self):
+        results = list(self.tantalus_api.list('file_instance', value=1))
+
+        self.assertEqual([a['id'] for a in results], [1, 3, 5, 7, 9, 15])
+        self.assertTrue(all(a['value'] == 1 for a in self.server.requests))
+
+    def test_cursor(self):
+        results = list(self.tantalus_api.filter('file_instance', {}, cursor=8))
+
+        self.assertEqual([a['id'] for a in results], [9, 12, 15, 20])
+        self.assertEqual(self.server.requests[0]['id__gt'], 8)
+
+    def test_page_size_grows(self):
+        list(self.tantalus_api.list('file_instance'))
+
+        page_sizes = [a['page_size'] for a in self.server.requests]
+        self.assertEqual(page_sizes, [3, 6, 12])
+
+    def test_page_size_shrinks(self):
+        self.tantalus_api.keyset_initial_page_size = 4
+        self.tantalus_api.keyset_min_page_size = 2
+
+        # Each page takes longer than the target
+        with mock.patch('dbclients.basicclient.time.time', side_effect=itertools.count(0., 5.)):
+            results = list(self.tantalus_api.list('file_instance'))
+
+        self.assertEqual(len(results), len(self.results))
+
+        page_sizes = [a['page_size'] for a in self.server.requests]
+        self.assertEqual(page_sizes, [4, 2, 2, 2])
+
+    def test_page_number_fallback(self):
+        results = list(self.tantalus_api.list('sample'))
+
+        self.assertEqual([a['id'] for a in results], [a['id'] for a in self.results])
+        self.assertEqual([a['page'] for a in self.server.requests], list(range(1, len(self.server.requests) + 1)))
+        self.assertTrue(all('ordering' not in a for a in self.server.requests))
+
+    def test_cursor_not_supported(self):
+        with self.assertRaises(ValueError):
+            list(self.tantalus_api.filter('sample', {}, cursor=8))
+
+
+if __name__ == '__main__':
+    unittest.main()
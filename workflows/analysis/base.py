@@ -162,44 +162,47 @@ class Analysis:
 
     def set_ready_status(self):
         """
-        Set run status of analysis to running.
+        Set run status of analysis to ready.
         """
-        self.update_status('ready')
-        self.update_last_updated()
+        self.set_status('ready')
 
     def set_run_status(self):
         """
         Set run status of analysis to running.
         """
-        self.update_status('running')
-        self.update_last_updated()
+        self.set_status('running')
 
     def set_archive_status(self):
         """
         Set run status of analysis to archiving.
         """
-        self.update_status('archiving')
-        self.update_last_updated()
+        self.set_status('archiving')
 
     def set_complete_status(self):
         """
         Set run status of analysis to complete.
         """
-        self.update_status('complete')
-        self.update_last_updated()
+        self.set_status('complete')
 
     def set_error_status(self):
         """
         Set run status to error.
         """
-        self.update_status('error')
-        self.update_last_updated()
+        self.set_status('error')
+
+    def set_status(self, status, last_updated=None):
+        """
+        Update the status and last updated time of the analysis in Tantalus
+        in a single request.
+        """
+        self.tantalus_api.transition_analysis(self.analysis, status, last_updated=last_updated)
 
     def update_status(self, status):
         """
         Update the run status of the analysis in Tantalus.
         """
-        self.analysis = self.tantalus_api.update('analysis', id=self.get_id(), status=status)
+        analysis = self.tantalus_api.update('analysis', id=self.get_id(), status=status)
+        self.analysis['status'] = analysis['status']
 
     def update_last_updated(self, last_updated=None):
         """
@@ -207,7 +210,8 @@ class Analysis:
         """
         if last_updated is None:
             last_updated = datetime.datetime.now().isoformat()
-        self.analysis = self.tantalus_api.update('analysis', id=self.get_id(), last_updated=last_updated)
+        analysis = self.tantalus_api.update('analysis', id=self.get_id(), last_updated=last_updated)
+        self.analysis['last_updated'] = analysis['last_updated']
 
     def get_id(self):
         return self.analysis['id']
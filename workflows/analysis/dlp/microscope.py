@@ -1,5 +1,6 @@
 import os
 import yaml
+import concurrent.futures
 import logging
 import click
 import sys
@@ -11,7 +12,6 @@ from datamanagement.utils.constants import LOGGING_FORMAT
 import workflows.analysis.dlp.results_import as results_import
 import workflows.analysis.dlp.launchmic
 
-import pandas as pd
 import dbclients.colossus
 
 
@@ -20,46 +20,77 @@ colossus_api = dbclients.colossus.ColossusApi()
 
 
 def get_colossus_tifs(library_id):
-    cell_ids = {}
-    sublibraries = colossus_api.list('sublibraries', library__pool_id=library_id)
-    for sublibrary in sublibraries:
-        cell_ids[(sublibrary['row'], sublibrary['column'])] = sublibrary['cell_id']
-
-    colossus_tiffs = []
-    sublibrary_briefs = colossus_api.list('sublibraries_brief', library__pool_id=library_id)
-    for sublibrary_brief in sublibrary_briefs:
-        for tif_num in ('1', '2'):
-            colossus_tiffs.append(
-                {
-                    'file_ch': sublibrary_brief[f'file_ch{tif_num}'],
-                    'ch_number': tif_num,
-                    'row': str(sublibrary_brief['row']),
-                    'column': str(sublibrary_brief['column']),
-                    'cell_id': cell_ids[(sublibrary_brief['row'], sublibrary_brief['column'])],
-                }
-            )
-
-    return pd.DataFrame(colossus_tiffs)
+    """ Get the channel tif paths of each sublibrary of a library.
+
+    Returns:
+        pandas.DataFrame indexed by file_ch with ch_number, row, column and cell_id
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        sublibraries = executor.submit(
+            lambda: list(colossus_api.list('sublibraries', library__pool_id=library_id)))
+        sublibrary_briefs = executor.submit(
+            lambda: list(colossus_api.list('sublibraries_brief', library__pool_id=library_id)))
+        sublibraries = pd.DataFrame(sublibraries.result(), columns=['row', 'column', 'cell_id'])
+        sublibrary_briefs = pd.DataFrame(sublibrary_briefs.result(), columns=['row', 'column', 'file_ch1', 'file_ch2'])
+
+    # Colossus can have duplicate sublibraries for a row and column, use the first
+    duplicated = sublibraries.duplicated(['row', 'column'])
+    if duplicated.any():
+        logging.warning('{} duplicate sublibraries for library {}, using the first cell id of row and column {}'.format(
+            duplicated.sum(), library_id, ', '.join('({}, {})'.format(*a) for a in sublibraries.loc[duplicated, ['row', 'column']].values)))
+        sublibraries = sublibraries[~duplicated]
+
+    sublibrary_briefs = sublibrary_briefs.merge(sublibraries, on=['row', 'column'], how='left', validate='many_to_one')
+
+    if sublibrary_briefs['cell_id'].isnull().any():
+        missing = sublibrary_briefs.loc[sublibrary_briefs['cell_id'].isnull(), ['row', 'column']].values[0]
+        raise KeyError(f'no sublibrary for row and column {tuple(missing)}')
+
+    colossus_tifs = []
+    for tif_num in ('1', '2'):
+        ch_tifs = sublibrary_briefs[['row', 'column', 'cell_id']].copy()
+        ch_tifs['file_ch'] = sublibrary_briefs[f'file_ch{tif_num}']
+        ch_tifs['ch_number'] = tif_num
+        colossus_tifs.append(ch_tifs)
+
+    colossus_tifs = pd.concat(colossus_tifs, ignore_index=True)
+    colossus_tifs['row'] = colossus_tifs['row'].astype(str)
+    colossus_tifs['column'] = colossus_tifs['column'].astype(str)
+    colossus_tifs = colossus_tifs.set_index('file_ch')
+
+    return colossus_tifs
 
 
 def get_tantalus_tifs(dataset_ids):
-    tantalus_tiffs = []
-    for dataset_id in dataset_ids:
-        files = tantalus_api.list(
+    """ Get the tif file resources of a set of results datasets.
+
+    Returns:
+        pandas.DataFrame indexed by the \\dir\\file channel path with filename and file_resource_id
+    """
+    def _list_tifs(dataset_id):
+        return list(tantalus_api.list(
             'file_resource',
             resultsdataset__id=dataset_id,
             filename__endswith='.tif',
             fileinstance__storage__name='singlecellresults'
-        )
-        for file in files:
-            tantalus_tiffs.append(
-                {
-                    'file_ch': f"\\{file['filename'].split('/')[-2]}\\{file['filename'].split('/')[-1]}",
-                    'filename': file['filename'],
-                    'file_resource_id': str(file['id'])
-                }
-            )
-    return pd.DataFrame(tantalus_tiffs)
+        ))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        files = [f for dataset_files in executor.map(_list_tifs, dataset_ids) for f in dataset_files]
+
+    tantalus_tifs = pd.DataFrame(
+        [(f['filename'], str(f['id'])) for f in files],
+        columns=['filename', 'file_resource_id'])
+
+    # Channel path is the final directory and filename with windows separators
+    path_parts = tantalus_tifs['filename'].str.rsplit('/', n=2, expand=True)
+    if tantalus_tifs.empty:
+        tantalus_tifs['file_ch'] = []
+    else:
+        tantalus_tifs['file_ch'] = '\\' + path_parts[1] + '\\' + path_parts[2]
+    tantalus_tifs = tantalus_tifs.set_index('file_ch')
+
+    return tantalus_tifs
 
 
 class MicroscopePreprocessing(workflows.analysis.base.Analysis):
@@ -94,23 +125,28 @@ class MicroscopePreprocessing(workflows.analysis.base.Analysis):
     def generate_inputs_yaml(self, storages, inputs_yaml_filename):
         t_df = get_tantalus_tifs(self.analysis['input_results'])
         c_df = get_colossus_tifs(self.args['library_id'])
-        merged_df = pd.merge(left=c_df, right=t_df, left_on='file_ch', right_on='file_ch')
+        merged_df = c_df.join(t_df, how='inner')
 
-        input_info = {'cell_images': {}}
         prefix = os.path.join(storages['working_results'], "results")
-        for index, row in merged_df.iterrows():
-            if row['cell_id'] not in input_info['cell_images'].keys():
-                input_info['cell_images'][row['cell_id']] = {}
+        merged_df['filepath'] = prefix + '/' + merged_df['filename']
+        merged_df['channel'] = merged_df['ch_number'].map(lambda a: 'cfse' if a == '1' else 'livedead')
 
-            if row['ch_number'] == '1':
-                input_info['cell_images'][row['cell_id']]["cfse"] = os.path.join(prefix, row['filename'])
-            else:
-                input_info['cell_images'][row['cell_id']]["livedead"] = os.path.join(prefix, row['filename'])
+        cell_images = (
+            merged_df.drop_duplicates(['cell_id', 'channel'], keep='last')
+            .pivot(index='cell_id', columns='channel', values='filepath')
+            .reindex(columns=['cfse', 'livedead']))
 
-        for cell_id in input_info['cell_images'].keys():
-            tif_count = len(input_info['cell_images'][cell_id].keys())
+        tif_counts = cell_images.notnull().sum(axis=1)
+        for cell_id, tif_count in tif_counts[tif_counts != 2].items():
             assert tif_count == 2, f'For cell_id "{cell_id}" expected 2 tifs but got {tif_count}'
 
+        input_info = {'cell_images': {
+            cell_id: {'cfse': cfse, 'livedead': livedead}
+            for cell_id, cfse, livedead in zip(
+                cell_images.index.tolist(),
+                cell_images['cfse'].tolist(),
+                cell_images['livedead'].tolist())}}
+
         with open(inputs_yaml_filename, 'w') as inputs_yaml:
             yaml.safe_dump(input_info, inputs_yaml, default_flow_style=False)
 
@@ -27,22 +27,18 @@ def create_dlp_results(
     metadata = yaml.safe_load(storage_client.open_file(metadata_filename))
 
     # Add all files to tantalus including the metadata.yaml file
-    file_resource_ids = set()
-    for filename in metadata["filenames"] + ['metadata.yaml']:
-        filename = os.path.join(results_dir, filename)
-        filepath = os.path.join(storage_client.prefix, filename)
+    filepaths = [
+        os.path.join(storage_client.prefix, results_dir, filename)
+        for filename in metadata["filenames"] + ['metadata.yaml']]
 
-        if not storage_client.exists(filename) and skip_missing:
-            logging.warning('skipping missing file: {}'.format(filename))
-            continue
-
-        file_resource, _ = tantalus_api.add_file(
-            storage_name=storage_name,
-            filepath=filepath,
-            update=update,
-        )
+    added_files = tantalus_api.add_files(
+        storage_name,
+        filepaths,
+        update=update,
+        skip_missing=skip_missing,
+    )
 
-        file_resource_ids.add(file_resource["id"])
+    file_resource_ids = set(file_resource["id"] for file_resource, _ in added_files.values())
 
     data = {
         'name': name,
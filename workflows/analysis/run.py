@@ -33,7 +33,7 @@ from dbclients.tantalus import TantalusApi
 from dbclients.basicclient import NotFoundError
 
 from workflows.utils import file_utils, log_utils
-from workflows.utils.jira_utils import comment_jira
+from workflows.utils import notifications
 
 
 log = logging.getLogger('sisyphus')
@@ -88,6 +88,10 @@ def main(
     if config_filename is None:
         config_filename = default_config
 
+    # Datasets, samples and libraries are fetched repeatedly while setting up the run
+    tantalus_api.enable_identity_map()
+    tantalus_api.enable_dataset_cache()
+
     analysis = workflows.analysis.base.Analysis.get_by_id(tantalus_api, analysis_id)
 
     if reset_status:
@@ -200,10 +204,10 @@ def main(
                 storages["working_inputs"],
             )
 
-        comment_jira(jira_id, f'finished {analysis_name} analysis')
-
         analysis.set_complete_status()
 
+        notifications.comment_jira(jira_id, f'finished {analysis_name} analysis')
+
         log.info("Done!")
         log.info("------ %s hours ------" % ((time.time() - start) / 60 / 60))
 
@@ -5,10 +5,8 @@ import sys
 import time
 import click
 import logging
-import subprocess
 from itertools import chain
 
-from jira import JIRA
 
 import workflows.launch_pipeline
 import workflows.generate_inputs
@@ -22,7 +20,7 @@ from dbclients.tantalus import TantalusApi
 from dbclients.basicclient import NotFoundError
 
 from workflows.utils import file_utils, log_utils, colossus_utils
-from workflows.utils.jira_utils import update_jira_dlp, add_attachment, comment_jira
+from workflows.utils import jira_utils, notifications
 
 
 log = logging.getLogger('sisyphus')
@@ -80,15 +78,13 @@ def attach_qc_report(jira, library_id, storages):
     library_ticket = analysis["library"]["jira_ticket"]
 
     log.info("Adding report to parent ticket of {}".format(jira))
-    add_attachment(library_ticket, local_path, jira_qc_filename)
+    notifications.add_attachment(library_ticket, local_path, jira_qc_filename)
 
 
 def get_contamination_comment(jira_ticket):
     jira_user = os.environ['JIRA_USERNAME']
-    jira_password = os.environ['JIRA_PASSWORD']
-    jira_api = JIRA('https://www.bcgsc.ca/jira/', basic_auth=(jira_user, jira_password))
 
-    issue = jira_api.issue(jira_ticket)
+    issue = jira_utils.jira_api.issue(jira_ticket)
     library_ticket_id = issue.fields.parent.key
 
     comment = f"""
@@ -102,23 +98,7 @@ def get_contamination_comment(jira_ticket):
     [~{jira_user}]
     """
 
-    comment_jira(library_ticket_id, comment)
-
-
-def load_ticket(jira):
-    log.info(f"Loading {jira} into Montage")
-    try:
-        # TODO: add directory in config
-        subprocess.call([
-            'ssh',
-            '-t',
-            'loader',
-            f"bash /home/uu/montageloader2_flora/load_ticket.sh {jira}",
-        ])
-    except Exception as e:
-        raise Exception(f"failed to load ticket: {e}")
-
-    log.info(f"Successfully loaded {jira} into Montage")
+    notifications.comment_jira(library_ticket_id, comment)
 
 
 def start_automation(
@@ -276,7 +256,7 @@ def start_automation(
     # Update Jira ticket
     analysis_info.set_finish_status(analysis_type)
     if analysis_type == "annotation" and not run_options["is_test_run"]:
-        update_jira_dlp(jira, args['aligner'])
+        notifications.update_jira_dlp(jira, args['aligner'])
         attach_qc_report(jira, args["library_id"], storages)
         analysis_info.set_finish_status()
 
@@ -284,7 +264,7 @@ def start_automation(
     log.info("------ %s hours ------" % ((time.time() - start) / 60 / 60))
 
     if analysis_type == "annotation":
-        load_ticket(jira)
+        notifications.load_ticket(jira)
 
     # TODO: confirm with andrew whether to move this down here
     tantalus_analysis.set_complete_status()
@@ -332,7 +312,7 @@ def main(jira,
          **run_options):
 
     if load_only:
-        load_ticket(jira)
+        notifications.load_montage_ticket(jira)
         return "complete"
 
     if config_filename is None:
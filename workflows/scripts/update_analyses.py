@@ -15,10 +15,20 @@ from datamanagement.utils.constants import LOGGING_FORMAT
 @click.option('--version')
 @click.option('--status')
 def update_analyses(analysis_id, version=None, status=None):
+    """ Update the version and status of analyses.
+
+    Status only updates are applied concurrently and also set last updated
+    to now, as for status changes made by runs.
+    """
     logging.basicConfig(format=LOGGING_FORMAT, level=logging.INFO)
 
     tantalus_api = dbclients.tantalus.TantalusApi()
 
+    if version is None and status is not None:
+        for analysis in tantalus_api.set_analyses_status(analysis_id, status):
+            logging.info(f'updated {analysis["id"]}, {analysis["name"]} with status {status} and last updated {analysis["last_updated"]}')
+        return
+
     for id_ in analysis_id:
         analysis = tantalus_api.get('analysis', id=id_)
         name = analysis['name']
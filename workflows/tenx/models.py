@@ -230,35 +230,39 @@ class Analysis(object):
         """
         Set run status of analysis to running.
         """
-        self.update_status('running')
-        self.update_last_updated()
+        self.set_status('running')
 
     def set_archive_status(self):
         """
         Set run status of analysis to archiving.
         """
-        self.update_status('archiving')
-        self.update_last_updated()
+        self.set_status('archiving')
 
     def set_complete_status(self):
         """
         Set run status of analysis to complete.
         """
-        self.update_status('complete')
-        self.update_last_updated()
+        self.set_status('complete')
 
     def set_error_status(self):
         """
         Set run status to error.
         """
-        self.update_status('error')
-        self.update_last_updated()
+        self.set_status('error')
+
+    def set_status(self, status, last_updated=None):
+        """
+        Update the status and last updated time of the analysis in Tantalus
+        in a single request.
+        """
+        tantalus_api.transition_analysis(self.analysis, status, last_updated=last_updated)
 
     def update_status(self, status):
         """
         Update the run status of the analysis in Tantalus.
         """
-        self.analysis = tantalus_api.update('analysis', id=self.get_id(), status=status)
+        analysis = tantalus_api.update('analysis', id=self.get_id(), status=status)
+        self.analysis['status'] = analysis['status']
 
     def update_last_updated(self, last_updated=None):
         """
@@ -266,7 +270,8 @@ class Analysis(object):
         """
         if last_updated is None:
             last_updated = datetime.datetime.now().isoformat()
-        self.analysis = tantalus_api.update('analysis', id=self.get_id(), last_updated=last_updated)
+        analysis = tantalus_api.update('analysis', id=self.get_id(), last_updated=last_updated)
+        self.analysis['last_updated'] = analysis['last_updated']
 
     def get_id(self):
         return self.analysis['id']
@@ -588,21 +593,18 @@ class TenXResults:
 
         for storage in self.storages:
             storage_client = tantalus_api.get_storage_client(storage)
-            for result_filepath in results_filepaths:
-                if result_filepath.startswith(storage_client.prefix):
-                    result_filename = result_filepath.strip(storage_client.prefix + '/')
 
-                    if not storage_client.exists(result_filename) and skip_missing:
-                        logging.warning('skipping missing file: {}'.format(result_filename))
-                        continue
+            storage_filepaths = [a for a in results_filepaths if a.startswith(storage_client.prefix)]
 
-                    file_resource, file_instance = tantalus_api.add_file(
-                        storage_name=storage,
-                        filepath=result_filepath,
-                        update=update,
-                    )
+            added_files = tantalus_api.add_files(
+                storage,
+                storage_filepaths,
+                update=update,
+                skip_missing=skip_missing,
+            )
 
-                    file_resource_ids.add(file_resource["id"])
+            for file_resource, file_instance in added_files.values():
+                file_resource_ids.add(file_resource["id"])
 
         return list(file_resource_ids)
 
@@ -0,0 +1,288 @@
+""" Outbound notification queue for Jira and Montage.
+
+Notifications are written to a spool directory and sent by a background
+worker with retries, so that slow external services do not block
+analyses.  Each notification, or each ticket's group of joined comments,
+is removed as soon as it is sent and only failures are retried.  Pending
+notifications survive a crash and are sent by the next process using the
+same spool directory, or with the send command of this module.  The spool
+directory defaults to ~/.sisyphus/notifications and can be set with
+SISYPHUS_NOTIFICATION_DIR.
+"""
+
+import atexit
+import collections
+import glob
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import click
+import portalocker
+
+log = logging.getLogger('sisyphus')
+
+DEFAULT_NOTIFICATION_DIR = os.path.join(os.path.expanduser('~'), '.sisyphus', 'notifications')
+
+# Seconds between send attempts of a failing notification, doubled after each failure
+RETRY_INTERVAL = 30
+MAX_RETRY_INTERVAL = 60 * 60
+
+# Seconds to wait for pending notifications at exit
+EXIT_TIMEOUT = 60
+
+
+def _by_notification(notification):
+    return notification['id']
+
+
+def _by_ticket(notification):
+    return notification['args']['jira_id']
+
+
+def _send_jira_comments(notifications):
+    """ Send comments on the same ticket joined into one.
+    """
+    from workflows.utils.jira_utils import comment_jira
+
+    comment_jira(notifications[0]['args']['jira_id'], '\n\n'.join(a['args']['comment'] for a in notifications))
+
+
+def _send_jira_attachments(notifications):
+    from workflows.utils.jira_utils import add_attachment
+
+    for notification in notifications:
+        add_attachment(**notification['args'])
+
+
+def _send_jira_dlp_updates(notifications):
+    from workflows.utils.jira_utils import update_jira_dlp
+
+    for notification in notifications:
+        update_jira_dlp(**notification['args'])
+
+
+def load_montage_ticket(jira_id):
+    """ Load a ticket into Montage immediately.
+    """
+    log.info(f"Loading {jira_id} into Montage")
+    # TODO: add directory in config
+    subprocess.check_call([
+        'ssh',
+        '-t',
+        'loader',
+        f"bash /home/uu/montageloader2_flora/load_ticket.sh {jira_id}",
+    ])
+    log.info(f"Successfully loaded {jira_id} into Montage")
+
+
+def _send_montage_loads(notifications):
+    """ Load a ticket into Montage once for all its load notifications.
+    """
+    load_montage_ticket(notifications[0]['args']['jira_id'])
+
+
+# Notifications of each kind are sent in this order, as groups with the
+# same key that succeed or fail together
+SENDERS = collections.OrderedDict([
+    ('jira_dlp_update', (_by_notification, _send_jira_dlp_updates)),
+    ('jira_attachment', (_by_notification, _send_jira_attachments)),
+    ('jira_comment', (_by_ticket, _send_jira_comments)),
+    ('montage_load', (_by_ticket, _send_montage_loads)),
+])
+
+
+class NotificationQueue(object):
+    """ Disk backed queue of notifications sent by a background worker. """
+
+    def __init__(self, notification_dir=None):
+        if notification_dir is None:
+            notification_dir = os.environ.get('SISYPHUS_NOTIFICATION_DIR', DEFAULT_NOTIFICATION_DIR)
+
+        self.notification_dir = notification_dir
+        os.makedirs(self.notification_dir, exist_ok=True)
+
+        self.lock_filename = os.path.join(self.notification_dir, '.lock')
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.worker = None
+
+    def _write(self, notification):
+        filename = os.path.join(self.notification_dir, notification['id'] + '.json')
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(notification, f)
+        os.rename(filename + '.tmp', filename)
+
+    def _read_pending(self):
+        notifications = []
+        for filename in sorted(glob.glob(os.path.join(self.notification_dir, '*.json'))):
+            try:
+                with open(filename) as f:
+                    notifications.append(json.load(f))
+            except (IOError, ValueError):
+                # Removed by another process, or partially written
+                continue
+        return notifications
+
+    def put(self, kind, **args):
+        """ Add a notification to the queue.
+
+        Args:
+            kind (str): one of the SENDERS kinds
+            args: arguments of the notification, must be json serializable
+        """
+        if kind not in SENDERS:
+            raise ValueError(f'unknown notification kind {kind}')
+
+        notification = {
+            'id': '{:020d}-{}'.format(time.time_ns(), uuid.uuid4().hex[:8]),
+            'kind': kind,
+            'args': args,
+            'attempts': 0,
+            'next_attempt': 0.,
+        }
+
+        self._write(notification)
+        self.start()
+        self.wakeup.set()
+
+    def send_pending(self):
+        """ Send all notifications that are due.
+
+        Returns:
+            number of notifications still pending
+        """
+        try:
+            lock = portalocker.Lock(self.lock_filename, timeout=0, fail_when_locked=True)
+            lock.acquire()
+        except (portalocker.exceptions.LockException, portalocker.exceptions.AlreadyLocked):
+            # Another process is sending
+            return len(self._read_pending())
+
+        try:
+            now = time.time()
+            notifications = self._read_pending()
+
+            due = collections.defaultdict(list)
+            for notification in notifications:
+                if notification['next_attempt'] <= now:
+                    due[notification['kind']].append(notification)
+
+            for kind, (group_key, sender) in SENDERS.items():
+                groups = collections.OrderedDict()
+                for notification in due[kind]:
+                    groups.setdefault(group_key(notification), []).append(notification)
+
+                for group in groups.values():
+                    try:
+                        sender(group)
+
+                    except Exception:
+                        log.exception(f'failed to send {len(group)} {kind} notifications')
+                        for notification in group:
+                            notification['attempts'] += 1
+                            retry_interval = min(RETRY_INTERVAL * 2 ** (notification['attempts'] - 1), MAX_RETRY_INTERVAL)
+                            notification['next_attempt'] = time.time() + retry_interval
+                            self._write(notification)
+
+                    else:
+                        for notification in group:
+                            os.remove(os.path.join(self.notification_dir, notification['id'] + '.json'))
+
+            return len(self._read_pending())
+
+        finally:
+            lock.release()
+
+    def _run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                pending = self.send_pending()
+            except Exception:
+                log.exception('failed to send notifications')
+                pending = 1
+
+            if self.stopping.is_set():
+                return
+
+            # Wait for new notifications, or for failed notifications to be due
+            self.wakeup.wait(RETRY_INTERVAL if pending else None)
+
+    def start(self):
+        """ Start the background worker if it is not running.
+        """
+        if self.worker is not None and self.worker.is_alive():
+            return
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def stop(self, timeout=EXIT_TIMEOUT):
+        """ Attempt to send pending notifications and stop the worker.
+
+        Notifications not sent within timeout remain on disk.
+        """
+        if self.worker is None:
+            return
+
+        self.stopping.set()
+        self.wakeup.set()
+        self.worker.join(timeout)
+
+
+_notification_queue = None
+
+
+def get_notification_queue():
+    """ Get the process wide notification queue, sending pending notifications at exit.
+    """
+    global _notification_queue
+
+    if _notification_queue is None:
+        _notification_queue = NotificationQueue()
+        atexit.register(_notification_queue.stop)
+        _notification_queue.start()
+
+    return _notification_queue
+
+
+def comment_jira(jira_id, comment):
+    get_notification_queue().put('jira_comment', jira_id=jira_id, comment=comment)
+
+
+def add_attachment(jira_id, attachment_file_path, attachment_filename):
+    get_notification_queue().put(
+        'jira_attachment',
+        jira_id=jira_id,
+        attachment_file_path=os.path.abspath(attachment_file_path),
+        attachment_filename=attachment_filename,
+    )
+
+
+def update_jira_dlp(jira_id, aligner):
+    get_notification_queue().put('jira_dlp_update', jira_id=jira_id, aligner=aligner)
+
+
+def load_ticket(jira_id):
+    get_notification_queue().put('montage_load', jira_id=jira_id)
+
+
+@click.command()
+@click.option('--notification_dir')
+def send(notification_dir=None):
+    """ Send pending notifications left by previous runs.
+    """
+    pending = NotificationQueue(notification_dir=notification_dir).send_pending()
+    if pending:
+        raise Exception(f'{pending} notifications still pending')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', stream=sys.stderr, level=logging.INFO)
+    send()
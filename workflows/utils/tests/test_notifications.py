@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import portalocker
+
+from workflows.utils import notifications
+
+
+class TestNotificationQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.notification_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.notification_dir)
+
+        self.queue = notifications.NotificationQueue(notification_dir=self.notification_dir)
+
+        # Send in the test rather than the background worker
+        patcher = mock.patch.object(self.queue, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.sent = []
+        self.failing = set()
+
+        def _sender(kind):
+            def _send(group):
+                self.sent.append((kind, [a['args'] for a in group]))
+                if kind in self.failing:
+                    raise Exception('{} unavailable'.format(kind))
+            return _send
+
+        senders = {}
+        for kind, (group_key, sender) in notifications.SENDERS.items():
+            senders[kind] = (group_key, _sender(kind))
+
+        patcher = mock.patch.dict(notifications.SENDERS, senders)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _pending(self):
+        return sorted(os.listdir(self.notification_dir))
+
+    def test_send(self):
+        self.queue.put('jira_comment', jira_id='SC-1', comment='a')
+        self.queue.put('jira_comment', jira_id='SC-2', comment='b')
+        self.queue.put('jira_comment', jira_id='SC-1', comment='c')
+
+        self.assertEqual(len([a for a in self._pending() if a.endswith('.json')]), 3)
+
+        self.assertEqual(self.queue.send_pending(), 0)
+
+        # Comments are grouped by ticket in the order they were queued
+        self.assertEqual(self.sent, [
+            ('jira_comment', [{'jira_id': 'SC-1', 'comment': 'a'}, {'jira_id': 'SC-1', 'comment': 'c'}]),
+            ('jira_comment', [{'jira_id': 'SC-2', 'comment': 'b'}]),
+        ])
+        self.assertEqual([a for a in self._pending() if a.endswith('.json')], [])
+
+    def test_kind_order(self):
+        self.queue.put('montage_load', jira_id='SC-1')
+        self.queue.put('jira_comment', jira_id='SC-1', comment='a')
+        self.queue.put('jira_dlp_update', jira_id='SC-1', aligner='A')
+
+        self.queue.send_pending()
+
+        self.assertEqual([a[0] for a in self.sent], ['jira_dlp_update', 'jira_comment', 'montage_load'])
+
+    def test_each_notification(self):
+        self.queue.put('jira_dlp_update', jira_id='SC-1', aligner='A')
+        self.queue.put('jira_dlp_update', jira_id='SC-1', aligner='B')
+
+        self.queue.send_pending()
+
+        self.assertEqual(len(self.sent), 2)
+
+    def test_retry(self):
+        self.failing.add('montage_load')
+
+        self.queue.put('jira_comment', jira_id='SC-1', comment='a')
+        self.queue.put('montage_load', jira_id='SC-1')
+
+        start = time.time()
+        self.assertEqual(self.queue.send_pending(), 1)
+
+        # Only the failed notification is kept, and backed off
+        pending = self.queue._read_pending()
+        self.assertEqual([a['kind'] for a in pending], ['montage_load'])
+        self.assertEqual(pending[0]['attempts'], 1)
+        self.assertGreaterEqual(pending[0]['next_attempt'], start + notifications.RETRY_INTERVAL)
+
+        # Not retried until due
+        self.sent = []
+        self.assertEqual(self.queue.send_pending(), 1)
+        self.assertEqual(self.sent, [])
+
+        self.failing.clear()
+        with mock.patch.object(notifications.time, 'time', return_value=pending[0]['next_attempt']):
+            self.assertEqual(self.queue.send_pending(), 0)
+        self.assertEqual(self.sent, [('montage_load', [{'jira_id': 'SC-1'}])])
+
+    def test_retry_interval(self):
+        self.failing.add('jira_comment')
+
+        self.queue.put('jira_comment', jira_id='SC-1', comment='a')
+
+        now = time.time()
+        for attempt in range(1, 10):
+            with mock.patch.object(notifications.time, 'time', return_value=now):
+                self.queue.send_pending()
+
+            notification, = self.queue._read_pending()
+            self.assertEqual(notification['attempts'], attempt)
+
+            interval = min(notifications.RETRY_INTERVAL * 2 ** (attempt - 1), notifications.MAX_RETRY_INTERVAL)
+            self.assertEqual(notification['next_attempt'], now + interval)
+
+            now = notification['next_attempt']
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            self.queue.put('email', address='a')
+
+        self.assertEqual(self._pending(), [])
+
+    def test_locked(self):
+        self.queue.put('jira_comment', jira_id='SC-1', comment='a')
+
+        # Another process is sending
+        with portalocker.Lock(self.queue.lock_filename, timeout=0, fail_when_locked=True):
+            self.assertEqual(self.queue.send_pending(), 1)
+
+        self.assertEqual(self.sent, [])
+
+    def test_pending_from_previous_process(self):
+        self.queue.put('jira_comment', jira_id='SC-1', comment='a')
+
+        queue = notifications.NotificationQueue(notification_dir=self.notification_dir)
+
+        self.assertEqual(queue.send_pending(), 0)
+        self.assertEqual(len(self.sent), 1)
+
+
+class TestNotificationWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.notification_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.notification_dir)
+
+    def test_worker(self):
+        sender = mock.Mock()
+
+        with mock.patch.dict(notifications.SENDERS, {'jira_comment': (notifications._by_ticket, sender)}):
+            queue = notifications.NotificationQueue(notification_dir=self.notification_dir)
+            queue.put('jira_comment', jira_id='SC-1', comment='a')
+            queue.stop(timeout=10)
+
+        self.assertFalse(queue.worker.is_alive())
+        sender.assert_called_once()
+        self.assertEqual(queue._read_pending(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()